@@ -2,7 +2,7 @@ import uuid
 
 from django.contrib import admin
 
-from .models import Asset, AssetClass, Bar, Exchange
+from .models import Asset, AssetClass, Bar, BarWatermark, Exchange
 
 
 class AssetClassAdmin(admin.ModelAdmin):
@@ -50,3 +50,12 @@ admin.site.register(Exchange, ExchangeAdmin)
 admin.site.register(Asset, AssetAdmin)
 admin.site.register(AssetClass, AssetClassAdmin)
 admin.site.register(Bar)
+
+
+class BarWatermarkAdmin(admin.ModelAdmin):
+    list_display = ("asset", "timeframe", "t", "updated_at")
+    list_filter = ("timeframe",)
+    search_fields = ("asset__symbol",)
+
+
+admin.site.register(BarWatermark, BarWatermarkAdmin)
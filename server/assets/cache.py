@@ -0,0 +1,258 @@
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .models import Bar
+
+logger = logging.getLogger(__name__)
+
+# Bar fields, and the fixed width dtype each is stored as
+BAR_COLUMNS = {
+    "t": np.dtype("<i8"),
+    "o": np.dtype("<f8"),
+    "h": np.dtype("<f8"),
+    "l": np.dtype("<f8"),
+    "c": np.dtype("<f8"),
+    "v": np.dtype("<i8"),
+}
+
+# Cache of this process, see `get_bar_cache`
+bar_cache = None
+
+
+class BarCache:
+    """
+    Columnar cache of the stored bars of each asset on local disk.
+
+    Each asset has a directory holding one file of fixed width values per bar
+    field, ordered oldest to newest, and a `meta` file holding the generation,
+    length and id sum of the columns. The id sum is the sum of the ids of the
+    bars cached, which changes whenever a bar is stored, corrected under a new
+    id, or deleted. Columns are memory mapped read only, so loading bars is
+    zero-copy, and maps are reused until the columns change.
+
+    New bars are appended as they are ingested. Bars stored out of order, or
+    updated, invalidate the columns of the asset, which are rebuilt from the
+    database on the next read. Writers hold a lock on the asset, and columns
+    are only ever appended to or replaced, so readers never see them shrink.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory(str): directory the columns are stored in
+        """
+        self.directory = directory
+        self.maps = {}
+
+    def path(self, asset_id, name):
+        return os.path.join(self.directory, str(asset_id), name)
+
+    @contextmanager
+    def lock(self, asset_id):
+        """Hold the write lock of an asset, across processes."""
+        os.makedirs(self.path(asset_id, ""), exist_ok=True)
+        with open(self.path(asset_id, "lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def meta(self, asset_id):
+        """Return a tuple of (generation, length, id sum), or None if not cached."""
+        try:
+            with open(self.path(asset_id, "meta")) as f:
+                generation, length, id_sum = map(int, f.read().split())
+        except (FileNotFoundError, ValueError):
+            return None
+        return generation, length, id_sum
+
+    def write_meta(self, asset_id, generation, length, id_sum):
+        path = self.path(asset_id, "meta")
+        with open(f"{path}.tmp", "w") as f:
+            f.write(f"{generation} {length} {id_sum}")
+        os.replace(f"{path}.tmp", path)
+
+    def read(self, asset_id):
+        """
+        Return the memory mapped columns of an asset.
+
+        :param asset_id(str): id of the asset
+        :returns: dict of read only arrays keyed by bar field, or None if the
+        asset is not cached
+        """
+        asset_id = str(asset_id)
+        meta = self.meta(asset_id)
+        if meta is None:
+            return None
+        cached = self.maps.get(asset_id)
+        if cached is not None and cached[0] == meta:
+            return cached[1]
+
+        length = meta[1]
+        try:
+            columns = {
+                field: (
+                    np.memmap(
+                        self.path(asset_id, field),
+                        dtype=dtype,
+                        mode="r",
+                        shape=(length,),
+                    ).view(np.ndarray)
+                    if length
+                    else np.empty(0, dtype=dtype)
+                )
+                for field, dtype in BAR_COLUMNS.items()
+            }
+        except (FileNotFoundError, ValueError):
+            # Columns are being replaced
+            return None
+        self.maps[asset_id] = (meta, columns)
+        return columns
+
+    def load(self, asset_id, start=None, end=None, stored=None):
+        """
+        Return the bars of an asset, building its columns if not cached.
+
+        Bars stored by another host are not appended to the columns of this
+        one, so the columns are rebuilt if they differ from the stored bars.
+
+        :param asset_id(str): id of the asset
+        :param start(int): Unix epoch of the earliest bar, if any
+        :param end(int): Unix epoch of the latest bar, if any
+        :param stored(tuple): number and id sum of the stored bars of the
+        asset, if known
+        :returns: dict of read only arrays keyed by bar field, ordered oldest
+        to newest, which are views of the memory mapped columns
+        """
+        columns = self.read(asset_id)
+        meta = self.meta(asset_id) if stored is not None else None
+        if columns is not None and meta is not None and meta[1:] != tuple(stored):
+            logger.info(f"Bar cache differs from stored bars of asset: {asset_id}")
+            with self.lock(asset_id):
+                self.invalidate(asset_id)
+            columns = None
+        if columns is None:
+            columns = self.build(asset_id)
+        times = columns["t"]
+        first = 0 if start is None else np.searchsorted(times, start, side="left")
+        last = len(times) if end is None else np.searchsorted(times, end, side="right")
+        return {field: values[first:last] for field, values in columns.items()}
+
+    def build(self, asset_id):
+        """Build the columns of an asset from its stored bars."""
+        with self.lock(asset_id):
+            # Columns may have been built while waiting for the lock
+            columns = self.read(asset_id)
+            if columns is not None:
+                return columns
+            rows = list(
+                Bar.objects.filter(asset_id=asset_id)
+                .order_by("t")
+                .values_list("id", *BAR_COLUMNS)
+            )
+            values = np.array(rows, dtype=float).reshape(-1, len(BAR_COLUMNS) + 1)
+            self.write(
+                asset_id,
+                {
+                    field: values[:, column]
+                    for column, field in enumerate(BAR_COLUMNS, start=1)
+                },
+                sum(row[0] for row in rows),
+            )
+        logger.info(f"Built bar cache for asset: {asset_id}")
+        return self.read(asset_id)
+
+    def write(self, asset_id, columns, id_sum):
+        """
+        Replace the columns of an asset. The caller holds the asset's lock.
+
+        :param asset_id(str): id of the asset
+        :param columns(dict): arrays keyed by bar field, ordered oldest to newest
+        :param id_sum(int): sum of the ids of the bars
+        """
+        self.invalidate(asset_id)
+        for field, dtype in BAR_COLUMNS.items():
+            path = self.path(asset_id, field)
+            np.asarray(columns[field]).astype(dtype).tofile(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        # Unique to these files, so maps of replaced files are never reused
+        self.write_meta(asset_id, time.time_ns(), len(columns["t"]), id_sum)
+
+    def append(self, asset_id, columns, id_sum):
+        """
+        Append bars newer than the cached bars of an asset.
+
+        Assets which are not cached are left to be built on their next read,
+        and the columns are invalidated if any bar is not newer than the bars
+        cached.
+
+        :param asset_id(str): id of the asset
+        :param columns(dict): arrays keyed by bar field, ordered oldest to newest
+        :param id_sum(int): sum of the ids of the bars
+        """
+        times = np.asarray(columns["t"])
+        if not len(times):
+            return
+        with self.lock(asset_id):
+            cached = self.read(asset_id)
+            if cached is None:
+                return
+            generation, length, cached_sum = self.meta(asset_id)
+            if np.any(np.diff(times) <= 0) or (length and times[0] <= cached["t"][-1]):
+                self.invalidate(asset_id)
+                return
+            for field, dtype in BAR_COLUMNS.items():
+                with open(self.path(asset_id, field), "r+b") as f:
+                    # Drop anything written by an append which did not finish
+                    f.seek(length * dtype.itemsize)
+                    f.truncate()
+                    f.write(np.asarray(columns[field]).astype(dtype).tobytes())
+            self.write_meta(
+                asset_id, generation, length + len(times), cached_sum + id_sum
+            )
+
+    def invalidate(self, asset_id):
+        """Drop the columns of an asset, so they are rebuilt on the next read."""
+        try:
+            os.remove(self.path(asset_id, "meta"))
+        except FileNotFoundError:
+            pass
+
+
+def stored_extent(extents, asset_id):
+    """
+    Return the number and id sum of the stored bars of an asset.
+
+    :param extents(dict): extents returned from `BarQuerySet.extents`
+    :param asset_id(str): id of the asset
+    """
+    _, count, id_sum = extents.get(str(asset_id), (0, 0, 0))
+    return count, id_sum
+
+
+def get_bar_cache():
+    """Return the bar cache of this process, or None if `BAR_CACHE_DIR` is unset."""
+    global bar_cache
+    directory = settings.BAR_CACHE_DIR
+    if not directory:
+        return None
+    if bar_cache is None or bar_cache.directory != directory:
+        bar_cache = BarCache(directory)
+    return bar_cache
+
+
+def invalidate_bars(asset_ids):
+    """
+    Invalidate the cached bars of assets whose bars are written other than by
+    `ingest_bars`.
+
+    :param asset_ids(iterable): ids of the assets
+    """
+    cache = get_bar_cache()
+    if cache is None:
+        return
+    for asset_id in asset_ids:
+        cache.invalidate(asset_id)
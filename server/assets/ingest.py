@@ -0,0 +1,176 @@
+import io
+import logging
+from itertools import groupby
+
+import numpy as np
+from alpaca_trade_api.entity import Entity
+from django.db import connections, transaction
+
+from .cache import BAR_COLUMNS, get_bar_cache
+from .models import Asset, Bar, BarWatermark
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = "assets_bar_staging"
+
+
+def bars_to_columns(bars):
+    """
+    Convert the bars of one asset to columnar arrays.
+
+    :param bars(list): Alpaca bars, or raw bar dicts
+    :returns: dict of numpy arrays keyed by bar field
+    """
+    raw_bars = [
+        bar.__dict__["_raw"] if isinstance(bar, Entity) else bar for bar in bars
+    ]
+    return {
+        field: np.fromiter(
+            (raw[field] for raw in raw_bars), dtype=dtype, count=len(raw_bars)
+        )
+        for field, dtype in BAR_COLUMNS.items()
+    }
+
+
+def copy_rows(asset_id, columns):
+    """
+    Format the columns of one asset as rows of the `COPY` text format.
+
+    :param asset_id(UUID): asset the bars belong to
+    :param columns(dict): columnar bars from `bars_to_columns`
+    """
+    return "".join(
+        f"{asset_id}\t{t}\t{o!r}\t{h!r}\t{l!r}\t{c!r}\t{v}\n"
+        for t, o, h, l, c, v in zip(*(columns[field].tolist() for field in BAR_COLUMNS))
+    )
+
+
+def ingest_bars(assets_bars, timeframe=None, using="default"):
+    """
+    Upsert bars fetched from Alpaca in bulk.
+
+    Each response is converted to columnar arrays once, and written with
+    `ingest_columns`.
+
+    :param assets_bars(dict): bars keyed by asset symbol
+    :param timeframe(str): timeframe of the bars, watermarks are not updated
+    if not given
+    :param using(str): database alias written to
+    :returns: number of bars inserted or updated
+    """
+    return ingest_columns(
+        {symbol: bars_to_columns(bars) for symbol, bars in assets_bars.items() if bars},
+        timeframe,
+        using,
+    )
+
+
+def ingest_columns(assets_columns, timeframe=None, using="default"):
+    """
+    Upsert columnar bars in bulk.
+
+    Symbols are resolved with one query. Bars are copied into a temporary
+    staging table with `COPY`, and upserted into the bar table with one
+    `INSERT ... ON CONFLICT (asset_id, t) DO UPDATE`. Bars which exist with
+    the same values are left untouched, so stored bars keep their ids, while
+    updated bars are given a new id, so readers tracking the highest id read
+    see corrected bars as new. The watermark of each asset in the timeframe
+    is raised to its latest bar in the same transaction. Bars written are
+    appended to the bar cache, if enabled, once the transaction commits.
+
+    :param assets_columns(dict): columnar bars, as from `bars_to_columns`,
+    keyed by asset symbol
+    :param timeframe(str): timeframe of the bars, watermarks are not updated
+    if not given
+    :param using(str): database alias written to
+    :returns: number of bars inserted or updated
+    """
+    assets_columns = {
+        symbol: columns
+        for symbol, columns in assets_columns.items()
+        if len(columns["t"])
+    }
+    if not assets_columns:
+        return 0
+
+    asset_ids = dict(
+        Asset.objects.using(using)
+        .filter(symbol__in=list(assets_columns))
+        .values_list("symbol", "id")
+    )
+    unknown = set(assets_columns) - set(asset_ids)
+    if unknown:
+        logger.info(f"Bars for unknown symbols skipped: {sorted(unknown)}")
+
+    buffer = io.StringIO()
+    for symbol, asset_id in asset_ids.items():
+        buffer.write(copy_rows(asset_id, assets_columns[symbol]))
+    if not buffer.tell():
+        return 0
+    buffer.seek(0)
+
+    connection = connections[using]
+    table = Bar._meta.db_table
+    fields = [Bar._meta.get_field(name) for name in ("asset", *BAR_COLUMNS)]
+    columns = ", ".join(field.column for field in fields)
+    definitions = ", ".join(
+        f"{field.column} {field.db_type(connection)}" for field in fields
+    )
+    values = [field.column for field in fields if field.column not in ("asset_id", "t")]
+    updates = ", ".join(f"{value} = EXCLUDED.{value}" for value in values)
+    stored = ", ".join(f"{table}.{value}" for value in values)
+    excluded = ", ".join(f"EXCLUDED.{value}" for value in values)
+    cache = get_bar_cache()
+    returning = f" RETURNING id, {columns}" if cache is not None else ""
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {STAGING_TABLE} ({definitions}) ON COMMIT DROP"
+        )
+        cursor.copy_expert(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN", buffer)
+        # Duplicate bars in a response would update the same row twice
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) "
+            f"SELECT DISTINCT ON (asset_id, t) {columns} FROM {STAGING_TABLE} "
+            "ORDER BY asset_id, t "
+            f"ON CONFLICT (asset_id, t) DO UPDATE SET {updates}, id = DEFAULT "
+            f"WHERE ({stored}) IS DISTINCT FROM ({excluded})" + returning
+        )
+        ingested = cursor.rowcount
+        if cache is not None:
+            rows = cursor.fetchall()
+            transaction.on_commit(lambda: cache_rows(cache, rows), using=using)
+        if timeframe:
+            watermarks = BarWatermark._meta.db_table
+            cursor.execute(
+                f"INSERT INTO {watermarks} (asset_id, timeframe, t, updated_at) "
+                f"SELECT asset_id, %s, MAX(t), NOW() FROM {STAGING_TABLE} "
+                "GROUP BY asset_id "
+                "ON CONFLICT (asset_id, timeframe) DO UPDATE "
+                "SET t = EXCLUDED.t, updated_at = EXCLUDED.updated_at "
+                f"WHERE {watermarks}.t < EXCLUDED.t",
+                (timeframe,),
+            )
+        # Dropped now, as callers may already be in a transaction
+        cursor.execute(f"DROP TABLE {STAGING_TABLE}")
+
+    logger.info(f"Bars ingested: {ingested}")
+    return ingested
+
+
+def cache_rows(cache, rows):
+    """
+    Append rows written to the bar table to the bar cache.
+
+    :param cache(BarCache): bar cache
+    :param rows(list): tuples of id, asset id and each bar field
+    """
+    rows.sort(key=lambda row: (str(row[1]), row[2]))
+    for asset_id, asset_rows in groupby(rows, key=lambda row: row[1]):
+        asset_rows = list(asset_rows)
+        values = np.array([row[2:] for row in asset_rows], dtype=float)
+        cache.append(
+            asset_id,
+            {field: values[:, column] for column, field in enumerate(BAR_COLUMNS)},
+            sum(row[0] for row in asset_rows),
+        )
@@ -0,0 +1,44 @@
+from assets.parquet import export_bars
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Export stored bars to Parquet files partitioned by symbol and month."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Root directory of the partitions.")
+        parser.add_argument(
+            "--symbols",
+            nargs="+",
+            default=None,
+            help="Symbols to export. Defaults to every symbol.",
+        )
+        parser.add_argument(
+            "--start",
+            type=int,
+            default=None,
+            help="Unix epoch of the earliest bar exported.",
+        )
+        parser.add_argument(
+            "--end",
+            type=int,
+            default=None,
+            help="Unix epoch of the latest bar exported.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of bars held in memory at once.",
+        )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f"Exporting bars to {kwargs['directory']}...")
+        exported = export_bars(
+            kwargs["directory"],
+            symbols=kwargs["symbols"],
+            start=kwargs["start"],
+            end=kwargs["end"],
+            batch_size=kwargs["batch_size"],
+        )
+        self.stdout.write(f"Exported {exported} bars")
@@ -0,0 +1,37 @@
+from assets.parquet import import_bars
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Import bars from Parquet files partitioned by symbol and month."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Root directory of the partitions.")
+        parser.add_argument(
+            "--symbols",
+            nargs="+",
+            default=None,
+            help="Symbols to import. Defaults to every symbol.",
+        )
+        parser.add_argument(
+            "--timeframe",
+            default=settings.BAR_BASE_TIMEFRAME,
+            help="Timeframe of the bars. Defaults to the stored bar timeframe.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of bars held in memory at once.",
+        )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f"Importing bars from {kwargs['directory']}...")
+        imported = import_bars(
+            kwargs["directory"],
+            symbols=kwargs["symbols"],
+            timeframe=kwargs["timeframe"],
+            batch_size=kwargs["batch_size"],
+        )
+        self.stdout.write(f"Imported {imported} bars")
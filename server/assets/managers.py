@@ -1,4 +1,6 @@
-from django.db.models import QuerySet
+from django.db import connections
+from django.db.models import Count, F, Max, QuerySet, Sum, Window
+from django.db.models.functions import RowNumber
 
 
 class BarQuerySet(QuerySet):
@@ -7,3 +9,50 @@ class BarQuerySet(QuerySet):
     def visible(self, asset_id):
         """Return visible bars for the given asset."""
         return self.filter(asset__pk=asset_id)
+
+    def latest_per_asset(self, length, *fields):
+        """
+        Return value rows of the latest `length` bars of each asset.
+
+        Rows are ordered by asset, and then oldest to newest. Executes a single
+        query using a `ROW_NUMBER` window partitioned by asset.
+
+        :param length(int): maximum number of bars returned per asset
+        :param fields(str): bar fields returned in each row
+        """
+        latest_bars = (
+            self.annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=F("asset_id"),
+                    order_by=F("t").desc(),
+                )
+            )
+            .order_by()
+            .values(*dict.fromkeys(("asset_id", "t", *fields)), "row_number")
+        )
+        columns = ", ".join(fields)
+        sql, params = latest_bars.query.sql_with_params()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"SELECT {columns} FROM ({sql}) AS latest_bars "
+                "WHERE row_number <= %s ORDER BY asset_id, t",
+                (*params, length),
+            )
+            return cursor.fetchall()
+
+    def extents(self):
+        """
+        Return a dict of asset id to a tuple of (highest id, number, id sum)
+        of its bars.
+
+        Bars backfilled into the history may have a higher id than newer bars,
+        so the highest id is not that of the latest bar.
+        """
+        return {
+            str(asset_id): (last_id, count, id_sum)
+            for asset_id, last_id, count, id_sum in self.order_by()
+            .values("asset_id")
+            .annotate(last_id=Max("id"), count=Count("id"), id_sum=Sum("id"))
+            .values_list("asset_id", "last_id", "count", "id_sum")
+        }
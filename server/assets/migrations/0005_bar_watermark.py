@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assets", "0004_bars_unique_together"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BarWatermark",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "timeframe",
+                    models.CharField(max_length=128, verbose_name="timeframe"),
+                ),
+                (
+                    "t",
+                    models.PositiveIntegerField(
+                        help_text="the beginning time of the latest stored bar as a Unix epoch",
+                        verbose_name="time",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="updated at"),
+                ),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bar_watermarks",
+                        to="assets.asset",
+                        verbose_name="asset",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "bar watermark",
+                "verbose_name_plural": "bar watermarks",
+                "unique_together": {("asset", "timeframe")},
+            },
+        ),
+    ]
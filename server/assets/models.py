@@ -148,3 +148,28 @@ class Bar(models.Model):
 
     def __str__(self):
         return f"{self.asset.symbol} Bar - {self.t}"
+
+
+class BarWatermark(models.Model):
+    """Time of the latest stored bar of an asset, for each timeframe fetched."""
+
+    asset = models.ForeignKey(
+        Asset,
+        verbose_name=_("asset"),
+        related_name="bar_watermarks",
+        on_delete=models.CASCADE,
+    )
+    timeframe = models.CharField(verbose_name=_("timeframe"), max_length=128)
+    t = models.PositiveIntegerField(
+        verbose_name=_("time"),
+        help_text=_("the beginning time of the latest stored bar as a Unix epoch"),
+    )
+    updated_at = models.DateTimeField(verbose_name=_("updated at"), auto_now=True)
+
+    class Meta:
+        unique_together = ("asset", "timeframe")
+        verbose_name = _("bar watermark")
+        verbose_name_plural = _("bar watermarks")
+
+    def __str__(self):
+        return f"{self.asset.symbol} {self.timeframe} - {self.t}"
@@ -0,0 +1,142 @@
+import logging
+import os
+from itertools import islice
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .cache import BAR_COLUMNS
+from .ingest import ingest_columns
+from .models import Bar
+
+logger = logging.getLogger(__name__)
+
+# Rows held in memory at once when exporting or importing
+PARQUET_BATCH_SIZE = 100000
+
+BAR_SCHEMA = pa.schema(
+    [(field, pa.from_numpy_dtype(dtype)) for field, dtype in BAR_COLUMNS.items()]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("symbol", pa.string()), ("month", pa.string())]), flavor="hive"
+)
+
+
+def partition_path(directory, symbol, month):
+    """Return the file of the bars of a symbol in a month, e.g. 2021-11."""
+    return os.path.join(directory, f"symbol={symbol}", f"month={month}", "bars.parquet")
+
+
+def export_bars(directory, symbols=None, start=None, end=None, batch_size=None):
+    """
+    Export stored bars to Parquet files partitioned by symbol and month.
+
+    Bars are streamed from a server side cursor ordered by symbol and time,
+    so each partition is written once, in row groups of up to `batch_size`
+    bars, and at most one batch is held in memory. Existing partitions are
+    replaced.
+
+    :param directory(str): root directory of the partitions
+    :param symbols(list): symbols to export, defaults to all
+    :param start(int): Unix epoch of the earliest bar, if any
+    :param end(int): Unix epoch of the latest bar, if any
+    :param batch_size(int): number of bars read and written at once
+    :returns: number of bars exported
+    """
+    batch_size = batch_size or PARQUET_BATCH_SIZE
+    bars = Bar.objects.all()
+    if symbols:
+        bars = bars.filter(asset__symbol__in=symbols)
+    if start is not None:
+        bars = bars.filter(t__gte=start)
+    if end is not None:
+        bars = bars.filter(t__lte=end)
+    rows = (
+        bars.order_by("asset__symbol", "t")
+        .values_list("asset__symbol", *BAR_COLUMNS)
+        .iterator(chunk_size=batch_size)
+    )
+
+    exported = 0
+    partition = writer = None
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            exported += len(batch)
+            batch_symbols = [row[0] for row in batch]
+            values = np.array([row[1:] for row in batch], dtype=float)
+            months = (
+                values[:, 0].astype("datetime64[s]").astype("datetime64[M]").astype(str)
+            )
+            # Rows are ordered, so each partition is a contiguous run
+            keys = list(zip(batch_symbols, months))
+            breaks = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]]
+            for first, last in zip(breaks, breaks[1:] + [len(keys)]):
+                if keys[first] != partition:
+                    if writer is not None:
+                        writer.close()
+                    partition = keys[first]
+                    path = partition_path(directory, *partition)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = pq.ParquetWriter(path, BAR_SCHEMA)
+                writer.write_table(
+                    pa.table(
+                        {
+                            field: values[first:last, column].astype(dtype)
+                            for column, (field, dtype) in enumerate(BAR_COLUMNS.items())
+                        },
+                        schema=BAR_SCHEMA,
+                    )
+                )
+    finally:
+        if writer is not None:
+            writer.close()
+
+    logger.info(f"Bars exported: {exported}")
+    return exported
+
+
+def import_bars(directory, symbols=None, timeframe=None, batch_size=None):
+    """
+    Import bars from Parquet files partitioned by symbol and month.
+
+    Partitions are read in batches of up to `batch_size` bars, and each batch
+    is upserted with `ingest_columns`, so at most one batch is held in memory.
+
+    :param directory(str): root directory of the partitions
+    :param symbols(list): symbols to import, defaults to all
+    :param timeframe(str): timeframe of the bars, to update watermarks
+    :param batch_size(int): number of bars read and written at once
+    :returns: number of bars inserted or updated
+    """
+    dataset = ds.dataset(directory, format="parquet", partitioning=PARTITIONING)
+    expression = ds.field("symbol").isin(symbols) if symbols else None
+
+    imported = 0
+    for batch in dataset.to_batches(
+        columns=["symbol", *BAR_COLUMNS],
+        filter=expression,
+        batch_size=batch_size or PARQUET_BATCH_SIZE,
+    ):
+        batch_symbols = batch.column("symbol").to_numpy(zero_copy_only=False)
+        columns = {
+            field: batch.column(field).to_numpy().astype(dtype)
+            for field, dtype in BAR_COLUMNS.items()
+        }
+        imported += ingest_columns(
+            {
+                symbol: {
+                    field: values[batch_symbols == symbol]
+                    for field, values in columns.items()
+                }
+                for symbol in np.unique(batch_symbols)
+            },
+            timeframe,
+        )
+
+    logger.info(f"Bars imported: {imported}")
+    return imported
@@ -1,15 +1,28 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
+import pytz
 from alpaca_trade_api.entity import Asset as AlpacaAsset
 from config import celery_app
 from core.alpaca import TradeApiRest
-from django.db.utils import IntegrityError
+from core.trading_calendar import completed_bar_times
+from django.conf import settings
+from django.utils import timezone
 
-from .models import Asset, AssetClass, Exchange
-from .serializers import AssetSerializer, BarSerializer
+from .ingest import ingest_bars
+from .models import Asset, AssetClass, BarWatermark, Exchange
+from .parquet import export_bars, import_bars
+from .serializers import AssetSerializer
 
 logger = logging.getLogger(__name__)
 
+# Maximum symbols accepted by a single bars request
+MAX_SYMBOLS_PER_REQUEST = 200
+# Maximum bars per symbol returned by a single bars request
+MAX_BARS_PER_REQUEST = 1000
+MAX_BAR_REQUEST_WORKERS = 4
+
 
 def update_assets(assets=None):
     """
@@ -95,10 +108,130 @@ def get_quotes(symbols):
 
 @celery_app.task(ignore_result=True)
 def update_bars(
-    symbols, timeframe, limit=None, start=None, end=None, after=None, until=None
+    symbols,
+    timeframe,
+    limit=None,
+    start=None,
+    end=None,
+    after=None,
+    until=None,
+    now=None,
 ):
     """Fetch bar data for list of symbols.
 
+    Without an interval, only bars after the watermark of each symbol are
+    fetched, with the limit sized to the completed bars since. Symbols with
+    the same watermark are fetched together, and symbols without a watermark
+    are fetched with the given limit.
+
+    :param symbols(list | string): must either be a list or comma separated
+    string of maximum 200 symbols.
+    :param now(datetime): current time, defaults to now
+    """
+    if any((start, end, after, until)):
+        assets_bars = fetch_bars(symbols, timeframe, limit, start, end, after, until)
+    else:
+        assets_bars = {}
+        for (after, limit), chunk in bar_update_requests(
+            symbols, timeframe, limit, now
+        ).items():
+            assets_bars.update(fetch_bars(chunk, timeframe, limit, after=after))
+    save_bars(assets_bars, timeframe)
+    return assets_bars
+
+
+def bar_update_requests(symbols, timeframe, limit=None, now=None):
+    """
+    Group symbols into requests for the bars after their watermark.
+
+    :param symbols(list | string): list or comma separated string of symbols
+    :param timeframe(str): timeframe of the bars, e.g. 15Min
+    :param limit(int): maximum bars per symbol, and the limit of symbols
+    without a watermark
+    :param now(datetime): current time, defaults to now
+    :returns: dict of (after, limit) to list of symbols, where after is None
+    for symbols without a watermark. Symbols without new bars are left out.
+    """
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+    now = now or timezone.now()
+    watermarks = dict(
+        BarWatermark.objects.filter(
+            asset__symbol__in=symbols, timeframe=timeframe
+        ).values_list("asset__symbol", "t")
+    )
+
+    gaps = {}
+    requests = {}
+    for symbol in symbols:
+        t = watermarks.get(symbol)
+        if t is None:
+            requests.setdefault((None, limit), []).append(symbol)
+            continue
+        if t not in gaps:
+            gaps[t] = len(completed_bar_times(t + 1, now, timeframe))
+        if not gaps[t]:
+            continue
+        after = datetime.fromtimestamp(t, pytz.utc).isoformat()
+        gap = min(gaps[t], limit or MAX_BARS_PER_REQUEST, MAX_BARS_PER_REQUEST)
+        requests.setdefault((after, gap), []).append(symbol)
+    return requests
+
+
+@celery_app.task(ignore_result=True)
+def refresh_bars(
+    symbols,
+    timeframe,
+    limit=None,
+    start=None,
+    end=None,
+    after=None,
+    until=None,
+    max_workers=MAX_BAR_REQUEST_WORKERS,
+):
+    """
+    Fetch bar data for any number of symbols.
+
+    Symbols are de-duplicated and split into chunks of the maximum symbols
+    allowed per request, and the chunks are fetched concurrently. Bars are
+    saved once every chunk has been fetched.
+
+    :param symbols(list): symbols to fetch bars for
+    :param max_workers(int): maximum number of concurrent requests
+    """
+    symbols = sorted(set(symbols))
+    chunks = [
+        symbols[i : i + MAX_SYMBOLS_PER_REQUEST]
+        for i in range(0, len(symbols), MAX_SYMBOLS_PER_REQUEST)
+    ]
+    if not chunks:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        responses = list(
+            executor.map(
+                lambda chunk: fetch_bars(
+                    chunk, timeframe, limit, start, end, after, until
+                ),
+                chunks,
+            )
+        )
+
+    assets_bars = {}
+    for response in responses:
+        assets_bars.update(response)
+    save_bars(assets_bars, timeframe)
+
+    logger.info(f"Refreshed bars for symbols: {len(symbols)}")
+    return assets_bars
+
+
+def fetch_bars(
+    symbols, timeframe, limit=None, start=None, end=None, after=None, until=None
+):
+    """
+    Fetch bar data for list of symbols from Alpaca, without saving.
+
     :param symbols(list | string): must either be a list or comma separated
     string of maximum 200 symbols.
     """
@@ -109,22 +242,47 @@ def update_bars(
             symbols = ",".join(symbols)
 
     api = TradeApiRest()
-    assets_bars = []
+    assets_bars = {}
     try:
         assets_bars = api.get_bars(symbols, timeframe, limit, start, end, after, until)
     except Exception as e:
         logger.error(f"Errors fetching bars: {e}")
 
-    for asset_symbol in assets_bars:
-        for bar in assets_bars[asset_symbol]:
-            bar = bar.__dict__["_raw"]
-            bar["asset"] = asset_symbol
-            serializer = BarSerializer(data=bar)
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                except IntegrityError:
-                    # Fail silently when data already exists
-                    pass
-
     return assets_bars
+
+
+def save_bars(assets_bars, timeframe=None):
+    """
+    Save bars fetched from Alpaca, updating bars which already exist.
+
+    :param assets_bars(dict): bars keyed by asset symbol
+    :param timeframe(str): timeframe of the bars, to update watermarks
+    :returns: number of bars inserted or updated
+    """
+    return ingest_bars(assets_bars, timeframe)
+
+
+@celery_app.task(ignore_result=True)
+def export_bar_history(directory, symbols=None, start=None, end=None):
+    """
+    Export stored bars to Parquet files partitioned by symbol and month.
+
+    :param directory(str): root directory of the partitions
+    :param symbols(list): symbols to export, defaults to all
+    :param start(int): Unix epoch of the earliest bar, if any
+    :param end(int): Unix epoch of the latest bar, if any
+    """
+    return export_bars(directory, symbols, start, end)
+
+
+@celery_app.task(ignore_result=True)
+def import_bar_history(directory, symbols=None, timeframe=None):
+    """
+    Import bars from Parquet files partitioned by symbol and month.
+
+    :param directory(str): root directory of the partitions
+    :param symbols(list): symbols to import, defaults to all
+    :param timeframe(str): timeframe of the bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    """
+    return import_bars(directory, symbols, timeframe or settings.BAR_BASE_TIMEFRAME)
@@ -0,0 +1,114 @@
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+from alpaca_trade_api.entity import Bar as AlpacaBar
+from assets.cache import get_bar_cache, stored_extent
+from assets.ingest import ingest_bars
+from assets.models import Bar
+from assets.tests.factories import AssetFactory, BarFactory
+from core.backtest import load_bars
+from django.test import TestCase, override_settings
+
+
+def run_on_commit():
+    """Run callbacks on commit at once, as tests never commit."""
+    return patch(
+        "assets.ingest.transaction.on_commit",
+        side_effect=lambda func, using=None: func(),
+    )
+
+
+def alpaca_bar(t, c):
+    return AlpacaBar({"t": t, "o": c, "h": c + 1, "l": c - 1, "c": c, "v": 100})
+
+
+class BarCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(BAR_CACHE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.cache = get_bar_cache()
+        self.asset = AssetFactory(symbol="TSLA")
+        for t in (60, 120, 180):
+            BarFactory(asset=self.asset, t=t, c=t / 10)
+
+    def stored(self):
+        return stored_extent(
+            Bar.objects.filter(asset=self.asset).extents(), self.asset.pk
+        )
+
+    def test_load(self):
+        """Columns are built once, and then read without queries."""
+        with self.assertNumQueries(1):
+            bars = self.cache.load(self.asset.pk)
+        with self.assertNumQueries(0):
+            cached = self.cache.load(self.asset.pk, start=100, end=180)
+
+        np.testing.assert_array_equal(bars["t"], [60, 120, 180])
+        np.testing.assert_array_equal(bars["c"], [6, 12, 18])
+        self.assertEqual(bars["t"].dtype, np.int64)
+        np.testing.assert_array_equal(cached["t"], [120, 180])
+        # Slices are read only views of the memory mapped columns
+        self.assertTrue(np.shares_memory(cached["c"], bars["c"]))
+        self.assertFalse(cached["c"].flags.writeable)
+
+        with self.assertNumQueries(1):
+            # Unknown assets are cached as empty columns
+            self.assertEqual(len(self.cache.load(AssetFactory.build().pk)["t"]), 0)
+
+    def test_ingest(self):
+        """Ingested bars are appended, and updated bars rebuild the columns."""
+        self.cache.load(self.asset.pk)
+
+        with run_on_commit():
+            ingest_bars({"TSLA": [alpaca_bar(240, 24), alpaca_bar(300, 30)]})
+        stored = self.stored()
+        with self.assertNumQueries(0):
+            # Appended bars keep the columns in line with the stored bars
+            bars = self.cache.load(self.asset.pk, stored=stored)
+        np.testing.assert_array_equal(bars["t"], [60, 120, 180, 240, 300])
+        np.testing.assert_array_equal(bars["v"][-2:], [100, 100])
+
+        with run_on_commit():
+            ingest_bars({"TSLA": [alpaca_bar(120, 50)]})
+        with self.assertNumQueries(1):
+            bars = self.cache.load(self.asset.pk)
+        np.testing.assert_array_equal(bars["c"], [6, 50, 18, 24, 30])
+
+    def test_load_stored(self):
+        """Columns which differ from the stored bars are rebuilt."""
+        self.cache.load(self.asset.pk)
+        stored = self.stored()
+        with self.assertNumQueries(0):
+            self.cache.load(self.asset.pk, stored=stored)
+
+        # Stored by another host, so not appended to this cache
+        BarFactory(asset=self.asset, t=240, c=24)
+        stored = self.stored()
+        with self.assertNumQueries(1):
+            bars = self.cache.load(self.asset.pk, stored=stored)
+        np.testing.assert_array_equal(bars["t"], [60, 120, 180, 240])
+
+        # Corrected by another host
+        ingest_bars({"TSLA": [alpaca_bar(120, 50)]})
+        stored = self.stored()
+        with self.assertNumQueries(1):
+            bars = self.cache.load(self.asset.pk, stored=stored)
+        np.testing.assert_array_equal(bars["c"], [6, 50, 18, 24])
+        stored = self.stored()
+        with self.assertNumQueries(0):
+            self.cache.load(self.asset.pk, stored=stored)
+
+    def test_read_paths(self):
+        """Backtests read bars from the cache."""
+        load_bars(self.asset.pk)
+
+        with self.assertNumQueries(0):
+            bars = load_bars(self.asset.pk, start=120)
+
+        self.assertEqual(set(bars), {"t", "o", "h", "l", "c"})
+        np.testing.assert_array_equal(bars["t"], [120, 180])
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+from alpaca_trade_api.entity import Bar as AlpacaBar
+from assets.ingest import bars_to_columns, ingest_bars
+from assets.models import Bar
+from assets.tests.factories import AssetFactory
+from django.test import TestCase
+
+
+def alpaca_bar(t, c, v=1000):
+    return AlpacaBar({"t": t, "o": c - 1, "h": c + 1, "l": c - 2, "c": c, "v": v})
+
+
+class IngestBarsTests(TestCase):
+    def setUp(self):
+        self.tesla = AssetFactory(symbol="TSLA")
+        self.apple = AssetFactory(symbol="AAPL")
+
+    def test_bars_to_columns(self):
+        """Bars are converted to one array per field."""
+        columns = bars_to_columns(
+            [alpaca_bar(60, 700.5), {**alpaca_bar(120, 701)._raw}]
+        )
+
+        self.assertEqual(columns["t"].tolist(), [60, 120])
+        self.assertEqual(columns["c"].tolist(), [700.5, 701])
+        self.assertEqual(columns["v"].dtype.kind, "i")
+
+    def test_ingest_bars(self):
+        """Bars of every symbol are saved with a fixed number of queries."""
+        assets_bars = {
+            "TSLA": [alpaca_bar(60 * i, 700 + i) for i in range(500)],
+            "AAPL": [alpaca_bar(60 * i, 120.12345 + i) for i in range(500)],
+            "MSFT": [alpaca_bar(60, 300)],
+        }
+
+        with self.assertNumQueries(7):
+            # Symbols are resolved with one query, and unknown symbols skipped
+            self.assertEqual(ingest_bars(assets_bars), 1000)
+
+        self.assertEqual(Bar.objects.filter(asset=self.tesla).count(), 500)
+        bar = Bar.objects.get(asset=self.apple, t=60)
+        self.assertEqual(bar.c, Decimal("121.12345"))
+        self.assertEqual(bar.v, 1000)
+
+    def test_ingest_bars_upsert(self):
+        """Existing bars are updated under a new id, and unchanged bars left alone."""
+        ingest_bars({"TSLA": [alpaca_bar(60, 700), alpaca_bar(120, 701)]})
+        stored = dict(Bar.objects.values_list("t", "id"))
+
+        ingested = ingest_bars(
+            {
+                "TSLA": [
+                    alpaca_bar(60, 700),
+                    alpaca_bar(120, 705, v=2000),
+                    alpaca_bar(180, 702),
+                    alpaca_bar(180, 702),
+                ]
+            }
+        )
+
+        self.assertEqual(ingested, 2)
+        self.assertEqual(Bar.objects.count(), 3)
+        bar = Bar.objects.get(t=120)
+        self.assertGreater(bar.id, max(stored.values()))
+        self.assertEqual(Bar.objects.get(t=60).id, stored[60])
+        self.assertEqual((bar.c, bar.v), (705, 2000))
+        self.assertEqual(ingest_bars({"TSLA": []}), 0)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+from decimal import Decimal
+
+from assets.models import Bar, BarWatermark
+from assets.parquet import export_bars, import_bars
+from assets.tests.factories import AssetFactory, BarFactory
+from django.test import TestCase
+
+# 2021-10-29 and 2021-11-01 14:30 UTC
+OCTOBER = 1635517800
+NOVEMBER = 1635777000
+
+
+class ParquetTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        self.tesla = AssetFactory(symbol="TSLA")
+        self.apple = AssetFactory(symbol="AAPL")
+        for asset in (self.tesla, self.apple):
+            for start in (OCTOBER, NOVEMBER):
+                for i in range(3):
+                    BarFactory(asset=asset, t=start + 900 * i, c=Decimal("1.12345"))
+
+    def test_export_bars(self):
+        """Bars are written to a file per symbol and month."""
+        # Batches smaller than a partition, and spanning partitions
+        self.assertEqual(export_bars(self.directory, batch_size=4), 12)
+
+        partitions = sorted(
+            os.path.relpath(os.path.join(root, name), self.directory)
+            for root, _, files in os.walk(self.directory)
+            for name in files
+        )
+        self.assertEqual(
+            partitions,
+            [
+                "symbol=AAPL/month=2021-10/bars.parquet",
+                "symbol=AAPL/month=2021-11/bars.parquet",
+                "symbol=TSLA/month=2021-10/bars.parquet",
+                "symbol=TSLA/month=2021-11/bars.parquet",
+            ],
+        )
+        self.assertEqual(
+            export_bars(self.directory, symbols=["TSLA"], start=NOVEMBER), 3
+        )
+
+    def test_import_bars(self):
+        """Exported bars are imported through the bulk ingestion path."""
+        export_bars(self.directory)
+        stored = sorted(
+            Bar.objects.values_list("asset__symbol", "t", "o", "h", "l", "c", "v")
+        )
+        Bar.objects.filter(asset=self.tesla, t__gte=NOVEMBER).delete()
+
+        imported = import_bars(self.directory, timeframe="15Min", batch_size=2)
+
+        # Bars which were not deleted are unchanged
+        self.assertEqual(imported, 3)
+        self.assertEqual(
+            sorted(
+                Bar.objects.values_list("asset__symbol", "t", "o", "h", "l", "c", "v")
+            ),
+            stored,
+        )
+        self.assertEqual(
+            BarWatermark.objects.get(asset=self.tesla, timeframe="15Min").t,
+            NOVEMBER + 1800,
+        )
+
+        with self.subTest(msg="only the symbols given are imported."):
+            Bar.objects.all().delete()
+            self.assertEqual(import_bars(self.directory, symbols=["AAPL"]), 6)
+            self.assertFalse(Bar.objects.filter(asset=self.tesla).exists())
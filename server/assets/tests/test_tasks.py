@@ -1,10 +1,19 @@
+from datetime import datetime
 from unittest.mock import patch
 
+import pytz
+
 from alpaca_trade_api.entity import Asset as AlpacaAsset
 from alpaca_trade_api.entity import Bar as AlpacaBar
 from alpaca_trade_api.entity import Quote as AlpacaQuote
-from assets.models import Asset, AssetClass, Bar, Exchange
-from assets.tasks import get_quotes, update_assets, update_bars
+from assets.models import Asset, AssetClass, Bar, BarWatermark, Exchange
+from assets.tasks import (
+    bar_update_requests,
+    get_quotes,
+    refresh_bars,
+    update_assets,
+    update_bars,
+)
 from assets.tests.factories import AssetFactory
 from django.test import TestCase
 
@@ -193,3 +202,68 @@ class AssetTaskTests(TestCase):
         # Bars are saved to db correctly
         self.assertEqual(Bar.objects.filter(asset=tesla).count(), 2)
         self.assertEqual(Bar.objects.filter(asset=microsoft).count(), 2)
+
+    @patch("assets.tasks.TradeApiRest")
+    def test_refresh_bars(self, mock_api):
+        """Bars are fetched in chunks of the maximum symbols per request."""
+        symbols = [f"SYM{i}" for i in range(450)]
+        mock_api().get_bars.side_effect = lambda symbols, *args: {
+            symbol: [] for symbol in symbols.split(",")
+        }
+
+        bars = refresh_bars(symbols + symbols[:10], "15Min", limit=1)
+
+        self.assertEqual(mock_api().get_bars.call_count, 3)
+        requested = [
+            call[0][0].split(",") for call in mock_api().get_bars.call_args_list
+        ]
+        self.assertEqual(sorted(len(chunk) for chunk in requested), [50, 200, 200])
+        self.assertEqual(len(bars), 450)
+
+    @patch("assets.tasks.TradeApiRest")
+    def test_update_bars_watermarks(self, mock_api):
+        """Only bars after the latest stored bar of each symbol are fetched."""
+        now = datetime(2021, 11, 29, 16, tzinfo=pytz.utc)
+        tesla = AssetFactory(symbol="TSLA")
+        apple = AssetFactory(symbol="AAPL")
+        microsoft = AssetFactory(symbol="MSFT")
+        AssetFactory(symbol="NVDA")
+        for asset, t in (
+            (tesla, 1638198000),
+            (apple, 1638198000),
+            (microsoft, 1638200700),
+        ):
+            BarWatermark.objects.create(asset=asset, timeframe="15Min", t=t)
+        BarWatermark.objects.create(asset=microsoft, timeframe="1D", t=1638162000)
+
+        requests = bar_update_requests(
+            ["TSLA", "AAPL", "MSFT", "NVDA"], "15Min", limit=100, now=now
+        )
+
+        # Three bars completed since 15:00, and none since 15:45
+        self.assertEqual(
+            requests,
+            {
+                ("2021-11-29T15:00:00+00:00", 3): ["TSLA", "AAPL"],
+                (None, 100): ["NVDA"],
+            },
+        )
+
+        bar = {"t": 1638198900, "o": 1, "h": 2, "l": 0.5, "c": 1.5, "v": 100}
+        mock_api().get_bars.return_value = {
+            "TSLA": [AlpacaBar(bar)],
+            "AAPL": [AlpacaBar({**bar, "t": 1638199800})],
+        }
+        update_bars("TSLA,AAPL,MSFT", "15Min", limit=100, now=now)
+
+        mock_api().get_bars.assert_called_once_with(
+            "TSLA,AAPL", "15Min", 3, None, None, "2021-11-29T15:00:00+00:00", None
+        )
+        self.assertEqual(
+            dict(
+                BarWatermark.objects.filter(timeframe="15Min").values_list(
+                    "asset__symbol", "t"
+                )
+            ),
+            {"TSLA": 1638198900, "AAPL": 1638199800, "MSFT": 1638200700},
+        )
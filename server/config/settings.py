@@ -222,6 +222,16 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
 
+# Market data
+
+# Timeframe of the bars fetched and stored. Longer timeframes are resampled
+# from these bars rather than fetched separately
+BAR_BASE_TIMEFRAME = env("BAR_BASE_TIMEFRAME", default="15Min")
+
+# Local directory of the memory mapped columnar bar cache, read by signals and
+# backtests instead of the database. Disabled if not set
+BAR_CACHE_DIR = env("BAR_CACHE_DIR", default=None)
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.1/topics/i18n/
 
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import Strategy
+from .models import BacktestResult, Strategy, StrategyRecommendation
 
 admin.site.register(Strategy)
+admin.site.register(BacktestResult)
+admin.site.register(StrategyRecommendation)
@@ -1,23 +1,24 @@
-import logging
+from core.transport import AlpacaTransport, get_transport
 
-import alpaca_trade_api as tradeapi
 
-logger = logging.getLogger(__name__)
+class TradeApiRest:
+    """
+    Base wrapper for TradeView REST requests.
 
+    Instances share the process wide transport, so requests reuse its pool of
+    keep-alive connections however many instances are created.
+    """
 
-class TradeApiRest:
-    """Base wrapper for TradeView REST requests."""
-
-    def __init__(self):
-        try:
-            # Env variables set to initalise connection:
-            #   * APCA_API_KEY_ID
-            #   * APCA_API_SECRET_KEY
-            #   * APCA_API_BASE_URL
-            self.api = tradeapi.REST()
-        except Exception as e:
-            logger.error(f"Tradeview api connection failed: {e}")
-            return
+    def __init__(self, transport=None):
+        """
+        :param transport(SyncTransport): transport the requests are made with,
+        defaults to the one shared by the process
+        """
+        # Env variables set to initalise connection:
+        #   * APCA_API_KEY_ID
+        #   * APCA_API_SECRET_KEY
+        #   * APCA_API_BASE_URL
+        self.api = transport or get_transport()
 
     def account_info(self):
         """
@@ -205,10 +206,11 @@ class TradeApiRest:
     def submit_order(
         self,
         symbol,
-        qty,
-        side,
-        type,
-        time_in_force,
+        qty=None,
+        side=None,
+        type=None,
+        time_in_force=None,
+        notional=None,
         limit_price=None,
         stop_price=None,
         client_order_id=None,
@@ -225,7 +227,10 @@ class TradeApiRest:
 
         Params:
         :param symbol(str): symbol or asset ID to identify the asset to trade
-        :param qty(float): number of shares to trade
+        :param qty(float): number of shares to trade. Required unless
+        'notional' is given
+        :param notional(float): dollar amount to trade, for market day orders.
+        Required unless 'qty' is given
         :param side(str): buy or sell
         :param type(str): market, limit, stop, stop_limit, or trailing_stop
         :param time_in_force(str):
@@ -263,19 +268,20 @@ class TradeApiRest:
 
         """
         return self.api.submit_order(
-            symbol,
-            qty,
-            side,
-            type,
-            time_in_force,
-            limit_price,
-            stop_price,
-            client_order_id,
-            order_class,
-            take_profit,
-            stop_loss,
-            trail_price,
-            trail_percent,
+            symbol=symbol,
+            qty=qty,
+            notional=notional,
+            side=side,
+            type=type,
+            time_in_force=time_in_force,
+            limit_price=limit_price,
+            stop_price=stop_price,
+            client_order_id=client_order_id,
+            order_class=order_class,
+            take_profit=take_profit,
+            stop_loss=stop_loss,
+            trail_price=trail_price,
+            trail_percent=trail_percent,
         )
 
     def is_tradable(self, symbol):
@@ -331,7 +337,7 @@ class TradeApiRest:
 
     def get_aggs(self, symbol, timespan, multiplier, _from, to):
         """
-        TBC.
+        Retrieves aggregate bars for the given symbol over a date range.
 
         Endpoint:
         GET /aggs/ticker/{symbol}/range/{multiplier}/{timespan}/{from}/{to}
@@ -341,9 +347,9 @@ class TradeApiRest:
         month, quarter, year
         :param multiplier(int): Size of the timespan multiplier (distance
         between samples)
-        :param _from(str): acceptable types: isoformat string, timestamp int,
-        datetime object
+        :param _from(str): start date, YYYY-MM-DD
         :param to(str): same as _from
+        :returns: list of bars, with millisecond timestamps
         """
         return self.api.get_aggs(symbol, timespan, multiplier, _from, to)
 
@@ -369,14 +375,76 @@ class TradeApiRest:
 
     def is_account_blocked(self):
         """Return true if account if blocked from trading."""
-        account = self._account_info()
+        account = self.account_info()
         return account.trading_blocked
 
     def daily_balance(self):
         """Get change in equity from yesterday."""
-        account = self._account_info()
+        account = self.account_info()
         return float(account.equity) - float(account.last_equity)
 
     def open_orders(self):
         """Get all orders that are open."""
         return self.api.list_orders(status="open")
+
+    def async_api(self):
+        """
+        Return an `AsyncTradeApiRest` sharing the connections of this api,
+        whose requests are awaited in coroutines passed to `run`.
+        """
+        return AsyncTradeApiRest(self.api.transport)
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the event loop of this api's connections, blocking
+        until it returns.
+        """
+        return self.api.run(coroutine)
+
+
+class AsyncTradeApiRest(TradeApiRest):
+    """
+    Asynchronous wrapper for TradeView REST requests.
+
+    Methods are those of `TradeApiRest`, returning awaitables, e.g.
+    `await api.submit_order(...)`. Requests share the keep-alive connections
+    of the api's transport, which are bound to the event loop it is used from
+    and closed with `close`, or on leaving `async with`.
+    """
+
+    def __init__(self, transport=None):
+        """
+        :param transport(AlpacaTransport): transport the requests are made
+        with, defaults to a new one
+        """
+        self.api = transport or AlpacaTransport()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the open connections."""
+        await self.api.close()
+
+    def async_api(self):
+        return self
+
+    async def is_tradable(self, symbol):
+        """Is an asset tradable via Alpaca api."""
+        return (await self.api.get_asset(str(symbol))).tradable
+
+    async def is_market_open(self):
+        """Return true if the market is currently open."""
+        return (await self.api.get_clock()).__dict__["_raw"]["is_open"]
+
+    async def is_account_blocked(self):
+        """Return true if account if blocked from trading."""
+        return (await self.account_info()).trading_blocked
+
+    async def daily_balance(self):
+        """Get change in equity from yesterday."""
+        account = await self.account_info()
+        return float(account.equity) - float(account.last_equity)
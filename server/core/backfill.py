@@ -0,0 +1,221 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import numpy as np
+import pytz
+from assets.models import Asset, Bar
+from assets.tasks import (
+    MAX_BAR_REQUEST_WORKERS,
+    MAX_BARS_PER_REQUEST,
+    MAX_SYMBOLS_PER_REQUEST,
+    fetch_bars,
+    save_bars,
+)
+from django.conf import settings
+from django.utils import timezone
+
+from core.engine import moving_average_window
+from core.models import Strategy
+from core.ratelimit import BACKFILL, api_priority
+from core.resample import can_resample
+from core.trading_calendar import completed_bar_times, latest_bar_times
+
+logger = logging.getLogger(__name__)
+
+# Days of history kept backfilled for each asset
+BACKFILL_DAYS = 30
+
+
+def gap_intervals(expected, missing):
+    """
+    Group missing bar times into contiguous intervals of expected bars.
+
+    :param expected(ndarray): sorted expected bar times
+    :param missing(ndarray): sorted missing bar times
+    :returns: list of tuples of (first bar time, last bar time, bar count)
+    """
+    if not len(missing):
+        return []
+    positions = np.searchsorted(expected, missing)
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    return [
+        (int(run[0]), int(run[-1]), len(run))
+        for run in np.split(np.asarray(missing), breaks)
+    ]
+
+
+def coverage_gaps(asset_ids, start, now, timeframe=None):
+    """
+    Find the intervals of expected bars which are not stored for each asset.
+
+    Expected bars are the completed bars of the timeframe in the trading
+    calendar from `start`. Stored bars are found with one range query over
+    the indexed (asset, t) columns.
+
+    :param asset_ids(list): ids of the assets to scan
+    :param start(int): Unix epoch of the earliest bar expected
+    :param now(datetime): current time
+    :param timeframe(str): timeframe of the stored bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :returns: tuple of (expected bar times, dict of asset id to list of
+    (first bar time, last bar time, bar count) of each gap)
+    """
+    expected = completed_bar_times(start, now, timeframe or settings.BAR_BASE_TIMEFRAME)
+    if not len(expected):
+        return expected, {str(asset_id): [] for asset_id in asset_ids}
+
+    stored_bars = (
+        Bar.objects.filter(
+            asset_id__in=asset_ids, t__gte=expected[0], t__lte=expected[-1]
+        )
+        .order_by("asset_id", "t")
+        .values_list("asset_id", "t")
+    )
+    stored = {
+        str(asset_id): np.array([row[1] for row in rows], dtype=np.int64)
+        for asset_id, rows in groupby(stored_bars, key=lambda row: row[0])
+    }
+    return expected, {
+        str(asset_id): gap_intervals(
+            expected,
+            np.setdiff1d(
+                expected, stored.get(str(asset_id), np.array([], dtype=np.int64))
+            ),
+        )
+        for asset_id in asset_ids
+    }
+
+
+def strategy_demand(strategies, now):
+    """
+    Return the earliest bar needed by each strategy, keyed by asset.
+
+    Strategies need the bars resampled into the latest bars of their
+    timeframe compared by their moving averages.
+
+    :param strategies(list): strategies needing bars
+    :param now(datetime): current time
+    :returns: dict of asset id to a list of bar times, one per strategy
+    """
+    starts = {}
+    demand = {}
+    for strategy in strategies:
+        timeframe = strategy.timeframe
+        if not can_resample(timeframe):
+            continue
+        window = moving_average_window(strategy.type, timeframe)
+        if (window, timeframe) not in starts:
+            times = latest_bar_times(window + 1, now, timeframe)
+            starts[(window, timeframe)] = int(times[0]) if len(times) else None
+        if starts[(window, timeframe)] is not None:
+            demand.setdefault(str(strategy.asset_id), []).append(
+                starts[(window, timeframe)]
+            )
+    return demand
+
+
+def plan_backfill(asset_ids=None, days=BACKFILL_DAYS, now=None, timeframe=None):
+    """
+    Plan the bar requests which fill the gaps in stored history.
+
+    Gaps are split into pages of at most `MAX_BARS_PER_REQUEST` bars, and
+    symbols missing the same page are requested together, in chunks of
+    `MAX_SYMBOLS_PER_REQUEST`. Requests are ordered by the number of active
+    strategies which need their bars, and then newest first.
+
+    :param asset_ids(list): ids of the assets to backfill, defaults to the
+    assets of active strategies
+    :param days(int): days of history backfilled
+    :param now(datetime): current time, defaults to now
+    :param timeframe(str): timeframe of the stored bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :returns: list of requests, each a dict of `symbols`, `start`, `end`, and
+    `limit` of the bars requested, and the `priority` of the request
+    """
+    now = now or timezone.now()
+    strategies = list(Strategy.objects.active())
+    if asset_ids is None:
+        asset_ids = {strategy.asset_id for strategy in strategies}
+    symbols = {
+        str(asset_id): symbol
+        for asset_id, symbol in Asset.objects.filter(pk__in=asset_ids).values_list(
+            "id", "symbol"
+        )
+    }
+    start = int((now - timedelta(days=days)).timestamp())
+    expected, gaps = coverage_gaps(list(symbols), start, now, timeframe)
+    demand = strategy_demand(strategies, now)
+
+    pages = {}
+    for asset_id, intervals in gaps.items():
+        for first, last, count in intervals:
+            # Strategies needing any bar of the gap
+            priority = sum(1 for t in demand.get(asset_id, []) if t <= last)
+            times = expected[
+                np.searchsorted(expected, first) : np.searchsorted(expected, last) + 1
+            ]
+            for page in range(0, count, MAX_BARS_PER_REQUEST):
+                page_times = times[page : page + MAX_BARS_PER_REQUEST]
+                key = (int(page_times[0]), int(page_times[-1]), len(page_times))
+                pages.setdefault(key, {})[symbols[asset_id]] = priority
+
+    requests = []
+    for (first, last, count), priorities in pages.items():
+        # Symbols needed by the most strategies are requested first
+        page_symbols = sorted(
+            priorities, key=lambda symbol: (-priorities[symbol], symbol)
+        )
+        for chunk in range(0, len(page_symbols), MAX_SYMBOLS_PER_REQUEST):
+            chunk_symbols = page_symbols[chunk : chunk + MAX_SYMBOLS_PER_REQUEST]
+            requests.append(
+                {
+                    "symbols": sorted(chunk_symbols),
+                    "start": first,
+                    "end": last,
+                    "limit": count,
+                    "priority": priorities[chunk_symbols[0]],
+                }
+            )
+    requests.sort(key=lambda request: (-request["priority"], -request["end"]))
+    return requests
+
+
+def drain_backfill(requests, timeframe=None, max_workers=MAX_BAR_REQUEST_WORKERS):
+    """
+    Fetch planned bar requests concurrently.
+
+    Requests are started in the order planned, and the bars of each response
+    are saved in order as they arrive, rather than once every request is done.
+    Requests are made in the BACKFILL class of the shared rate limiter, so
+    they leave its reserve to trading requests and wait while those do.
+
+    :param requests(list): requests returned from `plan_backfill`
+    :param timeframe(str): timeframe of the stored bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :param max_workers(int): maximum number of concurrent requests
+    :returns: number of bars saved
+    """
+    if not requests:
+        return 0
+    timeframe = timeframe or settings.BAR_BASE_TIMEFRAME
+
+    def fetch(request):
+        with api_priority(BACKFILL):
+            return fetch_bars(
+                request["symbols"],
+                timeframe,
+                request["limit"],
+                start=datetime.fromtimestamp(request["start"], pytz.utc).isoformat(),
+                end=datetime.fromtimestamp(request["end"], pytz.utc).isoformat(),
+            )
+
+    saved = 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+        # Saved in this thread, so workers do not hold database connections
+        for assets_bars in executor.map(fetch, requests):
+            saved += save_bars(assets_bars, timeframe)
+
+    logger.info(f"Backfilled bars: {saved}, requests: {len(requests)}")
+    return saved
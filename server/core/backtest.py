@@ -0,0 +1,322 @@
+import numpy as np
+from assets.cache import get_bar_cache
+from assets.models import Bar
+
+from core.engine import BUY, HOLD, SELL, crossover_sides, moving_average_window
+from core.resample import resample
+from core.trading_calendar import bars_per_session
+
+# Paper accounts on Alpaca start with this much cash
+DEFAULT_CASH = 100000
+
+TRADING_DAYS_PER_YEAR = 252
+
+# 15Min bars in a year of regular trading hours
+PERIODS_PER_YEAR = TRADING_DAYS_PER_YEAR * 26
+
+STOP_LOSS = "stop_loss"
+TAKE_PROFIT = "take_profit"
+SIGNAL = "signal"
+OPEN = "open"
+
+
+def load_bars(asset_id, start=None, end=None):
+    """
+    Load the bars of an asset into NumPy arrays with a single query.
+
+    Bars are read from the bar cache if enabled, as read only views.
+
+    :param asset_id(str): id of the asset to load
+    :param start(int): Unix epoch of the earliest bar, if any
+    :param end(int): Unix epoch of the latest bar, if any
+    :returns: dict of `t`, `o`, `h`, `l`, and `c` arrays ordered oldest to newest
+    """
+    cache = get_bar_cache()
+    if cache is not None:
+        bars = cache.load(asset_id, start, end)
+        return {field: bars[field] for field in ("t", "o", "h", "l", "c")}
+
+    bars = Bar.objects.filter(asset_id=asset_id)
+    if start is not None:
+        bars = bars.filter(t__gte=start)
+    if end is not None:
+        bars = bars.filter(t__lte=end)
+    rows = bars.order_by("t").values_list("t", "o", "h", "l", "c")
+
+    values = np.array(list(rows), dtype=float).reshape(-1, 5)
+    return {
+        "t": values[:, 0].astype(np.int64),
+        "o": values[:, 1],
+        "h": values[:, 2],
+        "l": values[:, 3],
+        "c": values[:, 4],
+    }
+
+
+def periods_per_year(timeframe):
+    """Return the number of bars of a timeframe in a year of regular trading."""
+    return TRADING_DAYS_PER_YEAR * bars_per_session(timeframe)
+
+
+def moving_averages(closes, window):
+    """
+    Return the moving average ending at every bar.
+
+    Bars before the first full window are `nan`.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of bars averaged
+    """
+    averages = np.full(len(closes), np.nan)
+    if window < 1 or len(closes) < window:
+        return averages
+    sums = np.concatenate(([0.0], np.cumsum(closes)))
+    averages[window - 1 :] = (sums[window:] - sums[:-window]) / window
+    return averages
+
+
+def crossovers(closes, averages):
+    """
+    Return the side of the moving average crossover at every bar.
+
+    Uses the same rule as the live strategy, comparing each bar with the
+    bar before it.
+    """
+    sides = np.full(len(closes), HOLD, dtype=object)
+    if len(closes) > 1:
+        sides[1:] = crossover_sides(
+            closes[1:], averages[1:], closes[:-1], averages[:-1]
+        )
+    return sides
+
+
+def first_index(mask, start, stop):
+    """Return the first index of `mask[start:stop]` which is true, or None."""
+    if start >= stop:
+        return None
+    hits = np.flatnonzero(mask[start:stop])
+    return start + int(hits[0]) if len(hits) else None
+
+
+def exit_prices(
+    entry_price,
+    qty,
+    stop_loss_amount=None,
+    stop_loss_percentage=None,
+    take_profit_amount=None,
+    take_profit_percentage=None,
+):
+    """
+    Return the stop loss and take profit prices of a trade.
+
+    When both an amount and a percentage are given, the nearest price to the
+    entry applies.
+
+    :param entry_price(float): price the trade entered at
+    :param qty(float): quantity bought
+    :returns: tuple of (stop loss price, take profit price), each None if unset
+    """
+    stop_prices = []
+    if stop_loss_amount is not None:
+        stop_prices.append(entry_price - float(stop_loss_amount) / qty)
+    if stop_loss_percentage is not None:
+        stop_prices.append(entry_price * (1 - float(stop_loss_percentage) / 100))
+    target_prices = []
+    if take_profit_amount is not None:
+        target_prices.append(entry_price + float(take_profit_amount) / qty)
+    if take_profit_percentage is not None:
+        target_prices.append(entry_price * (1 + float(take_profit_percentage) / 100))
+    return (
+        max(stop_prices) if stop_prices else None,
+        min(target_prices) if target_prices else None,
+    )
+
+
+def find_exit(bars, entry, sell, stop_price=None, target_price=None):
+    """
+    Return where a trade exits, searching the bars after its entry up to and
+    including the next SELL signal.
+
+    Stop losses are checked before take profits within a bar, and a bar
+    gapping through either price fills at the open.
+
+    :param bars(dict): arrays returned from `load_bars`
+    :param entry(int): index of the entry bar
+    :param sell(int): index of the next SELL signal, or None
+    :param stop_price(float): stop loss price, if any
+    :param target_price(float): take profit price, if any
+    :returns: tuple of (exit index, exit price, reason)
+    """
+    count = len(bars["c"])
+    stop = sell + 1 if sell is not None else count
+
+    exit_index, exit_price, reason = sell, None, SIGNAL
+    if stop_price is not None:
+        index = first_index(bars["l"] <= stop_price, entry + 1, stop)
+        if index is not None:
+            stop, exit_index, reason = index + 1, index, STOP_LOSS
+            exit_price = min(stop_price, bars["o"][index])
+    if target_price is not None:
+        index = first_index(bars["h"] >= target_price, entry + 1, stop)
+        if index is not None and (exit_index is None or index < exit_index):
+            exit_index, reason = index, TAKE_PROFIT
+            exit_price = max(target_price, bars["o"][index])
+
+    if exit_index is None:
+        exit_index, reason = count - 1, OPEN
+    if exit_price is None:
+        exit_price = bars["c"][exit_index]
+    return exit_index, exit_price, reason
+
+
+def backtest(
+    bars,
+    window,
+    trade_value,
+    stop_loss_amount=None,
+    stop_loss_percentage=None,
+    take_profit_amount=None,
+    take_profit_percentage=None,
+    cash=DEFAULT_CASH,
+    annual_periods=PERIODS_PER_YEAR,
+    averages=None,
+):
+    """
+    Backtest a moving average crossover strategy.
+
+    Signals, the equity curve, and metrics are computed for every bar at
+    once. Only trades are iterated, and each trade searches for its exit in
+    the bars up to the next SELL signal, so every bar is scanned at most once.
+
+    A BUY signal while flat buys `trade_value` (capped at equity) at the close.
+    The position is sold at the close of the next SELL signal, or earlier when
+    the low reaches the stop loss or the high reaches the take profit. Stop
+    losses are checked before take profits within a bar. Amounts are profit
+    or loss of the trade in dollars, and percentages are of the entry price.
+
+    :param bars(dict): arrays returned from `load_bars`
+    :param window(int): number of bars in the moving average
+    :param trade_value(float): value of each buy order
+    :param stop_loss_amount(float): loss in dollars which closes a trade
+    :param stop_loss_percentage(float): fall in price which closes a trade
+    :param take_profit_amount(float): profit in dollars which closes a trade
+    :param take_profit_percentage(float): rise in price which closes a trade
+    :param cash(float): starting cash
+    :param annual_periods(int): bars per year, used to annualise the Sharpe
+    ratio
+    :param averages(ndarray): precomputed moving averages, computed from the
+    closes if not given
+    :returns: dict of trades, equity curve, drawdown, and metrics
+    """
+    closes = bars["c"]
+    if averages is None:
+        averages = moving_averages(closes, window)
+
+    sides = crossovers(closes, averages)
+    buys = np.flatnonzero(sides == BUY)
+    sells = np.flatnonzero(sides == SELL)
+    count = len(closes)
+
+    trades = []
+    cash_flows = np.zeros(count)
+    holdings = np.zeros(count)
+    balance = float(cash)
+    exit_index = -1
+    while True:
+        # Enter on the first BUY signal after the previous trade closed
+        position = np.searchsorted(buys, exit_index, side="right")
+        if position >= len(buys) or balance <= 0:
+            break
+        entry = int(buys[position])
+        entry_price = closes[entry]
+        notional = min(float(trade_value), balance)
+        qty = notional / entry_price
+
+        stop_price, target_price = exit_prices(
+            entry_price,
+            qty,
+            stop_loss_amount,
+            stop_loss_percentage,
+            take_profit_amount,
+            take_profit_percentage,
+        )
+
+        # Exits are only searched up to and including the next SELL signal
+        position = np.searchsorted(sells, entry, side="right")
+        sell = int(sells[position]) if position < len(sells) else None
+        exit_index, exit_price, reason = find_exit(
+            bars, entry, sell, stop_price, target_price
+        )
+
+        proceeds = qty * exit_price
+        cash_flows[entry] -= notional
+        holdings[entry:exit_index] = qty
+        if reason != OPEN:
+            cash_flows[exit_index] += proceeds
+        balance += proceeds - notional
+
+        trades.append(
+            {
+                "entry_t": int(bars["t"][entry]),
+                "exit_t": int(bars["t"][exit_index]),
+                "entry_price": float(entry_price),
+                "exit_price": float(exit_price),
+                "qty": float(qty),
+                "notional": float(notional),
+                "profit": float(proceeds - notional),
+                "return": float(exit_price / entry_price - 1),
+                "reason": reason,
+            }
+        )
+        if reason == OPEN:
+            holdings[exit_index] = qty
+            break
+
+    equity = cash + np.cumsum(cash_flows) + holdings * closes
+    if count:
+        drawdown = equity / np.maximum.accumulate(equity) - 1
+    else:
+        drawdown = np.array([])
+
+    returns = np.diff(equity) / equity[:-1] if count > 1 else np.array([])
+    volatility = returns.std() if len(returns) else 0
+    sharpe = (
+        float(returns.mean() / volatility * np.sqrt(annual_periods))
+        if volatility
+        else 0.0
+    )
+
+    return {
+        "trades": trades,
+        "t": bars["t"],
+        "equity": equity,
+        "drawdown": drawdown,
+        "total_return": float(equity[-1] / cash - 1) if count else 0.0,
+        "max_drawdown": float(drawdown.min()) if count else 0.0,
+        "sharpe": sharpe,
+    }
+
+
+def backtest_strategy(strategy, start=None, end=None, **kwargs):
+    """
+    Backtest a moving average strategy against its asset's stored bars.
+
+    Stored bars are resampled into the strategy's timeframe, and the moving
+    average window is sized for the timeframe.
+
+    :param strategy(Strategy): strategy to backtest
+    :param start(int): Unix epoch of the earliest bar, if any
+    :param end(int): Unix epoch of the latest bar, if any
+    :param kwargs: passed to `backtest`
+    """
+    kwargs.setdefault("annual_periods", periods_per_year(strategy.timeframe))
+    return backtest(
+        resample(load_bars(strategy.asset_id, start, end), strategy.timeframe),
+        moving_average_window(strategy.type, strategy.timeframe),
+        strategy.trade_value,
+        stop_loss_amount=strategy.stop_loss_amount,
+        stop_loss_percentage=strategy.stop_loss_percentage,
+        take_profit_amount=strategy.take_profit_amount,
+        take_profit_percentage=strategy.take_profit_percentage,
+        **kwargs,
+    )
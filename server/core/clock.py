@@ -0,0 +1,67 @@
+import logging
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.alpaca import TradeApiRest
+
+logger = logging.getLogger(__name__)
+
+
+class MarketClock:
+    """
+    Cache of the market clock.
+
+    The clock is requested once, and whether the market is open is then
+    answered locally until the next market open or close, so checking the
+    clock while the market is closed does not require a request to Alpaca.
+    """
+
+    def __init__(self):
+        self.open = None
+        self.next_open = None
+        self.next_close = None
+
+    def clear(self):
+        """Forget the cached clock, forcing a request on the next check."""
+        self.open = None
+        self.next_open = None
+        self.next_close = None
+
+    @property
+    def expires_at(self):
+        """Return the time the cached clock is valid until."""
+        if self.open is None:
+            return None
+        return self.next_close if self.open else self.next_open
+
+    def refresh(self, api=None):
+        """
+        Request the market clock from Alpaca.
+
+        :param api(TradeApiRest): api used to make the request
+        """
+        api = api or TradeApiRest()
+        clock = api.get_clock().__dict__["_raw"]
+        self.open = clock["is_open"]
+        self.next_open = parse_datetime(clock["next_open"])
+        self.next_close = parse_datetime(clock["next_close"])
+        logger.info(
+            f"Market clock refreshed. is open, next open, next close: {self.open}, "
+            f"{self.next_open}, {self.next_close}"
+        )
+
+    def is_open(self, api=None, now=None):
+        """
+        Return true if the market is currently open.
+
+        :param api(TradeApiRest): api used if the clock must be requested
+        :param now(datetime): time to check, defaults to now
+        """
+        now = now or timezone.now()
+        if self.expires_at is None or now >= self.expires_at:
+            self.refresh(api)
+        return self.open
+
+
+market_clock = MarketClock()
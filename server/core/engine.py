@@ -0,0 +1,150 @@
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from orders.models import Order
+
+from core.models import Strategy
+from core.resample import can_resample, resample_cache
+from core.rolling import rolling_store
+from core.trading_calendar import bars_per_session
+
+BUY = Order.BUY
+SELL = Order.SELL
+HOLD = "hold"
+
+# Number of trading days averaged by each moving average strategy type
+MOVING_AVERAGE_DAYS = {
+    Strategy.MOVING_AVERAGE_7D: 5,
+    Strategy.MOVING_AVERAGE_14D: 10,
+}
+
+
+def moving_average_window(strategy_type, timeframe):
+    """
+    Return the number of bars averaged by a moving average strategy.
+
+    :param strategy_type(str): moving average strategy type
+    :param timeframe(str): timeframe of the averaged bars
+    """
+    return MOVING_AVERAGE_DAYS[strategy_type] * bars_per_session(timeframe)
+
+
+def crossover_sides(latest_close, latest_average, previous_close, previous_average):
+    """
+    Return the side of each moving average crossover.
+
+    Closing at or above the moving average after closing below it is a BUY, and
+    closing at or below the moving average after closing above it is a SELL.
+    Comparisons against `nan` are always false, so series without enough data
+    resolve to HOLD.
+    """
+    buy = (latest_close >= latest_average) & (previous_close < previous_average)
+    sell = (latest_close <= latest_average) & (previous_close > previous_average)
+    return np.where(buy, BUY, np.where(sell, SELL, HOLD))
+
+
+def derived_averages(closes, window):
+    """
+    Return the latest and previous closes and moving averages of a series.
+
+    :param closes(ndarray): completed closes, oldest to newest
+    :param window(int): number of bars averaged
+    :returns: tuple of (latest close, latest moving average, previous close,
+    previous moving average), `nan` without enough bars
+    """
+    if len(closes) < window + 1:
+        return np.nan, np.nan, np.nan, np.nan
+    return (
+        closes[-1],
+        closes[-window:].mean(),
+        closes[-2],
+        closes[-window - 1 : -1].mean(),
+    )
+
+
+def moving_average_signals(strategies, now=None):
+    """
+    Return the BUY/SELL/HOLD decision for each moving average strategy.
+
+    Strategies of the stored bar timeframe read moving averages from the
+    persistent rolling window of each (asset, window), which are updated with
+    only the bars stored since the previous tick. Strategies of longer
+    timeframes read them from the cached series resampled from the stored
+    bars. Crossovers of all strategies are then computed in one vectorised
+    pass.
+
+    :param strategies(iterable): moving average strategies to evaluate
+    :param now(datetime): current time, defaults to now
+    :returns: dict of strategy id to dict of `side`, `close`,
+    `moving_average`, and the beginning time `t` of the latest bar
+    """
+    strategies = [
+        s
+        for s in strategies
+        if s.type in MOVING_AVERAGE_DAYS and can_resample(s.timeframe)
+    ]
+    if not strategies:
+        return {}
+
+    keys = [
+        (
+            str(strategy.asset_id),
+            strategy.timeframe,
+            moving_average_window(strategy.type, strategy.timeframe),
+        )
+        for strategy in strategies
+    ]
+    stored = [key for key in keys if key[1] == settings.BAR_BASE_TIMEFRAME]
+    derived = [key for key in keys if key[1] != settings.BAR_BASE_TIMEFRAME]
+
+    averages = {}
+    # Beginning time of the latest bar of each key
+    bar_times = {}
+    if stored:
+        states = rolling_store.refresh(
+            (asset_id, window) for asset_id, _, window in stored
+        )
+        for key in stored:
+            state = states[(key[0], key[2])]
+            averages[key] = (
+                state.latest_close(),
+                state.moving_average(),
+                state.previous_close(),
+                state.previous_moving_average(),
+            )
+            bar_times[key] = state.last_t
+    if derived:
+        series = resample_cache.refresh(
+            [
+                (asset_id, timeframe, window + 1)
+                for asset_id, timeframe, window in derived
+            ],
+            now or timezone.now(),
+        )
+        for asset_id, timeframe, window in derived:
+            bars = series.get((asset_id, timeframe), {"c": np.array([])})
+            averages[(asset_id, timeframe, window)] = derived_averages(
+                bars["c"], window
+            )
+            if len(bars["c"]):
+                bar_times[(asset_id, timeframe, window)] = int(bars["t"][-1])
+
+    latest_close, latest_average, previous_close, previous_average = np.array(
+        [averages[key] for key in keys], dtype=float
+    ).T
+
+    sides = crossover_sides(
+        latest_close, latest_average, previous_close, previous_average
+    )
+
+    return {
+        strategy.pk: {
+            "side": str(side),
+            "close": float(close),
+            "moving_average": float(average),
+            "t": bar_times.get(key),
+        }
+        for strategy, key, side, close, average in zip(
+            strategies, keys, sides, latest_close, latest_average
+        )
+    }
@@ -0,0 +1,409 @@
+"""
+Technical indicators, computed in batch over arrays or incrementally per bar.
+
+Batch functions compute an indicator over every bar of an array for
+backtests, and incremental indicators update from their saved state with each
+new bar for live ticks. Both share the same arithmetic, so produce identical
+values. Values before an indicator has seen enough bars are `nan`.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def mean(values):
+    """Return the mean of a window of values, oldest to newest."""
+    return float(np.sum(values) / len(values))
+
+
+def ema_step(previous, value, window):
+    """Return the exponential moving average updated with a new value."""
+    return previous + 2 / (window + 1) * (value - previous)
+
+
+def wilder_step(previous, value, window):
+    """Return Wilder's smoothed average updated with a new value."""
+    return (previous * (window - 1) + value) / window
+
+
+def relative_strength(average_gain, average_loss):
+    """Return the relative strength index of the average gain and loss."""
+    if average_loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + average_gain / average_loss)
+
+
+def true_range(high, low, previous_close):
+    """Return the true range of a bar, or its range for the first bar."""
+    if np.isnan(previous_close):
+        return high - low
+    return max(high - low, abs(high - previous_close), abs(low - previous_close))
+
+
+def smoothed(values, window, step):
+    """
+    Return a recursive average of values, seeded by the mean of the first
+    `window` values.
+
+    :param values(ndarray): values to average, oldest to newest
+    :param window(int): number of values averaged
+    :param step(function): recursive update, e.g. `ema_step`
+    """
+    averages = np.full(len(values), np.nan)
+    if len(values) < window:
+        return averages
+    average = mean(values[:window])
+    averages[window - 1] = average
+    for i in range(window, len(values)):
+        average = step(average, values[i], window)
+        averages[i] = average
+    return averages
+
+
+def sma(closes, window):
+    """
+    Return the simple moving average ending at every bar.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of bars averaged
+    """
+    closes = np.asarray(closes, dtype=float)
+    averages = np.full(len(closes), np.nan)
+    if len(closes) >= window:
+        averages[window - 1 :] = (
+            sliding_window_view(closes, window).sum(axis=1) / window
+        )
+    return averages
+
+
+def ema(closes, window):
+    """
+    Return the exponential moving average at every bar.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of bars averaged, seeded by their mean
+    """
+    return smoothed(np.asarray(closes, dtype=float), window, ema_step)
+
+
+def rsi(closes, window=14):
+    """
+    Return Wilder's relative strength index at every bar.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of changes averaged
+    """
+    closes = np.asarray(closes, dtype=float)
+    values = np.full(len(closes), np.nan)
+    changes = np.diff(closes)
+    gains = smoothed(np.maximum(changes, 0), window, wilder_step)
+    losses = smoothed(np.maximum(-changes, 0), window, wilder_step)
+    for i in range(window - 1, len(changes)):
+        values[i + 1] = relative_strength(gains[i], losses[i])
+    return values
+
+
+def macd(closes, fast=12, slow=26, signal=9):
+    """
+    Return the moving average convergence divergence at every bar.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param fast(int): window of the fast exponential moving average
+    :param slow(int): window of the slow exponential moving average
+    :param signal(int): window of the exponential moving average of the line
+    :returns: tuple of arrays of (line, signal, histogram)
+    """
+    closes = np.asarray(closes, dtype=float)
+    line = ema(closes, fast) - ema(closes, slow)
+    signals = np.full(len(closes), np.nan)
+    first = max(fast, slow) - 1
+    if len(closes) > first:
+        signals[first:] = ema(line[first:], signal)
+    return line, signals, line - signals
+
+
+def bollinger(closes, window=20, width=2):
+    """
+    Return Bollinger bands at every bar.
+
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of bars averaged
+    :param width(float): number of standard deviations to each band
+    :returns: tuple of arrays of (lower, middle, upper)
+    """
+    closes = np.asarray(closes, dtype=float)
+    middle = sma(closes, window)
+    deviations = np.full(len(closes), np.nan)
+    if len(closes) >= window:
+        deviations[window - 1 :] = sliding_window_view(closes, window).std(axis=1)
+    return middle - width * deviations, middle, middle + width * deviations
+
+
+def atr(highs, lows, closes, window=14):
+    """
+    Return Wilder's average true range at every bar.
+
+    :param highs(ndarray): highs ordered oldest to newest
+    :param lows(ndarray): lows ordered oldest to newest
+    :param closes(ndarray): closes ordered oldest to newest
+    :param window(int): number of true ranges averaged
+    """
+    previous_closes = np.concatenate(([np.nan], np.asarray(closes, dtype=float)[:-1]))
+    ranges = np.array(
+        [
+            true_range(high, low, previous_close)
+            for high, low, previous_close in zip(highs, lows, previous_closes)
+        ],
+        dtype=float,
+    )
+    return smoothed(ranges, window, wilder_step)
+
+
+def nan_to_none(value):
+    """Return a value, or tuple of values, with `nan` replaced by None."""
+    if isinstance(value, (tuple, list)):
+        return [nan_to_none(item) for item in value]
+    return None if np.isnan(value) else value
+
+
+def none_to_nan(value):
+    """Return a value stored by `nan_to_none`, with None replaced by `nan`."""
+    if isinstance(value, list):
+        return tuple(none_to_nan(item) for item in value)
+    return np.nan if value is None else value
+
+
+class Indicator:
+    """
+    Base of the incremental indicators.
+
+    Subclasses keep their state in instance attributes of JSON serializable
+    values, or of the indicators named in `components`, and return the latest
+    value from `update`. Attributes named in `nan_attributes` may be `nan`,
+    and are stored as None, as `nan` is not valid JSON.
+    """
+
+    # Attribute name to class of the indicators an indicator is built from
+    components = {}
+    # Attributes of values, or tuples of values, which may be `nan`
+    nan_attributes = ()
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restore an indicator serialized with `to_dict`."""
+        indicator = cls.__new__(cls)
+        indicator.__dict__.update(data)
+        for name, component in cls.components.items():
+            setattr(indicator, name, component.from_dict(data[name]))
+        for name in cls.nan_attributes:
+            setattr(indicator, name, none_to_nan(data[name]))
+        return indicator
+
+    def to_dict(self):
+        """Return the indicator state as a JSON serializable dict."""
+        data = dict(self.__dict__)
+        for name in self.components:
+            data[name] = data[name].to_dict()
+        for name in self.nan_attributes:
+            data[name] = nan_to_none(data[name])
+        return data
+
+    @property
+    def is_ready(self):
+        """Return true once enough bars have been seen for a value."""
+        return not np.isnan(self.value)
+
+
+class SMA(Indicator):
+    """Simple moving average of the latest `window` closes."""
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.closes = []
+
+    @property
+    def value(self):
+        if len(self.closes) < self.window:
+            return np.nan
+        return mean(self.closes)
+
+    def update(self, close):
+        """
+        Add the close of a new bar.
+
+        :param close(float): close price of the new bar
+        """
+        self.closes = (self.closes + [float(close)])[-self.window :]
+        self.count += 1
+        return self.value
+
+
+class Smoothed(Indicator):
+    """Recursive average seeded by the mean of the first `window` values."""
+
+    step = None
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.seed = []
+        self.average = None
+
+    @property
+    def value(self):
+        return np.nan if self.average is None else self.average
+
+    def update(self, value):
+        """
+        Add a new value.
+
+        :param value(float): value of the new bar
+        """
+        value = float(value)
+        self.count += 1
+        if self.average is not None:
+            self.average = type(self).step(self.average, value, self.window)
+        else:
+            self.seed.append(value)
+            if len(self.seed) == self.window:
+                self.average = mean(self.seed)
+                self.seed = []
+        return self.value
+
+
+class EMA(Smoothed):
+    """Exponential moving average of closes."""
+
+    step = staticmethod(ema_step)
+
+
+class Wilder(Smoothed):
+    """Wilder's smoothed average, as used by RSI and ATR."""
+
+    step = staticmethod(wilder_step)
+
+
+class RSI(Indicator):
+    """Wilder's relative strength index of closes."""
+
+    components = {"gains": Wilder, "losses": Wilder}
+    nan_attributes = ("value",)
+
+    def __init__(self, window=14):
+        super().__init__(window)
+        self.previous_close = None
+        self.gains = Wilder(window)
+        self.losses = Wilder(window)
+        self.value = np.nan
+
+    def update(self, close):
+        """
+        Add the close of a new bar.
+
+        :param close(float): close price of the new bar
+        """
+        close = float(close)
+        self.count += 1
+        if self.previous_close is not None:
+            change = close - self.previous_close
+            self.gains.update(max(change, 0))
+            self.losses.update(max(-change, 0))
+            if self.gains.is_ready:
+                self.value = relative_strength(self.gains.value, self.losses.value)
+        self.previous_close = close
+        return self.value
+
+
+class MACD(Indicator):
+    """Moving average convergence divergence of closes."""
+
+    components = {"fast": EMA, "slow": EMA, "signal": EMA}
+    nan_attributes = ("value",)
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        super().__init__(max(fast, slow))
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.value = (np.nan, np.nan, np.nan)
+
+    def update(self, close):
+        """
+        Add the close of a new bar.
+
+        :param close(float): close price of the new bar
+        :returns: tuple of (line, signal, histogram)
+        """
+        self.count += 1
+        line = self.fast.update(close) - self.slow.update(close)
+        signal = np.nan
+        if not np.isnan(line):
+            signal = self.signal.update(line)
+        self.value = (line, signal, line - signal)
+        return self.value
+
+    @property
+    def is_ready(self):
+        return not np.isnan(self.value[1])
+
+
+class Bollinger(Indicator):
+    """Bollinger bands of the latest `window` closes."""
+
+    nan_attributes = ("value",)
+
+    def __init__(self, window=20, width=2):
+        super().__init__(window)
+        self.width = width
+        self.closes = []
+        self.value = (np.nan, np.nan, np.nan)
+
+    def update(self, close):
+        """
+        Add the close of a new bar.
+
+        :param close(float): close price of the new bar
+        :returns: tuple of (lower, middle, upper)
+        """
+        self.closes = (self.closes + [float(close)])[-self.window :]
+        self.count += 1
+        if len(self.closes) == self.window:
+            middle = mean(self.closes)
+            spread = self.width * float(np.std(self.closes))
+            self.value = (middle - spread, middle, middle + spread)
+        return self.value
+
+    @property
+    def is_ready(self):
+        return not np.isnan(self.value[1])
+
+
+class ATR(Indicator):
+    """Wilder's average true range of bars."""
+
+    components = {"ranges": Wilder}
+    nan_attributes = ("value", "previous_close")
+
+    def __init__(self, window=14):
+        super().__init__(window)
+        self.previous_close = np.nan
+        self.ranges = Wilder(window)
+        self.value = np.nan
+
+    def update(self, high, low, close):
+        """
+        Add a new bar.
+
+        :param high(float): high price of the new bar
+        :param low(float): low price of the new bar
+        :param close(float): close price of the new bar
+        """
+        self.count += 1
+        self.value = self.ranges.update(
+            true_range(float(high), float(low), self.previous_close)
+        )
+        self.previous_close = float(close)
+        return self.value
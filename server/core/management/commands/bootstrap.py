@@ -55,6 +55,7 @@ class Command(BaseCommand):
         import json
         from datetime import timedelta
 
+        from assets.cache import invalidate_bars
         from assets.models import Asset, AssetClass, Bar, Exchange
         from core.models import Strategy
         from django.utils import timezone
@@ -106,3 +107,4 @@ class Command(BaseCommand):
                 for bar in bars
             ]
             Bar.objects.bulk_create(objs, batch_size=1000, ignore_conflicts=True)
+            invalidate_bars([tsla.pk])
@@ -0,0 +1,35 @@
+from alpaca_trade_api.stream import Stream
+from core.monitor import Monitor, MonitorStream
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Monitor stop losses and take profits of open positions in real time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--refresh-interval",
+            type=float,
+            default=60,
+            help="Seconds between reloading strategies and positions.",
+        )
+        parser.add_argument(
+            "--quotes",
+            action="store_true",
+            default=False,
+            help="Evaluate bid prices of quotes as well as trades.",
+        )
+        parser.add_argument(
+            "--feed",
+            choices=["iex", "sip"],
+            default="iex",
+            help="Market data feed streamed.",
+        )
+
+    def handle(self, *args, **kwargs):
+        # Credentials are read from the APCA_API_* env variables
+        stream = Stream(data_feed=kwargs["feed"], raw_data=True)
+        monitor = Monitor(refresh_interval=kwargs["refresh_interval"])
+
+        self.stdout.write("Monitoring exits...")
+        MonitorStream(monitor, stream, quotes=kwargs["quotes"]).run()
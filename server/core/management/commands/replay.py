@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from core.models import Strategy
+from core.replay import ReplaySimulator, load_recording, load_stored, retime
+from core.trading_calendar import EXCHANGE_TIMEZONE
+from django.core.management.base import BaseCommand, CommandError
+
+
+def epoch(value):
+    """Parse a YYYY-MM-DD date argument as the start of the day on the exchange."""
+    day = datetime.strptime(value, "%Y-%m-%d")
+    return int(EXCHANGE_TIMEZONE.localize(day).timestamp())
+
+
+class Command(BaseCommand):
+    help = "Replay recorded bars through the strategy tick with a simulated market."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            help="JSON file of recorded bars, e.g. assets/tests/sample_tsla_bars.json.",
+        )
+        parser.add_argument(
+            "--symbols",
+            nargs="+",
+            default=[],
+            help="Symbols of stored bars to replay.",
+        )
+        parser.add_argument(
+            "--start",
+            type=epoch,
+            help="Date replayed from, YYYY-MM-DD.",
+        )
+        parser.add_argument(
+            "--end",
+            type=epoch,
+            help="Date replayed until, YYYY-MM-DD.",
+        )
+        parser.add_argument(
+            "--retime",
+            action="store_true",
+            default=False,
+            help="Replay recorded bars as consecutive 15Min bars from the start.",
+        )
+        parser.add_argument(
+            "--strategies",
+            type=int,
+            default=1,
+            help="Number of users with a strategy for each symbol.",
+        )
+        parser.add_argument(
+            "--type",
+            choices=[choice for choice, _ in Strategy.TYPE_CHOICES],
+            default=Strategy.MOVING_AVERAGE_7D,
+            help="Type of each strategy.",
+        )
+        parser.add_argument(
+            "--trade-value",
+            type=float,
+            default=1000,
+            help="Trade value of each strategy.",
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=None,
+            help="Replayed seconds per second. Defaults to as fast as possible.",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["file"]:
+            recording = load_recording(kwargs["file"])
+        elif kwargs["symbols"] and kwargs["start"] and kwargs["end"]:
+            recording = load_stored(kwargs["symbols"], kwargs["start"], kwargs["end"])
+        else:
+            raise CommandError("Either --file, or --symbols, --start and --end.")
+
+        if kwargs["retime"]:
+            first = min(bars["t"][0] for bars in recording.values() if len(bars["t"]))
+            recording = retime(recording, kwargs["start"] or int(first))
+
+        simulator = ReplaySimulator(
+            recording,
+            strategies_per_symbol=kwargs["strategies"],
+            strategy_type=kwargs["type"],
+            trade_value=kwargs["trade_value"],
+        )
+        try:
+            summary = simulator.run(speed=kwargs["speed"])
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            f"Ticks: {summary['ticks']}, orders: {summary['orders']}\n"
+            f"Tick latency mean, p95, max: {summary['elapsed_mean']:.4f}s, "
+            f"{summary['elapsed_p95']:.4f}s, {summary['elapsed_max']:.4f}s\n"
+            f"Queries per tick mean, max: {summary['queries_mean']:.1f}, "
+            f"{summary['queries_max']}\n"
+            f"Requests: {summary['requests']}\n"
+            f"Cash: {summary['cash']:.2f}, positions: {summary['positions']}"
+        )
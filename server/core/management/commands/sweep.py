@@ -0,0 +1,110 @@
+from assets.models import Asset
+from core.models import BacktestResult, Strategy
+from core.sweep import run_sweep
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentage(value):
+    """Parse a percentage argument, where `none` disables the exit."""
+    return None if value.lower() == "none" else float(value)
+
+
+class Command(BaseCommand):
+    help = "Backtest a grid of moving average parameters across assets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "symbols",
+            nargs="*",
+            help="Symbols to backtest. Defaults to assets of active strategies.",
+        )
+        parser.add_argument(
+            "--windows",
+            nargs="+",
+            type=int,
+            default=[130, 260],
+            help="Moving average window lengths, in bars.",
+        )
+        parser.add_argument(
+            "--timeframes",
+            nargs="+",
+            choices=[choice for choice, _ in Strategy.TYPE_TIMEFRAME],
+            default=None,
+            help="Timeframes to backtest. Defaults to the stored bar timeframe.",
+        )
+        parser.add_argument(
+            "--stop-loss-percentages",
+            nargs="+",
+            type=percentage,
+            default=[None],
+            help="Stop loss percentages, or `none`.",
+        )
+        parser.add_argument(
+            "--take-profit-percentages",
+            nargs="+",
+            type=percentage,
+            default=[None],
+            help="Take profit percentages, or `none`.",
+        )
+        parser.add_argument(
+            "--trade-value",
+            type=float,
+            default=1000,
+            help="Value of each buy order.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of worker processes. Defaults to the number of cores.",
+        )
+        parser.add_argument(
+            "--metric",
+            choices=BacktestResult.METRICS,
+            default=BacktestResult.SHARPE,
+            help="Metric results are ranked by.",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Number of ranked results shown.",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["symbols"]:
+            assets = Asset.objects.filter(symbol__in=kwargs["symbols"])
+        else:
+            assets = Asset.objects.filter(
+                pk__in=Strategy.objects.active().values("asset")
+            )
+        asset_ids = list(assets.values_list("pk", flat=True))
+        if not asset_ids:
+            raise CommandError("No assets to backtest.")
+
+        self.stdout.write(f"Sweeping {len(asset_ids)} assets...")
+        sweep_id = run_sweep(
+            asset_ids,
+            kwargs["windows"],
+            timeframes=kwargs["timeframes"],
+            stop_loss_percentages=kwargs["stop_loss_percentages"],
+            take_profit_percentages=kwargs["take_profit_percentages"],
+            trade_value=kwargs["trade_value"],
+            max_workers=kwargs["workers"],
+        )
+
+        results = (
+            BacktestResult.objects.filter(sweep_id=sweep_id)
+            .ranked(kwargs["metric"])
+            .select_related("asset")[: kwargs["top"]]
+        )
+        self.stdout.write(f"Sweep {sweep_id}, ranked by {kwargs['metric']}:")
+        for result in results:
+            self.stdout.write(
+                f"{result.asset.symbol} {result.timeframe} window={result.window} "
+                f"stop_loss={result.stop_loss_percentage} "
+                f"take_profit={result.take_profit_percentage} "
+                f"trades={result.trades} return={result.total_return:.4f} "
+                f"drawdown={result.max_drawdown:.4f} sharpe={result.sharpe:.2f}"
+            )
+        self.stdout.write("Done")
@@ -0,0 +1,96 @@
+from core.management.commands.sweep import percentage
+from core.models import BacktestResult, Strategy
+from core.walkforward import recommend_strategies
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Recommend moving average parameters for strategies by walk forward."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "strategies",
+            nargs="*",
+            type=int,
+            help="Ids of strategies. Defaults to active strategies.",
+        )
+        parser.add_argument(
+            "--windows",
+            nargs="+",
+            type=int,
+            default=[26, 65, 130, 260],
+            help="Moving average window lengths, in bars.",
+        )
+        parser.add_argument(
+            "--train-days",
+            type=int,
+            default=20,
+            help="Trading days parameters are chosen on.",
+        )
+        parser.add_argument(
+            "--test-days",
+            type=int,
+            default=5,
+            help="Trading days parameters are evaluated on.",
+        )
+        parser.add_argument(
+            "--stop-loss-percentages",
+            nargs="+",
+            type=percentage,
+            default=[None],
+            help="Stop loss percentages, or `none`.",
+        )
+        parser.add_argument(
+            "--take-profit-percentages",
+            nargs="+",
+            type=percentage,
+            default=[None],
+            help="Take profit percentages, or `none`.",
+        )
+        parser.add_argument(
+            "--metric",
+            choices=BacktestResult.METRICS,
+            default=BacktestResult.SHARPE,
+            help="Metric parameters are chosen by.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of worker processes. Defaults to the number of cores.",
+        )
+
+    def handle(self, *args, **kwargs):
+        strategies = Strategy.objects.select_related("asset")
+        if kwargs["strategies"]:
+            strategies = strategies.filter(pk__in=kwargs["strategies"])
+        else:
+            strategies = strategies.active()
+        if not strategies.exists():
+            raise CommandError("No strategies to walk forward.")
+
+        self.stdout.write(f"Walking forward {strategies.count()} strategies...")
+        recommendations = recommend_strategies(
+            strategies,
+            kwargs["windows"],
+            train_days=kwargs["train_days"],
+            test_days=kwargs["test_days"],
+            stop_loss_percentages=kwargs["stop_loss_percentages"],
+            take_profit_percentages=kwargs["take_profit_percentages"],
+            metric=kwargs["metric"],
+            max_workers=kwargs["workers"],
+        )
+
+        for recommendation in recommendations:
+            self.stdout.write(
+                f"Strategy {recommendation.strategy_id} "
+                f"({recommendation.strategy.asset.symbol}): "
+                f"window={recommendation.window} "
+                f"stop_loss={recommendation.stop_loss_percentage} "
+                f"take_profit={recommendation.take_profit_percentage} "
+                f"in_sample={recommendation.in_sample:.2f} "
+                f"out_of_sample={recommendation.out_of_sample:.2f} "
+                f"stability={recommendation.stability:.2f} "
+                f"folds={recommendation.folds}"
+            )
+        self.stdout.write("Done")
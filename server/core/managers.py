@@ -1,5 +1,5 @@
 from assets.models import Asset, AssetClass
-from django.db.models import QuerySet
+from django.db.models import Q, QuerySet
 from django.utils import timezone
 
 
@@ -32,3 +32,28 @@ class StrategyQuerySet(QuerySet):
             end_date__gt=time_now,
             asset__status=Asset.ACTIVE,
         )
+
+    def with_exits(self):
+        """Return strategies with a stop loss or take profit."""
+        return self.filter(
+            Q(stop_loss_amount__isnull=False)
+            | Q(stop_loss_percentage__isnull=False)
+            | Q(take_profit_amount__isnull=False)
+            | Q(take_profit_percentage__isnull=False)
+        )
+
+
+class BacktestResultQuerySet(QuerySet):
+    """Custom queryset methods for backtest results."""
+
+    def ranked(self, metric="sharpe"):
+        """
+        Return results ordered best first by the given metric.
+
+        Drawdowns are negative, so the best is also the highest.
+
+        :param metric(str): one of `BacktestResult.METRICS`
+        """
+        if metric not in self.model.METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        return self.order_by(f"-{metric}", "pk")
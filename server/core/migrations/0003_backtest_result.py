@@ -0,0 +1,98 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assets", "0004_bars_unique_together"),
+        ("core", "0002_add_strategies"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BacktestResult",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sweep_id", models.UUIDField(db_index=True, verbose_name="sweep id")),
+                (
+                    "timeframe",
+                    models.CharField(
+                        choices=[
+                            ("1Min", "1 minute"),
+                            ("5Min", "5 minute"),
+                            ("15Min", "15 minute"),
+                            ("1H", "1 hour"),
+                            ("1D", "1 day"),
+                        ],
+                        max_length=128,
+                        verbose_name="timeframe",
+                    ),
+                ),
+                (
+                    "window",
+                    models.PositiveIntegerField(
+                        help_text="number of bars in the moving average",
+                        verbose_name="window",
+                    ),
+                ),
+                (
+                    "trade_value",
+                    models.DecimalField(
+                        decimal_places=5, max_digits=12, verbose_name="trade value"
+                    ),
+                ),
+                (
+                    "stop_loss_percentage",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=5,
+                        null=True,
+                        verbose_name="stop loss percentage",
+                    ),
+                ),
+                (
+                    "take_profit_percentage",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=5,
+                        null=True,
+                        verbose_name="take profit percentage",
+                    ),
+                ),
+                ("trades", models.PositiveIntegerField(verbose_name="trades")),
+                ("total_return", models.FloatField(verbose_name="total return")),
+                ("max_drawdown", models.FloatField(verbose_name="max drawdown")),
+                ("sharpe", models.FloatField(verbose_name="sharpe ratio")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created at"),
+                ),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="assets.asset",
+                        verbose_name="asset",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "backtest result",
+                "verbose_name_plural": "backtest results",
+            },
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_backtest_result"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StrategyRecommendation",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "window",
+                    models.PositiveIntegerField(
+                        help_text="number of bars in the moving average",
+                        verbose_name="window",
+                    ),
+                ),
+                (
+                    "stop_loss_percentage",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=5,
+                        null=True,
+                        verbose_name="stop loss percentage",
+                    ),
+                ),
+                (
+                    "take_profit_percentage",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=5,
+                        null=True,
+                        verbose_name="take profit percentage",
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        help_text="metric parameters were chosen by",
+                        max_length=128,
+                        verbose_name="metric",
+                    ),
+                ),
+                (
+                    "in_sample",
+                    models.FloatField(
+                        help_text="mean metric of the chosen parameters on train slices",
+                        verbose_name="in sample",
+                    ),
+                ),
+                (
+                    "out_of_sample",
+                    models.FloatField(
+                        help_text="mean metric of the chosen parameters on test slices",
+                        verbose_name="out of sample",
+                    ),
+                ),
+                (
+                    "stability",
+                    models.FloatField(
+                        help_text="share of train slices which chose the recommended parameters",
+                        verbose_name="stability",
+                    ),
+                ),
+                ("folds", models.PositiveIntegerField(verbose_name="folds")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created at"),
+                ),
+                (
+                    "strategy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="core.strategy",
+                        verbose_name="strategy",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "strategy recommendation",
+                "verbose_name_plural": "strategy recommendations",
+            },
+        ),
+    ]
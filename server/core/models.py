@@ -4,7 +4,7 @@ from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from .managers import StrategyQuerySet
+from .managers import BacktestResultQuerySet, StrategyQuerySet
 
 
 class Strategy(models.Model):
@@ -109,3 +109,119 @@ class Strategy(models.Model):
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
+
+
+class BacktestResult(models.Model):
+    """Result of backtesting one set of parameters during a sweep."""
+
+    SHARPE = "sharpe"
+    TOTAL_RETURN = "total_return"
+    MAX_DRAWDOWN = "max_drawdown"
+    METRICS = (SHARPE, TOTAL_RETURN, MAX_DRAWDOWN)
+
+    sweep_id = models.UUIDField(verbose_name=_("sweep id"), db_index=True)
+    asset = models.ForeignKey(
+        Asset,
+        verbose_name=_("asset"),
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    timeframe = models.CharField(
+        verbose_name=_("timeframe"),
+        choices=Strategy.TYPE_TIMEFRAME,
+        max_length=128,
+    )
+    window = models.PositiveIntegerField(
+        verbose_name=_("window"),
+        help_text=_("number of bars in the moving average"),
+    )
+    trade_value = models.DecimalField(
+        verbose_name=_("trade value"),
+        max_digits=12,
+        decimal_places=5,
+    )
+    stop_loss_percentage = models.DecimalField(
+        verbose_name=_("stop loss percentage"),
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+    )
+    take_profit_percentage = models.DecimalField(
+        verbose_name=_("take profit percentage"),
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+    )
+    trades = models.PositiveIntegerField(verbose_name=_("trades"))
+    total_return = models.FloatField(verbose_name=_("total return"))
+    max_drawdown = models.FloatField(verbose_name=_("max drawdown"))
+    sharpe = models.FloatField(verbose_name=_("sharpe ratio"))
+    created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+
+    objects = BacktestResultQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "backtest result"
+        verbose_name_plural = "backtest results"
+
+    def __str__(self):
+        return (
+            f"Backtest {self.sweep_id}: {self.asset_id} {self.timeframe} {self.window}"
+        )
+
+
+class StrategyRecommendation(models.Model):
+    """Moving average parameters recommended for a strategy by walk forward."""
+
+    strategy = models.ForeignKey(
+        Strategy,
+        verbose_name=_("strategy"),
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    window = models.PositiveIntegerField(
+        verbose_name=_("window"),
+        help_text=_("number of bars in the moving average"),
+    )
+    stop_loss_percentage = models.DecimalField(
+        verbose_name=_("stop loss percentage"),
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+    )
+    take_profit_percentage = models.DecimalField(
+        verbose_name=_("take profit percentage"),
+        max_digits=5,
+        decimal_places=2,
+        blank=True,
+        null=True,
+    )
+    metric = models.CharField(
+        verbose_name=_("metric"),
+        max_length=128,
+        help_text=_("metric parameters were chosen by"),
+    )
+    in_sample = models.FloatField(
+        verbose_name=_("in sample"),
+        help_text=_("mean metric of the chosen parameters on train slices"),
+    )
+    out_of_sample = models.FloatField(
+        verbose_name=_("out of sample"),
+        help_text=_("mean metric of the chosen parameters on test slices"),
+    )
+    stability = models.FloatField(
+        verbose_name=_("stability"),
+        help_text=_("share of train slices which chose the recommended parameters"),
+    )
+    folds = models.PositiveIntegerField(verbose_name=_("folds"))
+    created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = "strategy recommendation"
+        verbose_name_plural = "strategy recommendations"
+
+    def __str__(self):
+        return f"Strategy {self.strategy_id}: window {self.window}"
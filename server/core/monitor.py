@@ -0,0 +1,414 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from orders.dispatch import MAX_CONCURRENT_ORDERS
+from orders.ledger import intent_client_order_id, record_intents, submit_intents
+from orders.models import Order, OrderIntent
+
+from core.alpaca import TradeApiRest
+from core.backtest import STOP_LOSS, TAKE_PROFIT
+from core.models import Strategy
+from core.trading_calendar import current_bar_time
+
+logger = logging.getLogger(__name__)
+
+
+def exit_prices(entry_prices, qtys, amounts, percentages, direction):
+    """
+    Return the tightest exit price of each position.
+
+    Amounts are a profit or loss in dollars over the whole position, and
+    percentages a rise or fall in price. Missing (`nan`) thresholds are
+    ignored, and positions without any threshold have an infinite exit price
+    in `direction`.
+
+    :param entry_prices(ndarray): average entry price of each position
+    :param qtys(ndarray): quantity of each position
+    :param amounts(ndarray): profit or loss amount of each position
+    :param percentages(ndarray): price change percentage of each position
+    :param direction(int): -1 for stop losses, or 1 for take profits
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        prices = np.vstack(
+            (
+                entry_prices + direction * amounts / qtys,
+                entry_prices * (1 + direction * percentages / 100),
+            )
+        )
+    prices = np.where(np.isnan(prices), direction * np.inf, prices)
+    if direction < 0:
+        return prices.max(axis=0)
+    return prices.min(axis=0)
+
+
+def held_qty():
+    """
+    Return an expression of the quantity each strategy has bought and not
+    yet sold, from the filled quantity of its orders.
+    """
+
+    def filled(side):
+        return Coalesce(
+            Sum("orders__filled_qty", filter=Q(orders__side=side)),
+            Value(0),
+            output_field=DecimalField(),
+        )
+
+    return filled(Order.BUY) - filled(Order.SELL)
+
+
+class ThresholdBook:
+    """
+    Stop loss and take profit prices of every monitored position.
+
+    Thresholds are held in arrays with one row per strategy holding a
+    position, so each batch of prices is compared against every threshold in
+    one vectorised pass. Symbols are mapped to integer codes once, when the
+    book is built.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows(list): dicts of `strategy_id`, `user_id`, `asset_id`,
+        `symbol`, `timeframe`, `qty`, `stop_price`, and `target_price`
+        """
+        self.symbols = sorted({row["symbol"] for row in rows})
+        self.codes = {symbol: code for code, symbol in enumerate(self.symbols)}
+        self.rows = rows
+        self.symbol_codes = np.array(
+            [self.codes[row["symbol"]] for row in rows], dtype=np.int64
+        )
+        self.stop_prices = np.array([row["stop_price"] for row in rows], dtype=float)
+        self.target_prices = np.array(
+            [row["target_price"] for row in rows], dtype=float
+        )
+        self.active = np.ones(len(rows), dtype=bool)
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    @classmethod
+    def build(cls, strategies, positions, pending_symbols=()):
+        """
+        Build the thresholds of strategies holding an open long position.
+
+        Each strategy is sized at the quantity it holds, and strategies
+        trading the same asset share the quantity of its position, so exits
+        sell at most the quantity held. Thresholds are measured from the
+        position's average entry price.
+
+        :param strategies(iterable): strategies with a stop loss or take
+        profit, annotated with the `held_qty` bought and not yet sold
+        :param positions(list): raw open positions returned from Alpaca
+        :param pending_symbols(iterable): symbols with an open order, which are
+        not monitored until the order is closed
+        """
+        pending_symbols = set(pending_symbols)
+        remaining = {
+            position["symbol"]: float(position["qty"])
+            for position in positions
+            if position.get("side", "long") == "long"
+            and position["symbol"] not in pending_symbols
+        }
+        entry_prices = {
+            position["symbol"]: float(position["avg_entry_price"])
+            for position in positions
+        }
+        held = []
+        for strategy in strategies:
+            symbol = strategy.asset.symbol
+            qty = min(float(strategy.held_qty or 0), remaining.get(symbol, 0))
+            if qty <= 0:
+                # Strategies which never bought, or whose position is sold
+                continue
+            remaining[symbol] -= qty
+            held.append((strategy, qty))
+        if not held:
+            return cls([])
+
+        strategies = [strategy for strategy, _ in held]
+        qtys = np.array([qty for _, qty in held])
+        entry_prices = np.array([entry_prices[s.asset.symbol] for s in strategies])
+
+        def thresholds(field):
+            return np.array(
+                [
+                    np.nan if getattr(s, field) is None else float(getattr(s, field))
+                    for s in strategies
+                ]
+            )
+
+        stop_prices = exit_prices(
+            entry_prices,
+            qtys,
+            thresholds("stop_loss_amount"),
+            thresholds("stop_loss_percentage"),
+            -1,
+        )
+        target_prices = exit_prices(
+            entry_prices,
+            qtys,
+            thresholds("take_profit_amount"),
+            thresholds("take_profit_percentage"),
+            1,
+        )
+
+        return cls(
+            [
+                {
+                    "strategy_id": strategy.pk,
+                    "user_id": strategy.user_id,
+                    "asset_id": strategy.asset_id,
+                    "symbol": strategy.asset.symbol,
+                    "timeframe": strategy.timeframe,
+                    "qty": float(qty),
+                    "stop_price": float(stop_price),
+                    "target_price": float(target_price),
+                }
+                for strategy, qty, stop_price, target_price in zip(
+                    strategies, qtys, stop_prices, target_prices
+                )
+            ]
+        )
+
+    def evaluate(self, symbols, prices):
+        """
+        Compare a batch of prices against every threshold.
+
+        Positions which cross a threshold are removed from the book, so each
+        exit is only returned once.
+
+        :param symbols(list): symbol of each price, oldest to newest
+        :param prices(list): trade or quote prices
+        :returns: list of dicts of each exit, with the `price` and `reason`
+        """
+        if not self.rows or not len(symbols):
+            return []
+
+        codes = np.array([self.codes.get(symbol, -1) for symbol in symbols])
+        prices = np.asarray(prices, dtype=float)
+        known = codes >= 0
+        # Lowest and highest price of each symbol in the batch
+        lows = np.full(len(self.symbols), np.inf)
+        highs = np.full(len(self.symbols), -np.inf)
+        np.minimum.at(lows, codes[known], prices[known])
+        np.maximum.at(highs, codes[known], prices[known])
+
+        stopped = self.active & (lows[self.symbol_codes] <= self.stop_prices)
+        targeted = self.active & (highs[self.symbol_codes] >= self.target_prices)
+        triggered = np.flatnonzero(stopped | targeted)
+        self.active[triggered] = False
+
+        return [
+            dict(
+                self.rows[row],
+                price=float(
+                    lows[self.symbol_codes[row]]
+                    if stopped[row]
+                    else highs[self.symbol_codes[row]]
+                ),
+                reason=STOP_LOSS if stopped[row] else TAKE_PROFIT,
+            )
+            for row in triggered
+        ]
+
+
+class Monitor:
+    """
+    Long running monitor of stop losses and take profits between ticks.
+
+    The threshold book is rebuilt from the database and Alpaca every
+    `refresh_interval` seconds, so evaluating prices never reads the
+    database. Exits are written to the order ledger, and submitted
+    concurrently as market orders.
+    """
+
+    def __init__(
+        self, api=None, refresh_interval=60, max_workers=MAX_CONCURRENT_ORDERS
+    ):
+        """
+        :param api(TradeApiRest): api used to fetch positions and place orders
+        :param refresh_interval(float): seconds between rebuilding the book
+        :param max_workers(int): maximum number of concurrent order requests
+        """
+        self.api = api or TradeApiRest()
+        self.refresh_interval = refresh_interval
+        self.max_workers = max_workers
+        self.book = ThresholdBook([])
+        self.refreshed_at = None
+
+    def refresh(self):
+        """
+        Rebuild the threshold book.
+
+        Executes one query for the strategies with exits, and one request each
+        for open positions and open orders.
+        """
+        strategies = (
+            Strategy.objects.active()
+            .with_exits()
+            .select_related("asset")
+            .annotate(held_qty=held_qty())
+            .order_by("pk")
+        )
+        positions = [
+            position.__dict__["_raw"] for position in self.api.list_positions()
+        ]
+        pending_symbols = {
+            order.__dict__["_raw"]["symbol"] for order in self.api.open_orders()
+        }
+        self.book = ThresholdBook.build(strategies, positions, pending_symbols)
+        self.refreshed_at = time.monotonic()
+        logger.info(f"Monitoring exits of positions: {len(self.book)}")
+        return self.book
+
+    def is_stale(self):
+        """Return true if the book is due to be rebuilt."""
+        return (
+            self.refreshed_at is None
+            or time.monotonic() - self.refreshed_at >= self.refresh_interval
+        )
+
+    def on_prices(self, symbols, prices):
+        """
+        Evaluate a batch of prices, and submit any exits.
+
+        :param symbols(list): symbol of each price, oldest to newest
+        :param prices(list): trade or quote prices
+        :returns: list of orders placed
+        """
+        if self.is_stale():
+            self.refresh()
+        exits = self.book.evaluate(symbols, prices)
+        if not exits:
+            return []
+        return self.submit(exits)
+
+    def submit(self, exits):
+        """
+        Submit exits concurrently, and record the orders placed.
+
+        Exits are written to the order ledger first, as intents to sell on the
+        bar of the strategy's timeframe in progress, so an exit which may have
+        been placed is never submitted again.
+
+        :param exits(list): exits returned from `ThresholdBook.evaluate`
+        :returns: list of orders placed
+        """
+        now = timezone.now()
+        intents = []
+        for exit in exits:
+            t = current_bar_time(now, exit["timeframe"])
+            intents.append(
+                OrderIntent(
+                    client_order_id=intent_client_order_id(
+                        exit["strategy_id"], t, Order.SELL
+                    ),
+                    user_id=exit["user_id"],
+                    strategy_id=exit["strategy_id"],
+                    asset_id=exit["asset_id"],
+                    t=t,
+                    side=Order.SELL,
+                    type=Order.MARKET,
+                    time_in_force=Order.DAY,
+                    qty=exit["qty"],
+                )
+            )
+        exits_by_strategy = {exit["strategy_id"]: exit for exit in exits}
+
+        orders = []
+        for intent, result in submit_intents(
+            record_intents(intents), self.api, max_concurrency=self.max_workers
+        ):
+            if result["error"] is not None:
+                continue
+            exit = exits_by_strategy[intent.strategy_id]
+            logger.info(
+                f"Exit placed. symbol, reason, price: {exit['symbol']}, {exit['reason']}, {exit['price']}"
+            )
+            orders.append(intent.order)
+        return orders
+
+
+class MonitorStream:
+    """
+    Feed trades and quotes from an Alpaca stream into a monitor.
+
+    Messages are buffered as they arrive, and each buffered batch is
+    evaluated in a worker thread, so the stream keeps being read while a
+    batch is evaluated and database and order requests never block the event
+    loop. Symbols are subscribed to as positions are opened.
+    """
+
+    def __init__(self, monitor, stream, quotes=False):
+        """
+        :param monitor(Monitor): monitor evaluating each batch
+        :param stream(Stream): Alpaca stream with raw data
+        :param quotes(bool): evaluate bid prices of quotes as well as trades
+        """
+        self.monitor = monitor
+        self.stream = stream
+        self.quotes = quotes
+        self.pending = []
+        self.draining = False
+        self.subscribed = set()
+        # Single thread, so the monitor is never used concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def subscribe(self):
+        """Subscribe to the symbols in the monitor's book."""
+        symbols = set(self.monitor.book.symbols) - self.subscribed
+        if not symbols:
+            return
+        self.stream.subscribe_trades(self.on_trade, *sorted(symbols))
+        if self.quotes:
+            self.stream.subscribe_quotes(self.on_quote, *sorted(symbols))
+        self.subscribed |= symbols
+        logger.info(f"Subscribed to symbols: {len(symbols)}")
+
+    def process(self, symbols, prices):
+        """Evaluate a batch in the worker thread."""
+        orders = self.monitor.on_prices(symbols, prices)
+        self.subscribe()
+        return orders
+
+    async def on_trade(self, trade):
+        self.pending.append((trade["S"], trade["p"]))
+        self.schedule()
+
+    async def on_quote(self, quote):
+        self.pending.append((quote["S"], quote["bp"]))
+        self.schedule()
+
+    def schedule(self):
+        """Start draining the buffer, unless a batch is being evaluated."""
+        if not self.draining:
+            self.draining = True
+            asyncio.ensure_future(self.drain())
+
+    async def drain(self):
+        """Evaluate buffered messages until the buffer is empty."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                symbols, prices = zip(*batch)
+                await loop.run_in_executor(
+                    self.executor, self.process, list(symbols), list(prices)
+                )
+        except Exception as e:
+            logger.error(f"Monitor batch failed: {e}")
+        finally:
+            self.draining = False
+
+    def run(self):
+        """Build the book, subscribe to its symbols, and run the stream."""
+        self.executor.submit(self.monitor.refresh).result()
+        self.executor.submit(self.subscribe).result()
+        self.stream.run()
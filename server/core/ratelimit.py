@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Alpaca's limit of requests per minute for each account
+REQUESTS_PER_MINUTE = 200
+
+# Priority classes of requests, higher classes are granted requests first
+BACKFILL = 0
+TRADING = 1
+ORDERS = 2
+
+# Share of the bucket each class leaves for the classes above it
+RESERVED = {BACKFILL: 0.5, TRADING: 0.1, ORDERS: 0}
+
+# Weight and class of requests, by method and path prefix. The first match
+# applies, and other requests weigh 1 token of the TRADING class.
+ENDPOINTS = [
+    ("POST", "/orders", 1, ORDERS),
+    ("DELETE", "/orders", 1, ORDERS),
+    ("GET", "/orders:by_client_order_id", 1, ORDERS),
+    ("GET", "/bars", 2, TRADING),
+    ("GET", "/account/portfolio/history", 2, TRADING),
+]
+
+# Seconds to stop limiting requests after Redis could not be reached
+UNAVAILABLE_BACKOFF = 30
+# Seconds to wait for Redis, before requests are made without limiting
+REDIS_TIMEOUT = 1
+
+# Takes `cost` tokens from the bucket, refilled at `rate` tokens per second,
+# unless fewer than `reserve` tokens would be left or a higher class is
+# waiting. Returns 0 when the tokens are taken, or else the seconds to wait,
+# and records the class as waiting until then.
+TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local priority = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local blocked = false
+local waiting = redis.call('HGETALL', KEYS[2])
+for i = 1, #waiting, 2 do
+    if tonumber(waiting[i]) > priority and tonumber(waiting[i + 1]) > now then
+        blocked = true
+    end
+end
+
+local wait = 0
+if blocked or tokens - cost < reserve then
+    wait = math.max((cost + reserve - tokens) / rate, 1 / rate)
+    local until_time = now + wait + 1 / rate
+    if until_time > (tonumber(redis.call('HGET', KEYS[2], priority)) or 0) then
+        redis.call('HSET', KEYS[2], priority, tostring(until_time))
+    end
+else
+    tokens = tokens - cost
+end
+
+local ttl = math.ceil(capacity / rate * 2000)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ttl)
+redis.call('PEXPIRE', KEYS[2], ttl)
+return tostring(wait)
+"""
+
+request_priority = contextvars.ContextVar("request_priority", default=None)
+
+
+@contextmanager
+def api_priority(priority):
+    """
+    Make the Alpaca requests of the current thread or task in a priority
+    class, e.g. `with api_priority(BACKFILL): ...`.
+
+    :param priority(int): priority class of the requests
+    """
+    token = request_priority.set(priority)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+def endpoint_cost(method, path):
+    """
+    Return the weight and priority class of a request.
+
+    The class is that of the current context, if set, or else the
+    endpoint's.
+
+    :param method(str): HTTP method
+    :param path(str): path of the endpoint, without the api version
+    :returns: tuple of (weight, priority)
+    """
+    weight, priority = 1, TRADING
+    for endpoint_method, prefix, endpoint_weight, endpoint_priority in ENDPOINTS:
+        if method == endpoint_method and path.startswith(prefix):
+            weight, priority = endpoint_weight, endpoint_priority
+            break
+    context_priority = request_priority.get()
+    return weight, priority if context_priority is None else context_priority
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every process through Redis, limiting the Alpaca
+    requests made by all workers together.
+
+    Requests wait for tokens rather than fail. Each class leaves a reserve
+    of tokens for the classes above it, and waits while a higher class is
+    waiting, so orders preempt bulk requests such as backfill.
+
+    When Redis cannot be reached, requests are not limited, so trading
+    continues on Alpaca's own limit.
+    """
+
+    def __init__(
+        self, client=None, rate=REQUESTS_PER_MINUTE, period=60, key="alpaca:ratelimit"
+    ):
+        """
+        :param client(Redis): Redis client, defaults to the Celery broker
+        :param rate(int): requests per period
+        :param period(float): seconds in a period
+        :param key(str): prefix of the Redis keys of the bucket
+        """
+        self.client = client or redis.Redis.from_url(
+            settings.CELERY_BROKER_URL,
+            socket_connect_timeout=REDIS_TIMEOUT,
+            socket_timeout=REDIS_TIMEOUT,
+        )
+        self.script = self.client.register_script(TOKEN_BUCKET)
+        self.capacity = rate
+        self.rate = rate / period
+        self.keys = [f"{key}:bucket", f"{key}:waiting"]
+        self.unavailable_until = 0
+
+    def reserve(self, cost=1, priority=TRADING):
+        """
+        Take tokens from the bucket if they are available.
+
+        :param cost(int): tokens taken
+        :param priority(int): priority class of the request
+        :returns: 0 if the tokens were taken, or else the seconds to wait
+        before trying again
+        """
+        if time.monotonic() < self.unavailable_until:
+            return 0
+        reserve = RESERVED[priority] * self.capacity
+        try:
+            return float(
+                self.script(
+                    keys=self.keys,
+                    args=[
+                        self.capacity,
+                        self.rate,
+                        min(cost, self.capacity - reserve),
+                        priority,
+                        reserve,
+                    ],
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable: {e}")
+            self.unavailable_until = time.monotonic() + UNAVAILABLE_BACKOFF
+            return 0
+
+    async def acquire(self, method, path):
+        """
+        Wait until a request may be made.
+
+        :param method(str): HTTP method
+        :param path(str): path of the endpoint, without the api version
+        :returns: seconds waited
+        """
+        cost, priority = endpoint_cost(method, path)
+        loop = asyncio.get_running_loop()
+        waited = 0
+        while True:
+            # Redis is called in the executor, so other requests in the loop
+            # are not blocked
+            wait = await loop.run_in_executor(None, self.reserve, cost, priority)
+            if not wait:
+                break
+            waited += wait
+            await asyncio.sleep(wait)
+        if waited:
+            logger.info(f"Request rate limited for seconds: {method} {path}, {waited}")
+        return waited
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the rate limiter shared by the process, created on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
@@ -0,0 +1,468 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pytz
+from alpaca_trade_api.entity import Account as AlpacaAccount
+from alpaca_trade_api.entity import Bar as AlpacaBar
+from alpaca_trade_api.entity import Clock as AlpacaClock
+from alpaca_trade_api.entity import Order as AlpacaOrder
+from alpaca_trade_api.entity import Position as AlpacaPosition
+from assets.models import Asset, Bar
+from config import celery_app
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from orders.models import Order
+from users.models import User
+
+from core.backtest import DEFAULT_CASH
+from core.clock import market_clock
+from core.models import Strategy
+from core.rolling import rolling_store
+from core.tasks import run_strategies_for_users
+from core.trading_calendar import TIMEFRAME_SECONDS, bar_times, session_bounds
+
+logger = logging.getLogger(__name__)
+
+BAR_FIELDS = ("t", "o", "h", "l", "c", "v")
+
+# Modules which create a `TradeApiRest` during a tick
+TRADE_API_TARGETS = (
+    "core.tasks.TradeApiRest",
+    "core.clock.TradeApiRest",
+    "assets.tasks.TradeApiRest",
+)
+
+
+def isoformat(t):
+    """Return a Unix epoch as an ISO formatted UTC timestamp."""
+    return datetime.fromtimestamp(t, pytz.utc).isoformat()
+
+
+def load_recording(path):
+    """
+    Load bars recorded as JSON, e.g. `assets/tests/sample_tsla_bars.json`.
+
+    :param path(str): path of a JSON list of bars with an `asset` symbol
+    :returns: dict of symbol to dict of bar arrays ordered oldest to newest
+    """
+    with open(path) as f:
+        rows = json.load(f)
+
+    recording = {}
+    for symbol in sorted({row["asset"] for row in rows}):
+        bars = sorted(
+            (row for row in rows if row["asset"] == symbol), key=lambda row: row["t"]
+        )
+        recording[symbol] = {
+            field: np.array([bar[field] for bar in bars], dtype=float)
+            for field in BAR_FIELDS
+        }
+        recording[symbol]["t"] = recording[symbol]["t"].astype(np.int64)
+    return recording
+
+
+def load_stored(symbols, start, end):
+    """
+    Load bars stored in `Bar` for a date range.
+
+    :param symbols(list): symbols to load
+    :param start(int): Unix epoch of the earliest bar
+    :param end(int): Unix epoch of the latest bar
+    :returns: dict of symbol to dict of bar arrays ordered oldest to newest
+    """
+    recording = {}
+    for asset in Asset.objects.filter(symbol__in=symbols):
+        rows = (
+            Bar.objects.filter(asset=asset, t__gte=start, t__lte=end)
+            .order_by("t")
+            .values_list(*BAR_FIELDS)
+        )
+        values = np.array(list(rows), dtype=float).reshape(-1, len(BAR_FIELDS)).T
+        recording[asset.symbol] = dict(zip(BAR_FIELDS, values))
+        recording[asset.symbol]["t"] = recording[asset.symbol]["t"].astype(np.int64)
+    return recording
+
+
+def retime(recording, start, timeframe="15Min"):
+    """
+    Move recorded bars onto consecutive bars of the trading calendar.
+
+    Allows bars of any timeframe, e.g. the daily sample bars, to be replayed
+    as intraday bars.
+
+    :param recording(dict): bars returned from `load_recording`
+    :param start(int): Unix epoch of the first bar
+    :param timeframe(str): timeframe of the replayed bars
+    """
+    count = max((len(bars["t"]) for bars in recording.values()), default=0)
+    days = count // 26 * 7 // 5 + 14
+    times = np.array([], dtype=np.int64)
+    while len(times) < count:
+        times = bar_times(start, start + days * 86400, timeframe)
+        days *= 2
+    for bars in recording.values():
+        bars["t"] = times[: len(bars["t"])]
+    return recording
+
+
+class AsyncFakeTradeApi:
+    """Asynchronous facade of a `FakeTradeApi`, as `AsyncTradeApiRest`."""
+
+    def __init__(self, api):
+        self.api = api
+
+    def __getattr__(self, name):
+        method = getattr(self.api, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class FakeTradeApi:
+    """
+    In process stand in for `TradeApiRest`, backed by recorded bars.
+
+    Bars are only visible once they have completed at the current, possibly
+    frozen, time. Market orders fill immediately at the latest close.
+    """
+
+    def __init__(self, recording, cash=DEFAULT_CASH, timeframe="15Min"):
+        """
+        :param recording(dict): bars keyed by symbol
+        :param cash(float): starting cash of the account
+        :param timeframe(str): timeframe of the recorded bars
+        """
+        self.recording = recording
+        self.cash = float(cash)
+        self.step = TIMEFRAME_SECONDS[timeframe]
+        self.positions = {}
+        self.requests = Counter()
+
+    def now(self):
+        return int(timezone.now().timestamp())
+
+    def completed(self, symbol):
+        """Return the number of recorded bars completed by now."""
+        bars = self.recording.get(symbol)
+        if bars is None:
+            return 0
+        return int(np.searchsorted(bars["t"], self.now() - self.step, side="right"))
+
+    def latest_close(self, symbol):
+        count = self.completed(symbol)
+        if not count:
+            return None
+        return float(self.recording[symbol]["c"][count - 1])
+
+    def get_clock(self):
+        self.requests["get_clock"] += 1
+        now = self.now()
+        # Sessions which have not closed yet, the first may already be open
+        opens, closes = session_bounds(now, now + 14 * 86400)
+        is_open = bool(opens[0] <= now)
+        next_open = opens[1] if is_open else opens[0]
+        next_close = closes[0]
+        return AlpacaClock(
+            {
+                "timestamp": isoformat(now),
+                "is_open": is_open,
+                "next_open": isoformat(int(next_open)),
+                "next_close": isoformat(int(next_close)),
+            }
+        )
+
+    def is_market_open(self):
+        return self.get_clock().__dict__["_raw"]["is_open"]
+
+    def market_value(self, symbol):
+        return self.positions[symbol] * (self.latest_close(symbol) or 0)
+
+    def account_info(self):
+        self.requests["account_info"] += 1
+        equity = self.cash + sum(self.market_value(s) for s in self.positions)
+        return AlpacaAccount(
+            {
+                "cash": str(self.cash),
+                "equity": str(equity),
+                "buying_power": str(self.cash),
+                "status": "ACTIVE",
+                "currency": "USD",
+            }
+        )
+
+    def list_positions(self):
+        self.requests["list_positions"] += 1
+        return [
+            AlpacaPosition(
+                {
+                    "symbol": symbol,
+                    "qty": str(qty),
+                    "side": "long",
+                    "market_value": str(self.market_value(symbol)),
+                }
+            )
+            for symbol, qty in self.positions.items()
+        ]
+
+    def submit_order(self, symbol, side, type, time_in_force, qty=None, **kwargs):
+        self.requests["submit_order"] += 1
+        price = self.latest_close(symbol)
+        if price is None:
+            raise ValueError(f"No price for symbol: {symbol}")
+        notional = kwargs.get("notional")
+        qty = float(qty) if qty is not None else float(notional) / price
+
+        if side == Order.BUY:
+            self.cash -= qty * price
+            self.positions[symbol] = self.positions.get(symbol, 0) + qty
+        else:
+            qty = min(qty, self.positions.get(symbol, 0))
+            self.cash += qty * price
+            self.positions[symbol] -= qty
+            if self.positions[symbol] <= 1e-9:
+                del self.positions[symbol]
+
+        now = isoformat(self.now())
+        return AlpacaOrder(
+            {
+                "id": str(uuid.uuid4()),
+                "client_order_id": kwargs.get("client_order_id") or str(uuid.uuid4()),
+                "created_at": now,
+                "updated_at": now,
+                "submitted_at": now,
+                "filled_at": now,
+                "symbol": symbol,
+                "notional": notional,
+                "qty": None if notional is not None else round(qty, 5),
+                "filled_qty": round(qty, 5),
+                "filled_avg_price": round(price, 5),
+                "order_class": Order.SIMPLE,
+                "type": type,
+                "side": side,
+                "time_in_force": time_in_force,
+                "status": "filled",
+                "extended_hours": False,
+            }
+        )
+
+    def get_bars(
+        self,
+        symbols,
+        timeframe,
+        limit=None,
+        start=None,
+        end=None,
+        after=None,
+        until=None,
+    ):
+        self.requests["get_bars"] += 1
+        if isinstance(symbols, str):
+            symbols = symbols.split(",")
+
+        assets_bars = {}
+        for symbol in symbols:
+            count = self.completed(symbol)
+            bars = {
+                field: values[:count]
+                for field, values in self.recording.get(symbol, {}).items()
+            }
+            if not count:
+                continue
+            times = bars["t"]
+            keep = np.ones(count, dtype=bool)
+            for bound, compare in (
+                (start, np.greater_equal),
+                (after, np.greater),
+                (end, np.less_equal),
+                (until, np.less),
+            ):
+                if bound is not None:
+                    epoch = datetime.fromisoformat(bound).timestamp()
+                    keep &= compare(times, epoch)
+            indexes = np.flatnonzero(keep)[-(limit or 100) :]
+            assets_bars[symbol] = [
+                AlpacaBar(
+                    {
+                        "t": int(bars["t"][i]),
+                        "o": float(bars["o"][i]),
+                        "h": float(bars["h"][i]),
+                        "l": float(bars["l"][i]),
+                        "c": float(bars["c"][i]),
+                        "v": int(bars["v"][i]),
+                    }
+                )
+                for i in indexes
+            ]
+        return assets_bars
+
+    def async_api(self):
+        return AsyncFakeTradeApi(self)
+
+    def run(self, coroutine):
+        return asyncio.run(coroutine)
+
+
+class ReplaySimulator:
+    """
+    Replay recorded bars through the production tick.
+
+    Each tick freezes time at the close of the next recorded bar, and runs
+    `run_strategies_for_users` with Celery tasks executed eagerly and every
+    `TradeApiRest` replaced with a `FakeTradeApi`. The replay runs in a
+    transaction which is rolled back, so replayed bars, strategies, and
+    orders are never kept.
+    """
+
+    def __init__(
+        self,
+        recording,
+        strategies_per_symbol=1,
+        strategy_type=Strategy.MOVING_AVERAGE_7D,
+        trade_value=1000,
+        cash=DEFAULT_CASH,
+        timeframe="15Min",
+    ):
+        """
+        :param recording(dict): bars keyed by symbol
+        :param strategies_per_symbol(int): users trading each symbol
+        :param strategy_type(str): type of each replayed strategy
+        :param trade_value(float): trade value of each replayed strategy
+        :param cash(float): starting cash of the account
+        :param timeframe(str): timeframe of the recorded bars
+        """
+        self.recording = recording
+        self.strategies_per_symbol = strategies_per_symbol
+        self.strategy_type = strategy_type
+        self.trade_value = trade_value
+        self.timeframe = timeframe
+        self.api = FakeTradeApi(recording, cash=cash, timeframe=timeframe)
+        self.ticks = []
+
+    def tick_times(self):
+        """Return the time each recorded bar completes."""
+        times = [bars["t"] for bars in self.recording.values() if len(bars["t"])]
+        if not times:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(times)) + TIMEFRAME_SECONDS[self.timeframe]
+
+    def setup(self, first, last):
+        """Replace stored bars with the replay, and create replay strategies."""
+        assets = Asset.objects.filter(symbol__in=self.recording)
+        missing = set(self.recording) - {asset.symbol for asset in assets}
+        if missing:
+            raise ValueError(f"Unknown symbols: {sorted(missing)}")
+
+        # Bars are only stored as they are fetched during the replay
+        Bar.objects.filter(asset__in=assets, t__gte=first).delete()
+
+        start_date = datetime.fromtimestamp(first, pytz.utc) - timedelta(days=1)
+        end_date = datetime.fromtimestamp(last, pytz.utc) + timedelta(days=1)
+        for index in range(self.strategies_per_symbol):
+            user = User.objects.create_user(
+                email=f"replay-{uuid.uuid4().hex}@tradingbot.com",
+                password=None,
+                first_name=f"Replay {index}",
+            )
+            Strategy.objects.bulk_create(
+                [
+                    Strategy(
+                        user=user,
+                        type=self.strategy_type,
+                        asset=asset,
+                        start_date=start_date,
+                        end_date=end_date,
+                        timeframe=self.timeframe,
+                        trade_value=self.trade_value,
+                    )
+                    for asset in assets
+                ]
+            )
+
+    def run(self, speed=None):
+        """
+        Replay every recorded bar.
+
+        :param speed(float): replayed seconds per wall clock second, or as fast
+        as possible if not given
+        :returns: dict summarising the replay
+        """
+        times = self.tick_times()
+        self.ticks = []
+        if not len(times):
+            return self.summary()
+
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        patches = [patch(target, return_value=self.api) for target in TRADE_API_TARGETS]
+        try:
+            for p in patches:
+                p.start()
+            # The bar cache is disabled, as it would keep the replayed bars
+            # after they are rolled back
+            with override_settings(BAR_CACHE_DIR=None), transaction.atomic():
+                self.setup(int(times[0]), int(times[-1]))
+                market_clock.clear()
+                rolling_store.clear()
+                previous = None
+                for tick in times:
+                    if speed and previous is not None:
+                        time.sleep((tick - previous) / speed)
+                    previous = tick
+                    self.tick(int(tick))
+                transaction.set_rollback(True)
+        finally:
+            for p in patches:
+                p.stop()
+            celery_app.conf.task_always_eager = eager
+            market_clock.clear()
+            rolling_store.clear()
+
+        return self.summary()
+
+    def tick(self, tick):
+        """Run the production tick at a simulated time."""
+        orders = Order.objects.count()
+        # Captured queries are read from the log, which has a maximum length
+        connection.queries_log.clear()
+        with freeze_time(datetime.fromtimestamp(tick, pytz.utc)):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                run_strategies_for_users()
+                elapsed = time.perf_counter() - started
+        self.ticks.append(
+            {
+                "t": tick,
+                "elapsed": elapsed,
+                "queries": len(queries),
+                "orders": Order.objects.count() - orders,
+            }
+        )
+
+    def summary(self):
+        """Summarise the latency, queries, and orders of every tick."""
+        elapsed = np.array([tick["elapsed"] for tick in self.ticks])
+        queries = np.array([tick["queries"] for tick in self.ticks])
+        return {
+            "ticks": len(self.ticks),
+            "orders": sum(tick["orders"] for tick in self.ticks),
+            "elapsed_total": float(elapsed.sum()) if len(elapsed) else 0.0,
+            "elapsed_mean": float(elapsed.mean()) if len(elapsed) else 0.0,
+            "elapsed_p95": float(np.percentile(elapsed, 95)) if len(elapsed) else 0.0,
+            "elapsed_max": float(elapsed.max()) if len(elapsed) else 0.0,
+            "queries_mean": float(queries.mean()) if len(queries) else 0.0,
+            "queries_max": int(queries.max()) if len(queries) else 0,
+            "requests": dict(self.api.requests),
+            "cash": self.api.cash,
+            "positions": dict(self.api.positions),
+        }
@@ -0,0 +1,332 @@
+import logging
+from itertools import groupby
+
+import numpy as np
+from assets.cache import get_bar_cache, stored_extent
+from assets.models import Bar
+from django.conf import settings
+
+from core.trading_calendar import (
+    TIMEFRAME_SECONDS,
+    completed_bar_times,
+    latest_bar_times,
+    session_bounds,
+)
+
+logger = logging.getLogger(__name__)
+
+BAR_FIELDS = ("t", "o", "h", "l", "c", "v")
+
+
+def can_resample(timeframe, source=None):
+    """
+    Return true if bars of a timeframe can be derived from the source bars.
+
+    :param timeframe(str): timeframe of the bars, e.g. 1H
+    :param source(str): timeframe of the source bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    """
+    step = TIMEFRAME_SECONDS.get(timeframe, np.inf)
+    return step >= TIMEFRAME_SECONDS[source or settings.BAR_BASE_TIMEFRAME]
+
+
+def resample(bars, timeframe, source=None):
+    """
+    Aggregate bars into a longer timeframe in one vectorised pass.
+
+    Bars are grouped within each regular trading session, aligned to the
+    session open, so the last bar of a session may be shorter. Timeframes not
+    in `TIMEFRAME_SECONDS` (i.e. 1D) have one bar per session. Bars outside
+    regular trading hours are dropped.
+
+    :param bars(dict): arrays of `t`, `o`, `h`, `l`, `c`, and optionally `v`
+    :param timeframe(str): timeframe to aggregate into, e.g. 1H
+    :param source(str): timeframe of the given bars, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :raises ValueError: if the timeframe is shorter than the source timeframe
+    """
+    source = source or settings.BAR_BASE_TIMEFRAME
+    if not can_resample(timeframe, source):
+        raise ValueError(f"Unable to resample {source} bars into {timeframe} bars")
+    if timeframe == source or not len(bars["t"]):
+        return bars
+
+    times = bars["t"]
+    opens, closes = session_bounds(int(times[0]), int(times[-1]))
+    sessions = np.searchsorted(opens, times, side="right") - 1
+    in_session = (sessions >= 0) & (times < closes[np.maximum(sessions, 0)])
+    bars = {key: values[in_session] for key, values in bars.items()}
+    times, sessions = bars["t"], sessions[in_session]
+    if not len(times):
+        return bars
+
+    step = TIMEFRAME_SECONDS.get(timeframe)
+    if step is None:
+        offsets = np.zeros(len(times), dtype=np.int64)
+    else:
+        offsets = (times - opens[sessions]) // step
+    changes = (np.diff(sessions) != 0) | (np.diff(offsets) != 0)
+    starts = np.flatnonzero(np.concatenate(([True], changes)))
+    ends = np.append(starts[1:], len(times)) - 1
+
+    resampled = {
+        "t": opens[sessions[starts]] + offsets[starts] * (step or 0),
+        "o": bars["o"][starts],
+        "h": np.maximum.reduceat(bars["h"], starts),
+        "l": np.minimum.reduceat(bars["l"], starts),
+        "c": bars["c"][ends],
+    }
+    if "v" in bars:
+        resampled["v"] = np.add.reduceat(bars["v"], starts)
+    return resampled
+
+
+class DerivedSeries:
+    """
+    Bars of one asset resampled into a longer timeframe.
+
+    Holds the latest `length` derived bars, plus the bar still in progress.
+    `start` is the time stored bars were loaded from, and `last_id` the
+    highest primary key of the stored bars seen.
+    """
+
+    def __init__(self, timeframe, length, start, bars, last_id):
+        self.timeframe = timeframe
+        self.length = length
+        self.start = start
+        self.bars = bars
+        self.last_id = last_id
+
+    def splice(self, bars):
+        """
+        Replace the last derived bar, and append any newer derived bars.
+
+        :param bars(dict): derived bars from the start of the last bar
+        """
+        if not len(bars["t"]):
+            return
+        keep = np.searchsorted(self.bars["t"], bars["t"][0])
+        self.bars = {
+            field: np.concatenate((self.bars[field][:keep], bars[field]))
+            for field in BAR_FIELDS
+        }
+        # Keep one bar more than needed for the bar in progress
+        if len(self.bars["t"]) > self.length + 1:
+            self.bars = {
+                field: values[-(self.length + 1) :]
+                for field, values in self.bars.items()
+            }
+            self.start = int(self.bars["t"][0])
+
+    def completed(self, now):
+        """
+        Return the latest `length` derived bars which have completed.
+
+        :param now(datetime | int): current time
+        """
+        times = self.bars["t"]
+        if not len(times):
+            return self.bars
+        done = np.isin(times, completed_bar_times(int(times[0]), now, self.timeframe))
+        return {
+            field: values[done][-self.length :] for field, values in self.bars.items()
+        }
+
+
+class ResampleCache:
+    """
+    Derived series of each (asset, timeframe) evaluated by strategies.
+
+    Only bars of `BAR_BASE_TIMEFRAME` are stored, and longer timeframes are
+    derived from them. State lives for the lifetime of the worker process.
+    New stored bars only re-derive the last derived bar onwards, and a series
+    is only rebuilt on a restart, when a longer series is requested, or when a
+    bar is stored within the series (i.e. a gap was backfilled, or a bar was
+    corrected).
+    """
+
+    def __init__(self):
+        self.series = {}
+
+    def clear(self):
+        """Drop all derived series, forcing a rebuild on the next refresh."""
+        self.series = {}
+
+    def refresh(self, keys, now):
+        """
+        Bring the derived series for the given keys up to date.
+
+        Executes one query for new bars of every tracked asset, plus one query
+        for the bars of any series which are extended or rebuilt.
+
+        :param keys(iterable): tuples of (asset id, timeframe, length)
+        :param now(datetime | int): current time
+        :returns: dict of (asset id, timeframe) to the latest completed
+        derived bars
+        """
+        lengths = {}
+        for asset_id, timeframe, length in keys:
+            key = (str(asset_id), timeframe)
+            lengths[key] = max(lengths.get(key, 0), length)
+
+        tracked = [
+            key
+            for key, length in lengths.items()
+            if key in self.series and self.series[key].length >= length
+        ]
+        rebuild = {}
+        for key, length in lengths.items():
+            if key in tracked:
+                continue
+            times = latest_bar_times(length, now, key[1])
+            if len(times):
+                rebuild[key] = int(times[0])
+
+        extend = {}
+        if tracked:
+            extend, stale = self.new_bar_starts(tracked)
+            rebuild.update({key: self.series[key].start for key in stale})
+        if rebuild or extend:
+            self.load(rebuild, extend, lengths)
+
+        return {
+            key: self.series[key].completed(now)
+            for key in lengths
+            if key in self.series
+        }
+
+    def new_bar_starts(self, keys):
+        """
+        Find the tracked series with bars stored since they were last updated.
+
+        :param keys(list): tuples of (asset id, timeframe) already tracked
+        :returns: tuple of (dict of key to the time bars must be derived from,
+        set of keys which must be rebuilt)
+        """
+        last_id = min(self.series[key].last_id for key in keys)
+        new_bars = (
+            Bar.objects.filter(
+                asset_id__in={asset_id for asset_id, _ in keys}, id__gt=last_id
+            )
+            .order_by("asset_id", "t")
+            .values_list("asset_id", "id", "t")
+        )
+        bars_by_asset = {
+            str(asset_id): list(rows)
+            for asset_id, rows in groupby(new_bars, key=lambda row: row[0])
+        }
+
+        extend = {}
+        stale = set()
+        for key in keys:
+            series = self.series[key]
+            rows = [
+                row for row in bars_by_asset.get(key[0], []) if row[1] > series.last_id
+            ]
+            if not rows:
+                continue
+            series.last_id = max(row[1] for row in rows)
+            # Bars older than the series are not derived
+            times = [row[2] for row in rows if row[2] >= series.start]
+            if not times:
+                continue
+            last_t = series.bars["t"][-1] if len(series.bars["t"]) else None
+            if last_t is None or times[0] < last_t:
+                # Bar stored within the series, so derive it again
+                stale.add(key)
+                continue
+            extend[key] = int(last_t)
+        return extend, stale
+
+    def load(self, rebuild, extend, lengths):
+        """
+        Derive series from the stored bars after each start time.
+
+        Bars are read from the bar cache if enabled.
+
+        :param rebuild(dict): key to the time a new series starts at
+        :param extend(dict): key to the time of the last derived bar of a
+        tracked series
+        :param lengths(dict): key to the number of derived bars required
+        """
+        starts = {**extend, **rebuild}
+        bars_by_asset, last_ids = stored_bars(
+            {asset_id for asset_id, _ in starts}, min(starts.values())
+        )
+
+        if rebuild:
+            logger.info(f"Rebuilding derived series: {len(rebuild)}")
+        for key, start in starts.items():
+            asset_id, timeframe = key
+            stored = bars_by_asset[asset_id]
+            first = np.searchsorted(stored["t"], start, side="left")
+            bars = resample(
+                {field: values[first:] for field, values in stored.items()}, timeframe
+            )
+            last_id = last_ids.get(asset_id, 0)
+
+            if key in rebuild:
+                self.series[key] = DerivedSeries(
+                    timeframe,
+                    lengths[key],
+                    start,
+                    {field: values[:0] for field, values in bars.items()},
+                    last_id,
+                )
+            series = self.series[key]
+            series.splice(bars)
+            series.last_id = max(series.last_id, last_id)
+
+
+def stored_bars(asset_ids, start):
+    """
+    Return the stored bars of each asset from a start time.
+
+    Bars are read from the bar cache if enabled, with one query for the
+    extents of the stored bars, and cached bars which differ from them are
+    rebuilt, or else with one query. Ids are read before the cached bars, so
+    bars stored meanwhile are seen as new on the next refresh.
+
+    :param asset_ids(iterable): ids of the assets
+    :param start(int): Unix epoch of the earliest bar
+    :returns: tuple of (dict of asset id to arrays keyed by bar field, ordered
+    oldest to newest, dict of asset id to the highest id of its bars)
+    """
+    cache = get_bar_cache()
+    if cache is not None:
+        extents = Bar.objects.filter(asset_id__in=asset_ids).extents()
+        bars_by_asset = {
+            str(asset_id): {
+                field: values
+                for field, values in cache.load(
+                    asset_id, start, stored=stored_extent(extents, asset_id)
+                ).items()
+                if field in BAR_FIELDS
+            }
+            for asset_id in asset_ids
+        }
+        last_ids = {asset_id: extent[0] for asset_id, extent in extents.items()}
+        return bars_by_asset, last_ids
+
+    rows = (
+        Bar.objects.filter(asset_id__in=asset_ids, t__gte=start)
+        .order_by("asset_id", "t")
+        .values_list("asset_id", "id", *BAR_FIELDS)
+    )
+    values_by_asset = {
+        str(asset_id): np.array([row[1:] for row in asset_rows], dtype=float)
+        for asset_id, asset_rows in groupby(rows, key=lambda row: row[0])
+    }
+    bars_by_asset = {}
+    last_ids = {}
+    for asset_id in asset_ids:
+        values = values_by_asset.get(str(asset_id), np.empty((0, len(BAR_FIELDS) + 1)))
+        if len(values):
+            last_ids[str(asset_id)] = int(values[:, 0].max())
+        bars = {field: values[:, column + 1] for column, field in enumerate(BAR_FIELDS)}
+        bars["t"] = bars["t"].astype(np.int64)
+        bars_by_asset[str(asset_id)] = bars
+    return bars_by_asset, last_ids
+
+
+resample_cache = ResampleCache()
@@ -0,0 +1,231 @@
+import logging
+from itertools import groupby
+
+import numpy as np
+from assets.cache import get_bar_cache, stored_extent
+from assets.models import Bar
+
+logger = logging.getLogger(__name__)
+
+
+class RollingWindow:
+    """
+    Rolling moving average state of the latest closes for an asset.
+
+    Closes are kept in a ring buffer one bar longer than the window, so both
+    the latest moving average and the moving average of the previous period
+    are available. Each new bar updates the running sum in constant time.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = np.zeros(window + 1)
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+        self.last_id = 0
+        self.last_t = None
+
+    @property
+    def is_full(self):
+        """Return true if the buffer holds enough closes for both periods."""
+        return self.count > self.window
+
+    def push(self, close, t=None, bar_id=None):
+        """
+        Add the close of a new bar.
+
+        :param close(float): close price of the new bar
+        :param t(int): the beginning time of the new bar as a Unix epoch
+        :param bar_id(int): primary key of the new bar
+        """
+        size = self.window + 1
+        if self.count >= self.window:
+            # Close leaving the latest period
+            self.total -= self.buffer[(self.position - self.window) % size]
+        self.buffer[self.position] = close
+        self.total += close
+        self.position = (self.position + 1) % size
+        self.count += 1
+
+        if self.position == 0:
+            # Resum once per revolution to stop floating point error building up
+            self.total = float(np.sum(self.latest()))
+
+        if t is not None:
+            self.last_t = t
+        if bar_id is not None:
+            self.last_id = max(self.last_id, bar_id)
+
+    def latest(self):
+        """Return the closes of the latest period, oldest to newest."""
+        size = self.window + 1
+        length = min(self.count, self.window)
+        indexes = np.arange(self.position - length, self.position) % size
+        return self.buffer[indexes]
+
+    def latest_close(self):
+        """Return the close of the latest bar."""
+        if not self.count:
+            return np.nan
+        return self.buffer[(self.position - 1) % (self.window + 1)]
+
+    def previous_close(self):
+        """Return the close of the bar before the latest bar."""
+        if self.count < 2:
+            return np.nan
+        return self.buffer[(self.position - 2) % (self.window + 1)]
+
+    def moving_average(self):
+        """Return the moving average of the latest period."""
+        if not self.count:
+            return np.nan
+        return self.total / min(self.count, self.window)
+
+    def previous_moving_average(self):
+        """Return the moving average of the period ending at the previous bar."""
+        if self.count < 2:
+            return np.nan
+        total = self.total - self.latest_close()
+        if self.is_full:
+            # Oldest close in the buffer is only part of the previous period
+            total += self.buffer[self.position]
+        return total / min(self.count - 1, self.window)
+
+
+class RollingStore:
+    """
+    Persistent rolling windows for each (asset, window) evaluated by strategies.
+
+    State lives for the lifetime of the worker process. New bars are applied
+    incrementally, and a window is only rebuilt from `Bar` rows on a restart,
+    when a bar is stored out of order (i.e. a gap was backfilled, or a bar was
+    corrected), or when more new bars arrived than the window holds.
+    """
+
+    def __init__(self):
+        self.states = {}
+
+    def clear(self):
+        """Drop all rolling windows, forcing a rebuild on the next refresh."""
+        self.states = {}
+
+    def refresh(self, keys):
+        """
+        Bring the rolling windows for the given keys up to date.
+
+        Executes one query for new bars of every tracked asset, plus one query
+        to rebuild any windows that are missing or stale.
+
+        :param keys(iterable): tuples of (asset id, window)
+        :returns: dict of key to `RollingWindow`
+        """
+        keys = {(str(asset_id), window) for asset_id, window in keys}
+        tracked = [key for key in keys if key in self.states]
+        rebuild = {key for key in keys if key not in self.states}
+
+        if tracked:
+            rebuild |= self.apply_new_bars(tracked)
+        if rebuild:
+            self.rebuild(rebuild)
+
+        return {key: self.states[key] for key in keys}
+
+    def apply_new_bars(self, keys):
+        """
+        Push bars stored since each window was last updated.
+
+        :param keys(list): tuples of (asset id, window) already tracked
+        :returns: set of keys which must be rebuilt
+        """
+        rebuild = set()
+        last_id = min(self.states[key].last_id for key in keys)
+        new_bars = (
+            Bar.objects.filter(
+                asset_id__in={asset_id for asset_id, _ in keys}, id__gt=last_id
+            )
+            .order_by("asset_id", "t")
+            .values_list("asset_id", "id", "t", "c")
+        )
+        bars_by_asset = {
+            str(asset_id): list(rows)
+            for asset_id, rows in groupby(new_bars, key=lambda row: row[0])
+        }
+
+        for key in keys:
+            state = self.states[key]
+            rows = [
+                row for row in bars_by_asset.get(key[0], []) if row[1] > state.last_id
+            ]
+            if not rows:
+                continue
+            if (
+                not state.is_full
+                or len(rows) > state.window
+                or rows[0][2] <= state.last_t
+            ):
+                rebuild.add(key)
+                continue
+            for _, bar_id, t, c in rows:
+                state.push(float(c), t=t, bar_id=bar_id)
+
+        return rebuild
+
+    def rebuild(self, keys):
+        """
+        Rebuild rolling windows from the latest stored bars.
+
+        Bars are read from the bar cache if enabled. Ids are read before the
+        bars, so bars stored meanwhile are applied on the next refresh.
+
+        :param keys(iterable): tuples of (asset id, window)
+        """
+        logger.info(f"Rebuilding rolling windows: {len(keys)}")
+        asset_ids = {asset_id for asset_id, _ in keys}
+        extents = Bar.objects.filter(asset_id__in=asset_ids).extents()
+        closes = latest_closes(
+            asset_ids, max(window for _, window in keys) + 1, extents
+        )
+
+        for key in keys:
+            asset_id, window = key
+            state = RollingWindow(window)
+            for t, c in closes.get(asset_id, [])[-(window + 1) :]:
+                state.push(float(c), t=t)
+            state.last_id = extents.get(asset_id, (0,))[0]
+            self.states[key] = state
+
+
+def latest_closes(asset_ids, length, extents):
+    """
+    Return the times and closes of the latest bars of each asset.
+
+    Bars are read from the bar cache if enabled, and rebuilt if they differ
+    from the stored bars, or else with one query.
+
+    :param asset_ids(iterable): ids of the assets
+    :param length(int): maximum number of bars returned per asset
+    :param extents(dict): extents of the stored bars of the assets, returned
+    from `BarQuerySet.extents`
+    :returns: dict of asset id to list of (t, c), oldest to newest
+    """
+    cache = get_bar_cache()
+    if cache is not None:
+        closes = {}
+        for asset_id in asset_ids:
+            bars = cache.load(asset_id, stored=stored_extent(extents, asset_id))
+            closes[str(asset_id)] = list(
+                zip(bars["t"][-length:].tolist(), bars["c"][-length:].tolist())
+            )
+        return closes
+
+    rows = Bar.objects.filter(asset_id__in=asset_ids).latest_per_asset(
+        length, "asset_id", "t", "c"
+    )
+    return {
+        str(asset_id): [(t, c) for _, t, c in asset_rows]
+        for asset_id, asset_rows in groupby(rows, key=lambda row: row[0])
+    }
+
+
+rolling_store = RollingStore()
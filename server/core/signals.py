@@ -19,6 +19,10 @@ def create_periodic_tasks(
     every_15_minutes, _ = CrontabSchedule.objects.get_or_create(
         minute="15", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
     )
+    # Before the market opens, so backfill does not compete with trading
+    daily, _ = CrontabSchedule.objects.get_or_create(
+        minute="0", hour="12", day_of_week="*", day_of_month="*", month_of_year="*"
+    )
 
     tasks = [
         {
@@ -26,6 +30,16 @@ def create_periodic_tasks(
             "task": "core.tasks.run_strategies_for_users",
             "crontab": every_15_minutes,
         },
+        {
+            "name": "Reconcile order intents",
+            "task": "core.tasks.reconcile_order_intents",
+            "crontab": every_15_minutes,
+        },
+        {
+            "name": "Backfill bars",
+            "task": "core.tasks.backfill_bars",
+            "crontab": daily,
+        },
     ]
 
     for task in tasks:
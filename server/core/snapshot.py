@@ -0,0 +1,120 @@
+from orders.models import Order
+
+
+class AccountSnapshot:
+    """
+    Account and open positions captured once per tick.
+
+    Built from a single account request and a single positions request, and
+    updated locally as orders are placed during the tick, so sizing an order
+    does not require a request to Alpaca.
+    """
+
+    def __init__(self, account, positions):
+        """
+        :param account(dict): raw account returned from Alpaca
+        :param positions(list): raw open positions returned from Alpaca
+        """
+        self.account = dict(account)
+        self.positions = {position["symbol"]: dict(position) for position in positions}
+
+    @classmethod
+    def fetch(cls, api):
+        """
+        Capture the account and open positions.
+
+        :param api(TradeApiRest): api used to make the requests
+        """
+        account = api.account_info()
+        positions = api.list_positions()
+        return cls(
+            account.__dict__["_raw"],
+            [position.__dict__["_raw"] for position in positions],
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restore a snapshot serialized with `to_dict`."""
+        return cls(data["account"], data["positions"].values())
+
+    def to_dict(self):
+        """Return the snapshot as a JSON serializable dict."""
+        return {"account": self.account, "positions": self.positions}
+
+    @property
+    def equity(self):
+        """Cash + long_market_value + short_market_value."""
+        return float(self.account["equity"])
+
+    @property
+    def buying_power(self):
+        """Buying power left, the equity if the account does not report it."""
+        return float(self.account.get("buying_power", self.account["equity"]))
+
+    def position(self, symbol):
+        """Return the raw open position for the given symbol, if any."""
+        return self.positions.get(symbol)
+
+    def share_positions(self, demands):
+        """
+        Split the long positions between several holders of the account, so
+        the holders together sell at most the value of each position.
+
+        Each position is allotted in turn, each holder receiving up to the
+        value it asks for, until the position is used up. Short positions
+        are not split.
+
+        :param demands(dict): holder to dict of symbol to value to be sold,
+        in the order positions are allotted
+        :returns: dict of holder to snapshot of its share of the positions
+        """
+        remaining = {
+            symbol: float(position["market_value"])
+            for symbol, position in self.positions.items()
+            if position["side"] == "long"
+        }
+        shares = {}
+        for holder, demand in demands.items():
+            positions = [
+                position
+                for position in self.positions.values()
+                if position["side"] != "long"
+            ]
+            for symbol, value in demand.items():
+                allotted = min(float(value), remaining.get(symbol, 0))
+                if allotted <= 0:
+                    continue
+                remaining[symbol] -= allotted
+                positions.append(
+                    {**self.positions[symbol], "market_value": str(allotted)}
+                )
+            shares[holder] = AccountSnapshot(self.account, positions)
+        return shares
+
+    def record_order(self, symbol, side, notional):
+        """
+        Update open positions, cash and buying power with an order placed
+        during the tick.
+
+        :param symbol(str): symbol of the asset traded
+        :param side(str): buy or sell
+        :param notional(float): value of the order
+        """
+        spent = notional if side == Order.BUY else -notional
+        self.account["buying_power"] = str(self.buying_power - spent)
+        if "cash" in self.account:
+            self.account["cash"] = str(float(self.account["cash"]) - spent)
+
+        position = self.positions.setdefault(
+            symbol, {"symbol": symbol, "side": "long", "market_value": "0"}
+        )
+        market_value = float(position["market_value"])
+        if side == Order.BUY:
+            market_value += notional
+        else:
+            market_value -= notional
+
+        if market_value <= 0:
+            del self.positions[symbol]
+        else:
+            position["market_value"] = str(market_value)
@@ -0,0 +1,237 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+from itertools import groupby, product
+
+import numpy as np
+from assets.models import Bar
+from django.conf import settings
+
+from core.backtest import backtest, moving_averages, periods_per_year
+from core.models import BacktestResult
+from core.resample import can_resample, resample
+
+logger = logging.getLogger(__name__)
+
+BAR_FIELDS = ("t", "o", "h", "l", "c")
+
+# Bars of every swept asset, memory mapped read only in each worker process
+worker_bars = None
+
+
+def load_universe(asset_ids):
+    """
+    Load the bars of many assets into one array with a single query.
+
+    :param asset_ids(list): ids of the assets to load
+    :returns: tuple of (list of (asset id, first row, last row) of each asset,
+    array of shape (5, bars) holding `t`, `o`, `h`, `l`, and `c`)
+    """
+    rows = (
+        Bar.objects.filter(asset_id__in=asset_ids)
+        .order_by("asset_id", "t")
+        .values_list("asset_id", *BAR_FIELDS)
+    )
+    rows = list(rows)
+    values = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 5).T
+
+    slices = []
+    start = 0
+    for asset_id, asset_rows in groupby(rows, key=lambda row: row[0]):
+        stop = start + sum(1 for _ in asset_rows)
+        slices.append((str(asset_id), start, stop))
+        start = stop
+    return slices, values
+
+
+def attach_bars(path):
+    """Memory map the shared bar array in a worker process."""
+    global worker_bars
+    worker_bars = None if path is None else np.load(path, mmap_mode="r")
+
+
+def map_shared(function, tasks, values, max_workers=None):
+    """
+    Run tasks in a process pool sharing one array of bars.
+
+    The array is written to a memory mapped file once, and read by each
+    worker process rather than pickled to it. Results are yielded as each
+    task completes.
+
+    Daemon processes (e.g. Celery workers) are unable to start a process
+    pool, so tasks run in process instead.
+
+    :param function(callable): module level function called with each task
+    :param tasks(list): tuples of arguments
+    :param values(ndarray): bars returned from `load_universe`
+    :param max_workers(int): number of worker processes, defaults to the
+    number of cores
+    """
+    in_process = max_workers == 1 or multiprocessing.current_process().daemon
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bars.npy")
+        np.save(path, values)
+
+        if in_process:
+            attach_bars(path)
+            try:
+                for task in tasks:
+                    yield function(*task)
+            finally:
+                attach_bars(None)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=max_workers, initializer=attach_bars, initargs=(path,)
+            ) as executor:
+                futures = [executor.submit(function, *task) for task in tasks]
+                for future in as_completed(futures):
+                    yield future.result()
+
+
+def shared_bars(start, stop):
+    """Return a copy of the bars of one asset from the shared array."""
+    bars = {
+        field: np.array(worker_bars[row, start:stop])
+        for row, field in enumerate(BAR_FIELDS)
+    }
+    bars["t"] = bars["t"].astype(np.int64)
+    return bars
+
+
+def sweep_asset(asset_id, start, stop, timeframe, grid):
+    """
+    Backtest every combination of the grid for one asset and timeframe.
+
+    Runs in a worker process. Bars are read from the shared memory mapped
+    array, resampled once, and each moving average is computed once and
+    shared by every stop loss and take profit combination.
+
+    :param asset_id(str): id of the asset
+    :param start(int): first column of the asset in the shared array
+    :param stop(int): column after the last column of the asset
+    :param timeframe(str): timeframe to backtest
+    :param grid(dict): `windows`, `stop_loss_percentages`,
+    `take_profit_percentages`, and `trade_value` to sweep
+    :returns: tuple of (asset id, timeframe, list of result dicts)
+    """
+    bars = resample(shared_bars(start, stop), timeframe)
+
+    results = []
+    for window in grid["windows"]:
+        averages = moving_averages(bars["c"], window)
+        for stop_loss, take_profit in product(
+            grid["stop_loss_percentages"], grid["take_profit_percentages"]
+        ):
+            result = backtest(
+                bars,
+                window,
+                grid["trade_value"],
+                stop_loss_percentage=stop_loss,
+                take_profit_percentage=take_profit,
+                annual_periods=periods_per_year(timeframe),
+                averages=averages,
+            )
+            results.append(
+                {
+                    "window": window,
+                    "stop_loss_percentage": stop_loss,
+                    "take_profit_percentage": take_profit,
+                    "trades": len(result["trades"]),
+                    "total_return": result["total_return"],
+                    "max_drawdown": result["max_drawdown"],
+                    "sharpe": result["sharpe"],
+                }
+            )
+    return asset_id, timeframe, results
+
+
+def run_sweep(
+    asset_ids,
+    windows,
+    timeframes=None,
+    stop_loss_percentages=(None,),
+    take_profit_percentages=(None,),
+    trade_value=1000,
+    max_workers=None,
+    sweep_id=None,
+):
+    """
+    Backtest a grid of parameters across many assets in parallel.
+
+    Bars are loaded once and written to a memory mapped file shared by every
+    worker process, rather than pickled to each of them. Work is split by
+    (asset, timeframe), and results are saved as each asset completes.
+
+    :param asset_ids(list): ids of the assets to backtest
+    :param windows(list): moving average window lengths, in bars
+    :param timeframes(list): timeframes to backtest, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :param stop_loss_percentages(list): stop losses, `None` for no stop loss
+    :param take_profit_percentages(list): take profits, `None` for no take
+    profit
+    :param trade_value(float): value of each buy order
+    :param max_workers(int): number of worker processes, defaults to the
+    number of cores
+    :param sweep_id(UUID): id the results are saved with
+    :returns: id of the sweep
+    """
+    sweep_id = sweep_id or uuid.uuid4()
+    grid = {
+        "windows": list(windows),
+        "stop_loss_percentages": list(stop_loss_percentages),
+        "take_profit_percentages": list(take_profit_percentages),
+        "trade_value": float(trade_value),
+    }
+
+    timeframes = timeframes or [settings.BAR_BASE_TIMEFRAME]
+    skipped = [t for t in timeframes if not can_resample(t)]
+    if skipped:
+        logger.warning(f"Skipping timeframes shorter than stored bars: {skipped}")
+    timeframes = [t for t in dict.fromkeys(timeframes) if t not in skipped]
+
+    slices, values = load_universe(asset_ids)
+    tasks = [
+        (asset_id, start, stop, timeframe, grid)
+        for asset_id, start, stop in slices
+        for timeframe in timeframes
+    ]
+    parameters = (
+        len(grid["windows"])
+        * len(grid["stop_loss_percentages"])
+        * len(grid["take_profit_percentages"])
+    )
+    logger.info(
+        f"Sweeping backtests. sweep, assets, timeframes, parameters: {sweep_id}, "
+        f"{len(slices)}, {len(timeframes)}, {parameters}"
+    )
+
+    for result in map_shared(sweep_asset, tasks, values, max_workers):
+        save_results(sweep_id, grid, *result)
+
+    return sweep_id
+
+
+def save_results(sweep_id, grid, asset_id, timeframe, results):
+    """Save the results of one asset and timeframe of a sweep."""
+    BacktestResult.objects.bulk_create(
+        [
+            BacktestResult(
+                sweep_id=sweep_id,
+                asset_id=asset_id,
+                timeframe=timeframe,
+                window=result["window"],
+                trade_value=Decimal(str(grid["trade_value"])),
+                stop_loss_percentage=result["stop_loss_percentage"],
+                take_profit_percentage=result["take_profit_percentage"],
+                trades=result["trades"],
+                total_return=result["total_return"],
+                max_drawdown=result["max_drawdown"],
+                sharpe=result["sharpe"],
+            )
+            for result in results
+        ]
+    )
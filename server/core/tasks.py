@@ -1,202 +1,518 @@
 import logging
 import time
+import uuid
 from datetime import datetime, timedelta
+from itertools import groupby
 
+import numpy as np
 import pytz
-from alpaca_trade_api.rest import APIError
 from assets.models import Bar
-from assets.tasks import update_bars
+from assets.tasks import bar_update_requests, refresh_bars
+from celery import chord, group
 from config import celery_app
-from django.db.models import Avg, F, RowRange, Window
-from orders.models import Order
+from django.conf import settings
+from django.utils import timezone
+from orders.ledger import (
+    intent_client_order_id,
+    reconcile_intents,
+    record_intents,
+    submit_intents,
+)
+from orders.models import Order, OrderIntent
 from users.models import User
 
 from core.alpaca import TradeApiRest
+from core.backfill import (
+    BACKFILL_DAYS,
+    drain_backfill,
+    gap_intervals,
+    plan_backfill,
+)
+from core.clock import market_clock
+from core.engine import BUY, SELL, moving_average_signals, moving_average_window
 from core.models import Strategy
+from core.resample import can_resample
+from core.snapshot import AccountSnapshot
+from core.sweep import run_sweep
+from core.trading_calendar import completed_bar_times, latest_bar_times
+from core.walkforward import recommend_strategies
 
 logger = logging.getLogger(__name__)
 
+# Minimum share of the expected bars which must be stored to trade
+MIN_BAR_COVERAGE = 0.95
+
+# Seconds an order intent may be pending before it is reconciled, which
+# leaves time for the dispatcher to retry
+ORDER_INTENT_GRACE = 300
+
 
 @celery_app.task()
 def run_strategies_for_users(user_id=None):
     """Run strategies for all users, unless a user is specified."""
-    if user_id is None:
-        user_ids = Strategy.objects.active().values_list("user__id", flat=True)
-        users = User.objects.filter(id__in=user_ids)
-    else:
-        users = User.objects.filter(pk=user_id)
+    strategies = Strategy.objects.active().select_related("asset")
+    if user_id is not None:
+        strategies = strategies.filter(user_id=user_id)
+    users = User.objects.filter(id__in=strategies.values_list("user__id", flat=True))
+
+    # Clock is cached until the next open or close, so closed market ticks do
+    # not make any requests
+    if not market_clock.is_open():
+        logger.info(
+            f"Market closed until {market_clock.next_open}, skipping strategies"
+        )
+        return
 
     api = TradeApiRest()
 
-    if not api.is_market_open():
-        logger.info("Market closed, skipping strategies")
+    # Compute each distinct signal once, and share it with every user
+    started_at = time.time()
+    signals = compute_signals(strategies)
+
+    user_ids = list(users.values_list("id", flat=True))
+    if not user_ids:
         return
 
-    for user in users:
-        moving_average_strategy(user)
+    # Account and positions are fetched once, unless no orders can be placed
+    # this tick, and each user is given its share of the positions to sell,
+    # so users together sell at most the positions held
+    snapshots = dict.fromkeys(user_ids)
+    if any(signal["side"] in (BUY, SELL) for signal in signals.values()):
+        snapshot = AccountSnapshot.fetch(api)
+        shares = snapshot.share_positions(sell_demands(strategies, signals, user_ids))
+        snapshots = {user_id: share.to_dict() for user_id, share in shares.items()}
 
+    # Fan out orders for each user across workers, and aggregate the results
+    # once every user has been processed
+    header = group(
+        run_strategies_for_user.s(user_id, signals, snapshots[user_id])
+        for user_id in user_ids
+    )
+    chord(header)(record_tick.s(started_at=started_at))
 
-def moving_average_strategy(user):
-    """Initialise moving average strategy."""
-    strategies = Strategy.objects.filter(user=user).active()
 
-    if not strategies.exists():
-        return
+def sell_demands(strategies, signals, user_ids):
+    """
+    Return the value each user's strategies would sell this tick.
+
+    :param strategies(QuerySet): active strategies of the users
+    :param signals(dict): signals computed for the tick, keyed by signal key
+    :param user_ids(list): ids of the users, in the order positions are shared
+    :returns: dict of user id to dict of symbol to value
+    """
+    demands = {user_id: {} for user_id in user_ids}
+    for strategy in strategies:
+        signal = signals.get(signal_key(strategy))
+        if signal is None or signal["side"] != SELL:
+            continue
+        demand = demands[strategy.user_id]
+        symbol = strategy.asset.symbol
+        demand[symbol] = demand.get(symbol, 0) + float(strategy.trade_value)
+    return demands
+
+
+@celery_app.task()
+def run_strategies_for_user(user_id, signals, snapshot=None):
+    """
+    Run strategies for a user with the signals computed for the tick.
+
+    :param user_id(int): id of the user to place orders for
+    :param signals(dict): signals computed for the tick, keyed by signal key
+    :param snapshot(dict): account snapshot captured for the tick
+    """
+    started = time.perf_counter()
+    user = User.objects.get(pk=user_id)
+    if snapshot is not None:
+        snapshot = AccountSnapshot.from_dict(snapshot)
+    orders = moving_average_strategy(user, signals, snapshot)
+    return {
+        "user_id": user_id,
+        "orders": orders,
+        "elapsed": time.perf_counter() - started,
+    }
+
+
+@celery_app.task(ignore_result=True)
+def record_tick(results, started_at):
+    """
+    Aggregate the results of each user processed in a tick.
+
+    :param results(list): results returned by `run_strategies_for_user`
+    :param started_at(float): Unix epoch the tick was planned at
+    """
+    summary = {
+        "users": len(results),
+        "orders": sum(result["orders"] for result in results),
+        "user_elapsed_total": sum(result["elapsed"] for result in results),
+        "user_elapsed_max": max((result["elapsed"] for result in results), default=0),
+        "tick_elapsed": time.time() - started_at,
+    }
+    logger.info(
+        "Tick complete. users, orders, slowest user, tick latency: "
+        f"{summary['users']}, {summary['orders']}, "
+        f"{summary['user_elapsed_max']:.3f}s, {summary['tick_elapsed']:.3f}s"
+    )
+    return summary
+
+
+@celery_app.task(ignore_result=True)
+def reconcile_order_intents():
+    """Settle order intents left pending for longer than the grace period."""
+    return reconcile_intents(
+        TradeApiRest(), timezone.now() - timedelta(seconds=ORDER_INTENT_GRACE)
+    )
+
+
+def signal_key(strategy):
+    """
+    Return the key of the signal a strategy trades on.
 
-    strategy_symbols = list(strategies.values_list("asset__symbol", flat=True))
+    Strategies with the same asset, type, and timeframe share the same signal.
+    """
+    return f"{strategy.asset_id}:{strategy.type}:{strategy.timeframe}"
 
-    # Update latest bars
-    update_bars(strategy_symbols, "15Min", limit=1)
+
+def compute_signals(strategies):
+    """
+    Compute the signal of each distinct (asset, type, timeframe) once.
+
+    :param strategies(iterable): strategies to compute signals for
+    :returns: dict of signal key to signal
+    """
+    representatives = {}
+    for strategy in strategies:
+        representatives.setdefault(signal_key(strategy), strategy)
+
+    if not representatives:
+        return {}
+
+    # Fetch missing bars, including the latest bar, for every symbol traded
+    # this tick at once
+    ready_strategies = fetch_bar_data_for_strategies(list(representatives.values()))
+
+    # Calculate moving averages and crossovers for all signals in one pass
+    signals = moving_average_signals(ready_strategies)
+
+    return {signal_key(s): signals[s.pk] for s in ready_strategies}
+
+
+def moving_average_strategy(user, signals=None, snapshot=None):
+    """
+    Initialise moving average strategy.
+
+    Orders are decided for every strategy first, recorded in the order
+    ledger, then submitted concurrently, so a failed order does not stop the
+    orders of other strategies.
+
+    :param user(User): user to place orders for
+    :param signals(dict): signals computed for the tick, keyed by signal key.
+    Computed for the user's strategies if not given.
+    :param snapshot(AccountSnapshot): account and positions used to size
+    orders. Fetched if not given.
+    :returns: number of orders placed
+    """
+    strategies = Strategy.objects.filter(user=user).active().select_related("asset")
+
+    if not strategies.exists():
+        return 0
+
+    if signals is None:
+        signals = compute_signals(strategies)
 
     api = TradeApiRest()
+    intents = []
+    signals_by_strategy = {}
     for strategy in strategies:
-        total_bars_count = fetch_bar_data_for_strategy(strategy)
-        if not total_bars_count:
-            logger.info(f"Insufficient bar data for asset: {strategy.asset.id}")
+        signal = signals.get(signal_key(strategy))
+        if signal is None:
+            # Not enough bar data to compute the signal
             continue
 
-        # Calculate moving average and conditionally place order
-        annotated_bars = Bar.objects.filter(asset_id=strategy.asset.id).annotate(
-            moving_average=Window(
-                expression=Avg("c"),
-                order_by=F("t").desc(),
-                frame=RowRange(start=0, end=int(total_bars_count - 1)),
-            ),
-        )
+        if snapshot is None and signal["side"] in (BUY, SELL):
+            snapshot = AccountSnapshot.fetch(api)
 
-        latest_bar = annotated_bars.first()
-        previous_bar = annotated_bars[1]
         symbol = strategy.asset.symbol
-        if (
-            latest_bar.c >= latest_bar.moving_average
-            and previous_bar.c < previous_bar.moving_average
-        ):
+        if signal["side"] == BUY:
             side = Order.BUY
-            account = api.account_info()
-            trade_value = min(
-                float(strategy.trade_value), float(account.__dict__["_raw"]["equity"])
-            )
-        elif (
-            latest_bar.c <= latest_bar.moving_average
-            and previous_bar.c > previous_bar.moving_average
-        ):
+            trade_value = min(float(strategy.trade_value), snapshot.buying_power)
+            if trade_value <= 0:
+                logger.info(f"No buying power left, unable to buy: {strategy.asset.id}")
+                continue
+        elif signal["side"] == SELL:
             side = Order.SELL
 
-            try:
-                position = api.list_position_by_symbol(symbol)
-            except APIError:
+            position = snapshot.position(symbol)
+            if position is None:
                 logger.info(f"No position exists, unable to sell: {strategy.asset.id}")
                 continue
-            else:
-                if position.__dict__["_raw"]["side"] == "short":
-                    logger.info(f"Asset is long, unable to sell: {strategy.asset.id}")
-                    continue
+            if position["side"] == "short":
+                logger.info(f"Asset is long, unable to sell: {strategy.asset.id}")
+                continue
 
             trade_value = min(
-                float(strategy.trade_value),
-                float(position.__dict__["_raw"]["market_value"]),
+                float(strategy.trade_value), float(position["market_value"])
             )
         else:
             # No order required with current quote
             logger.info(
-                f"No order placed. symbol, close price, moving average {symbol}, {latest_bar.c}, {latest_bar.moving_average}"
+                f"No order placed. symbol, close price, moving average {symbol}, {signal['close']}, {signal['moving_average']}"
             )
             continue
 
-        try:
-            order = api.submit_order(
-                symbol=symbol,
-                notional=trade_value,
+        # Recorded as the order is decided, so later strategies trading the
+        # same asset are sized against it
+        snapshot.record_order(symbol, side, trade_value)
+        intents.append(
+            OrderIntent(
+                client_order_id=intent_client_order_id(strategy.pk, signal["t"], side),
+                user=user,
+                strategy=strategy,
+                asset=strategy.asset,
+                t=signal["t"],
                 side=side,
                 type=Order.MARKET,
                 time_in_force=Order.GTC,
+                notional=trade_value,
             )
-            logger.info(
-                f"Order placed. symbol, side, close, moving_average: {symbol}, {side}, {latest_bar.c}, {latest_bar.moving_average}"
+        )
+        signals_by_strategy[strategy.pk] = signal
+
+    # Orders are written to the ledger before they are submitted, so orders
+    # already placed for the same bars are not placed again
+    intents = record_intents(intents)
+    orders_placed = 0
+    for intent, result in submit_intents(intents, api):
+        signal = signals_by_strategy[intent.strategy_id]
+        if result["error"] is not None:
+            logger.warning(f"Tradeview order failed: {result['error']}")
+            continue
+        logger.info(
+            f"Order placed. symbol, side, close, moving_average: {intent.asset.symbol}, {intent.side}, {signal['close']}, {signal['moving_average']}"
+        )
+        orders_placed += 1
+
+    return orders_placed
+
+
+def missing_bar_times(strategies, now=None):
+    """
+    Return the expected bar times which are not stored for each strategy.
+
+    Expected bars are the completed bars of `BAR_BASE_TIMEFRAME` in the trading
+    calendar which are resampled into the latest bars of the strategy's
+    timeframe needed to compare the moving average of this period to the
+    previous period. Strategies of timeframes shorter than the stored bars
+    expect no bars. Stored bars are found with one range query over the
+    indexed (asset, t) columns.
+
+    :param strategies(list): moving average strategies to check
+    :param now(datetime): current time, defaults to now
+    :returns: dict of strategy id to tuple of (expected, missing) bar times
+    """
+    now = now or timezone.now()
+    base_timeframe = settings.BAR_BASE_TIMEFRAME
+    expected_by_window = {}
+    expected = {}
+    for strategy in strategies:
+        timeframe = strategy.timeframe
+        window = moving_average_window(strategy.type, timeframe)
+        if (window, timeframe) not in expected_by_window:
+            times = np.array([], dtype=np.int64)
+            if can_resample(timeframe):
+                times = latest_bar_times(window + 1, now, timeframe)
+            if len(times) and timeframe != base_timeframe:
+                times = completed_bar_times(int(times[0]), now, base_timeframe)
+            expected_by_window[(window, timeframe)] = times
+        expected[strategy.pk] = expected_by_window[(window, timeframe)]
+
+    times = [t for t in expected_by_window.values() if len(t)]
+    if not times:
+        return {pk: (t, t) for pk, t in expected.items()}
+
+    stored_bars = (
+        Bar.objects.filter(
+            asset_id__in={strategy.asset_id for strategy in strategies},
+            t__gte=min(t[0] for t in times),
+            t__lte=max(t[-1] for t in times),
+        )
+        .order_by("asset_id")
+        .values_list("asset_id", "t")
+    )
+    stored = {
+        str(asset_id): np.array([row[1] for row in rows], dtype=np.int64)
+        for asset_id, rows in groupby(stored_bars, key=lambda row: row[0])
+    }
+
+    return {
+        strategy.pk: (
+            expected[strategy.pk],
+            np.setdiff1d(
+                expected[strategy.pk],
+                stored.get(str(strategy.asset_id), np.array([], dtype=np.int64)),
+            ),
+        )
+        for strategy in strategies
+    }
+
+
+def fetch_bar_data_for_strategies(strategies, now=None):
+    """
+    Fetch missing bar data for strategies, and return those ready to trade.
+
+    Bars completed since the latest stored bar of each symbol, its
+    watermark, are fetched first, sized to the bars completed since. Then
+    only the remaining gaps between the expected and stored bars are fetched,
+    e.g. for symbols without a watermark. Symbols with the same gap are
+    fetched together, rather than once per strategy. Bars are only fetched in
+    `BAR_BASE_TIMEFRAME`, as longer timeframes are resampled from them.
+
+    :param strategies(list): strategies to fetch bar data for
+    :param now(datetime): current time, defaults to now
+    :returns: list of strategies with enough bar data
+    """
+    updates = bar_update_requests(
+        sorted({strategy.asset.symbol for strategy in strategies}),
+        settings.BAR_BASE_TIMEFRAME,
+        now=now,
+    )
+    for (after, limit), symbols in updates.items():
+        if after is not None:
+            refresh_bars(
+                sorted(symbols), settings.BAR_BASE_TIMEFRAME, limit=limit, after=after
             )
-        except Exception as e:
-            logger.warning(f"Tradeview order failed: {e}")
-            return
-
-        raw_order = order.__dict__["_raw"]
-        order = Order.objects.create(
-            user=user,
-            id=raw_order.get("id"),
-            client_order_id=raw_order.get("client_order_id"),
-            created_at=raw_order.get("created_at"),
-            updated_at=raw_order.get("updated_at"),
-            submitted_at=raw_order.get("submitted_at"),
-            filled_at=raw_order.get("filled_at"),
-            expired_at=raw_order.get("expired_at"),
-            canceled_at=raw_order.get("canceled_at"),
-            failed_at=raw_order.get("failed_at"),
-            replaced_at=raw_order.get("replaced_at"),
-            replaced_by=raw_order.get("replaced_by"),
-            replaces=raw_order.get("replaces"),
-            asset_id=strategy.asset,
-            notional=raw_order.get("notional"),
-            qty=raw_order.get("qty"),
-            filled_qty=raw_order.get("filled_qty"),
-            filled_avg_price=raw_order.get("filled_avg_price"),
-            order_class=raw_order.get("order_class"),
-            type=raw_order.get("type"),
-            side=raw_order.get("side"),
-            time_in_force=raw_order.get("time_in_force"),
-            limit_price=raw_order.get("limit_price"),
-            stop_price=raw_order.get("stop_price"),
-            status=raw_order.get("status"),
-            extended_hours=raw_order.get("extended_hours"),
-            trail_percent=raw_order.get("trail_percent"),
-            trail_price=raw_order.get("trail_price"),
-            hwm=raw_order.get("hwm"),
+
+    coverage = missing_bar_times(strategies, now)
+
+    requests = {}
+    for strategy in strategies:
+        for interval in gap_intervals(*coverage[strategy.pk]):
+            requests.setdefault(interval, set()).add(strategy.asset.symbol)
+
+    for (start, end, count), symbols in requests.items():
+        refresh_bars(
+            sorted(symbols),
+            settings.BAR_BASE_TIMEFRAME,
+            limit=count,
+            start=datetime.fromtimestamp(start, pytz.utc).isoformat(),
+            end=datetime.fromtimestamp(end, pytz.utc).isoformat(),
         )
-        legs = raw_order.get("legs")
-        if legs:
-            order.legs.set(legs)
 
+    if requests:
+        coverage = missing_bar_times(strategies, now)
+
+    ready_strategies = []
+    for strategy in strategies:
+        expected, missing = coverage[strategy.pk]
+        # Alpaca does not return bars for intervals without any trades, so
+        # tolerate a small number of bars which do not exist
+        if not len(expected) or len(missing) > (1 - MIN_BAR_COVERAGE) * len(expected):
+            logger.info(f"Insufficient bar data for asset: {strategy.asset.id}")
+            continue
+        ready_strategies.append(strategy)
+
+    return ready_strategies
+
+
+@celery_app.task(ignore_result=True)
+def backfill_bars(asset_ids=None, days=None):
+    """
+    Fill the gaps in the stored bar history of assets.
+
+    :param asset_ids(list): ids of the assets to backfill, defaults to the
+    assets of active strategies
+    :param days(int): days of history backfilled, defaults to `BACKFILL_DAYS`
+    :returns: number of bars saved
+    """
+    requests = plan_backfill(asset_ids, days=days or BACKFILL_DAYS)
+    logger.info(f"Planned backfill requests: {len(requests)}")
+    return drain_backfill(requests)
+
+
+@celery_app.task()
+def sweep_backtests(
+    asset_ids,
+    windows,
+    timeframes=None,
+    stop_loss_percentages=(None,),
+    take_profit_percentages=(None,),
+    trade_value=1000,
+    chunk_size=None,
+    sweep_id=None,
+):
+    """
+    Backtest a grid of parameters across many assets.
 
-def fetch_bar_data_for_strategy(strategy):
-    """Conditionally fetch bar data if there is not enough historical data."""
-    if strategy.type == Strategy.MOVING_AVERAGE_7D:
-        days = 7
-        business_days = 5
+    Celery worker processes are unable to start a process pool, so when
+    `chunk_size` is given the assets are split into chunks which are swept
+    in parallel by the workers instead.
+
+    :param asset_ids(list): ids of the assets to backtest
+    :param windows(list): moving average window lengths, in bars
+    :param timeframes(list): timeframes to backtest, defaults to
+    `BAR_BASE_TIMEFRAME`
+    :param stop_loss_percentages(list): stop losses, `None` for no stop loss
+    :param take_profit_percentages(list): take profits, `None` for no take
+    profit
+    :param trade_value(float): value of each buy order
+    :param chunk_size(int): number of assets swept by each task
+    :param sweep_id(str): id the results are saved with
+    :returns: id of the sweep
+    """
+    sweep_id = sweep_id or str(uuid.uuid4())
+    parameters = {
+        "windows": windows,
+        "timeframes": timeframes,
+        "stop_loss_percentages": stop_loss_percentages,
+        "take_profit_percentages": take_profit_percentages,
+        "trade_value": trade_value,
+        "sweep_id": sweep_id,
+    }
+
+    if chunk_size and len(asset_ids) > chunk_size:
+        group(
+            sweep_backtests.s(asset_ids[start : start + chunk_size], **parameters)
+            for start in range(0, len(asset_ids), chunk_size)
+        )()
     else:
-        days = 14
-        business_days = 10
-
-    time_now_utc = datetime.utcnow().replace(tzinfo=pytz.utc)
-    base_time_utc = time_now_utc - timedelta(days=days)
-    base_time_epoch = int(time.mktime(base_time_utc.timetuple()))
-    bars = Bar.objects.filter(asset_id=strategy.asset.id, t__gte=base_time_epoch)
-
-    # Hacky adjustment for public holidays and crontab tasks not being
-    # perfectly aligned with market open etc.
-    adjusted = 0.8
-    seven_day_bars_to_update = []
-    fourteen_day_bars_to_update = []
-    fifteen_min_bars_per_day = 6.5 * 60 / 15
-    total_bars_count = business_days * fifteen_min_bars_per_day
-    adjusted_count = adjusted * total_bars_count
-    symbol = strategy.asset.symbol
-
-    if bars.count() < adjusted_count:
-        if strategy.type == Strategy.MOVING_AVERAGE_7D:
-            seven_day_bars_to_update.append(symbol)
-        else:
-            fourteen_day_bars_to_update.append(symbol)
-
-    # Update number of days in strategy with an additional record (+ 1), to
-    # ensure there is enough historical data to compare the moving average of
-    # this period, to the previous period.
-    if seven_day_bars_to_update:
-        update_bars(seven_day_bars_to_update, "15Min", 5 * fifteen_min_bars_per_day + 1)
-    if fourteen_day_bars_to_update:
-        update_bars(
-            fourteen_day_bars_to_update, "15Min", 10 * fifteen_min_bars_per_day + 1
-        )
+        run_sweep(asset_ids, **parameters)
 
-    bars = Bar.objects.filter(asset_id=strategy.asset.id, t__gte=base_time_epoch)
-    if bars.count() < adjusted_count:
-        return
+    return sweep_id
+
+
+@celery_app.task()
+def recommend_strategy_parameters(
+    windows,
+    strategy_ids=None,
+    train_days=20,
+    test_days=5,
+    stop_loss_percentages=(None,),
+    take_profit_percentages=(None,),
+    metric="sharpe",
+):
+    """
+    Walk forward moving average parameters for strategies.
+
+    Runs in process, as Celery worker processes are unable to start a
+    process pool.
+
+    :param windows(list): moving average window lengths, in bars
+    :param strategy_ids(list): ids of the strategies, defaults to active
+    strategies
+    :returns: number of recommendations saved
+    """
+    strategies = Strategy.objects.all()
+    if strategy_ids is None:
+        strategies = strategies.active()
+    else:
+        strategies = strategies.filter(pk__in=strategy_ids)
 
-    return total_bars_count
+    recommendations = recommend_strategies(
+        strategies,
+        windows,
+        train_days=train_days,
+        test_days=test_days,
+        stop_loss_percentages=stop_loss_percentages,
+        take_profit_percentages=take_profit_percentages,
+        metric=metric,
+    )
+    return len(recommendations)
@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import uuid
+from unittest.mock import AsyncMock, MagicMock
+
+from aiohttp import web
+
+ACCOUNT = {
+    "id": "904837e3-3b76-47ec-b432-046db621571b",
+    "status": "ACTIVE",
+    "currency": "USD",
+    "cash": "10000",
+    "equity": "10100",
+    "last_equity": "10000",
+    "trading_blocked": False,
+}
+
+
+def mock_api(api=None):
+    """
+    Return a mock `TradeApiRest` whose async api awaits the mocked methods of
+    the sync api, so orders dispatched are recorded on the sync mock.
+
+    :param api(MagicMock): mock to configure, defaults to a new one
+    """
+    api = api or MagicMock()
+    api.run.side_effect = asyncio.run
+    async_api = api.async_api.return_value
+    for name in ("submit_order", "get_order_by_client_order_id"):
+        setattr(async_api, name, AsyncMock(side_effect=getattr(api, name)))
+    return api
+
+
+def api_error(status, message):
+    return web.json_response(
+        {"code": status * 100000, "message": message}, status=status
+    )
+
+
+class FakeAlpacaServer:
+    """
+    Local stand-in of the Alpaca trading and market data REST apis.
+
+    Orders submitted are kept, and can be fetched and cancelled. Each request
+    is recorded with the connection it was made on, responses can be delayed,
+    and queued failures are returned before the next responses.
+    """
+
+    def __init__(self, assets=("AAPL", "TSLA"), bars=None, delay=0):
+        """
+        :param assets(iterable): symbols of the tradable assets
+        :param bars(dict): symbol to list of raw bars served
+        :param delay(float): seconds before each response
+        """
+        self.assets = {
+            symbol: {"id": str(uuid.uuid4()), "symbol": symbol, "tradable": True}
+            for symbol in assets
+        }
+        self.bars = bars or {}
+        self.delay = delay
+        self.orders = {}
+        self.requests = []
+        self.connections = set()
+        self.failures = []
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def fail(self, status, message="Failed", times=1, json=True):
+        """
+        Respond to the next `times` requests with an error, with a JSON body
+        as Alpaca's or else a plain text one as a proxy's.
+        """
+        self.failures.extend([(status, message, json)] * times)
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.requests.append((request.method, request.path, dict(request.query)))
+        self.connections.add(id(request.transport))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            status, message, json = self.failures.pop(0)
+            if not json:
+                return web.Response(status=status, text=message)
+            return api_error(status, message)
+        return await handler(request)
+
+    async def account(self, request):
+        return web.json_response(ACCOUNT)
+
+    async def clock(self, request):
+        return web.json_response(
+            {
+                "timestamp": "2021-11-29T10:00:00-05:00",
+                "is_open": True,
+                "next_open": "2021-11-30T09:30:00-05:00",
+                "next_close": "2021-11-29T16:00:00-05:00",
+            }
+        )
+
+    async def list_assets(self, request):
+        return web.json_response(list(self.assets.values()))
+
+    async def get_asset(self, request):
+        asset = self.assets.get(request.match_info["symbol"])
+        if asset is None:
+            return api_error(404, "asset not found")
+        return web.json_response(asset)
+
+    async def list_positions(self, request):
+        return web.json_response([])
+
+    async def submit_order(self, request):
+        params = await request.json()
+        if params["symbol"] not in self.assets:
+            return api_error(422, "asset not found")
+        order = {
+            "id": str(uuid.uuid4()),
+            "client_order_id": params.get("client_order_id", str(uuid.uuid4())),
+            "status": "accepted",
+            "filled_qty": "0",
+            **params,
+        }
+        self.orders[order["id"]] = order
+        return web.json_response(order)
+
+    async def list_orders(self, request):
+        status = request.query.get("status", "open")
+        return web.json_response(
+            [
+                order
+                for order in self.orders.values()
+                if status == "all"
+                or (order["status"] == "accepted") == (status == "open")
+            ]
+        )
+
+    async def get_order(self, request):
+        order = self.orders.get(request.match_info["id"])
+        if order is None:
+            return api_error(404, "order not found")
+        return web.json_response(order)
+
+    async def get_order_by_client_order_id(self, request):
+        for order in self.orders.values():
+            if order["client_order_id"] == request.query["client_order_id"]:
+                return web.json_response(order)
+        return api_error(404, "order not found")
+
+    async def cancel_order(self, request):
+        order = self.orders.get(request.match_info["id"])
+        if order is None:
+            return api_error(404, "order not found")
+        order["status"] = "canceled"
+        return web.Response(status=204)
+
+    async def cancel_all_orders(self, request):
+        for order in self.orders.values():
+            order["status"] = "canceled"
+        return web.json_response([])
+
+    async def get_bars(self, request):
+        limit = int(request.query.get("limit", 100))
+        return web.json_response(
+            {
+                symbol: self.bars.get(symbol, [])[-limit:]
+                for symbol in request.query["symbols"].split(",")
+            }
+        )
+
+    async def get_aggs(self, request):
+        bars = self.bars.get(request.match_info["symbol"], [])
+        return web.json_response(
+            {
+                "ticker": request.match_info["symbol"],
+                "status": "success",
+                "resultsCount": len(bars),
+                "results": [{**bar, "t": bar["t"] * 1000} for bar in bars],
+            }
+        )
+
+    async def last_quote(self, request):
+        symbol = request.match_info["symbol"]
+        return web.json_response(
+            {
+                "status": "success",
+                "symbol": symbol,
+                "last": {"askprice": 101, "bidprice": 100, "timestamp": 1638198000},
+            }
+        )
+
+    async def last_trade(self, request):
+        symbol = request.match_info["symbol"]
+        return web.json_response(
+            {
+                "status": "success",
+                "symbol": symbol,
+                "last": {"price": 100.5, "size": 10, "timestamp": 1638198000},
+            }
+        )
+
+    def run(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes(
+            [
+                web.get("/v2/account", self.account),
+                web.get("/v2/clock", self.clock),
+                web.get("/v2/assets", self.list_assets),
+                web.get("/v2/assets/{symbol}", self.get_asset),
+                web.get("/v2/positions", self.list_positions),
+                web.post("/v2/orders", self.submit_order),
+                web.get("/v2/orders", self.list_orders),
+                web.delete("/v2/orders", self.cancel_all_orders),
+                web.get(
+                    "/v2/orders:by_client_order_id", self.get_order_by_client_order_id
+                ),
+                web.get("/v2/orders/{id}", self.get_order),
+                web.delete("/v2/orders/{id}", self.cancel_order),
+                web.get("/v1/bars/{timeframe}", self.get_bars),
+                web.get(
+                    "/v1/aggs/ticker/{symbol}/range/{multiplier}/{timespan}/{start}/{end}",
+                    self.get_aggs,
+                ),
+                web.get("/v1/last_quote/stocks/{symbol}", self.last_quote),
+                web.get("/v1/last/stocks/{symbol}", self.last_trade),
+            ]
+        )
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = self.runner.addresses[0][1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def __enter__(self):
+        self.thread.start()
+        self.ready.wait(5)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
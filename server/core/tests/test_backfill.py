@@ -0,0 +1,113 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytz
+from alpaca_trade_api.entity import Bar as AlpacaBar
+from assets.models import Bar
+from assets.tests.factories import AssetFactory, BarFactory
+from core.backfill import drain_backfill, plan_backfill
+from core.tests.factories import StrategyFactory
+from django.test import TestCase
+
+# Bars of 2021-11-29 completed by 16:00 UTC, from the open at 14:30 UTC
+NOW = datetime(2021, 11, 29, 16, tzinfo=pytz.utc)
+OPEN = 1638196200
+TIMES = [OPEN + 900 * i for i in range(6)]
+
+
+class BackfillTests(TestCase):
+    def setUp(self):
+        self.tesla = AssetFactory(symbol="TSLA")
+        self.apple = AssetFactory(symbol="AAPL")
+        self.microsoft = AssetFactory(symbol="MSFT")
+        StrategyFactory(asset=self.tesla, timeframe="15Min")
+        StrategyFactory(asset=self.microsoft, timeframe="15Min")
+        for t in TIMES:
+            BarFactory(asset=self.microsoft, t=t)
+            if t not in TIMES[2:4]:
+                BarFactory(asset=self.tesla, t=t)
+
+    def plan(self, **kwargs):
+        return plan_backfill(
+            [self.tesla.pk, self.apple.pk, self.microsoft.pk],
+            days=1,
+            now=NOW,
+            timeframe="15Min",
+            **kwargs
+        )
+
+    def test_plan_backfill(self):
+        """Exact gaps are requested, needed by active strategies first."""
+        self.assertEqual(
+            self.plan(),
+            [
+                {
+                    "symbols": ["TSLA"],
+                    "start": TIMES[2],
+                    "end": TIMES[3],
+                    "limit": 2,
+                    "priority": 1,
+                },
+                {
+                    "symbols": ["AAPL"],
+                    "start": TIMES[0],
+                    "end": TIMES[5],
+                    "limit": 6,
+                    "priority": 0,
+                },
+            ],
+        )
+
+        with self.subTest(msg="symbols missing the same bars are requested together."):
+            Bar.objects.filter(asset=self.tesla).delete()
+            requests = self.plan()
+            self.assertEqual(len(requests), 1)
+            self.assertEqual(requests[0]["symbols"], ["AAPL", "TSLA"])
+            self.assertEqual(requests[0]["priority"], 1)
+
+    @patch("core.backfill.MAX_SYMBOLS_PER_REQUEST", 1)
+    @patch("core.backfill.MAX_BARS_PER_REQUEST", 4)
+    def test_plan_backfill_limits(self):
+        """Requests are split by the symbol and page size limits."""
+        Bar.objects.filter(asset=self.tesla).delete()
+
+        requests = self.plan()
+
+        self.assertEqual(
+            [
+                (request["symbols"], request["start"], request["limit"])
+                for request in requests
+            ],
+            [
+                (["TSLA"], TIMES[4], 2),
+                (["TSLA"], TIMES[0], 4),
+                (["AAPL"], TIMES[4], 2),
+                (["AAPL"], TIMES[0], 4),
+            ],
+        )
+
+    @patch("assets.tasks.TradeApiRest")
+    def test_drain_backfill(self, mock_api):
+        """Requests are fetched in order, and their bars saved."""
+
+        def get_bars(symbols, timeframe, limit, start, end, *args):
+            return {
+                symbol: [
+                    AlpacaBar({"t": t, "o": 1, "h": 1, "l": 1, "c": 1, "v": 1})
+                    for t in TIMES
+                    if start <= datetime.fromtimestamp(t, pytz.utc).isoformat() <= end
+                ][:limit]
+                for symbol in symbols.split(",")
+            }
+
+        mock_api().get_bars.side_effect = get_bars
+
+        saved = drain_backfill(self.plan(), timeframe="15Min", max_workers=1)
+
+        self.assertEqual(saved, 8)
+        self.assertEqual(
+            [call.args[0] for call in mock_api().get_bars.call_args_list],
+            ["TSLA", "AAPL"],
+        )
+        self.assertEqual(self.plan(), [])
+        self.assertEqual(drain_backfill([]), 0)
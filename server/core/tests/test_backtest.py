@@ -0,0 +1,129 @@
+from unittest.mock import patch
+
+import numpy as np
+from assets.tests.factories import AssetFactory, BarFactory
+from core.backtest import (
+    OPEN,
+    SIGNAL,
+    STOP_LOSS,
+    TAKE_PROFIT,
+    backtest,
+    backtest_strategy,
+    load_bars,
+    moving_averages,
+)
+from core.models import Strategy
+from core.tests.factories import StrategyFactory
+from django.test import TestCase
+
+
+class BacktestTests(TestCase):
+    def setUp(self):
+        # Moving average of 2 bars crosses up at 3, down at 5, and up at 6
+        self.bars = {
+            "t": np.arange(7) * 900,
+            "o": np.array([10, 10, 10, 8, 12.5, 11, 9]),
+            "h": np.array([10, 10, 10, 12, 14, 11, 9]),
+            "l": np.array([10, 10, 8, 8, 12.5, 9, 9]),
+            "c": np.array([10, 10, 8, 12, 14, 9, 9]),
+        }
+
+    def test_moving_averages(self):
+        """Moving averages match averages computed from scratch."""
+        closes = np.random.default_rng(0).uniform(1, 1000, 50)
+
+        averages = moving_averages(closes, 10)
+
+        self.assertTrue(np.isnan(averages[:9]).all())
+        for index in range(9, 50):
+            self.assertAlmostEqual(
+                averages[index], closes[index - 9 : index + 1].mean()
+            )
+
+    def test_backtest(self):
+        """Trades are entered on BUY signals and exited on SELL signals."""
+        result = backtest(self.bars, 2, 120, cash=1000)
+
+        trades = result["trades"]
+        self.assertEqual(len(trades), 2)
+        self.assertEqual(trades[0]["entry_t"], 3 * 900)
+        self.assertEqual(trades[0]["exit_t"], 5 * 900)
+        self.assertEqual(trades[0]["qty"], 10)
+        self.assertEqual(trades[0]["profit"], -30)
+        self.assertEqual(trades[0]["reason"], SIGNAL)
+        # Trade still open at the end is valued at the last close
+        self.assertEqual(trades[1]["entry_t"], 6 * 900)
+        self.assertEqual(trades[1]["reason"], OPEN)
+
+        np.testing.assert_allclose(
+            result["equity"], [1000, 1000, 1000, 1000, 1020, 970, 970]
+        )
+        self.assertAlmostEqual(result["max_drawdown"], 970 / 1020 - 1)
+        self.assertAlmostEqual(result["total_return"], -0.03)
+        self.assertNotEqual(result["sharpe"], 0)
+
+    def test_backtest_stop_loss(self):
+        """Stop loss closes a trade before a SELL signal in the same bar."""
+        result = backtest(self.bars, 2, 120, stop_loss_amount=20, cash=1000)
+
+        trade = result["trades"][0]
+        self.assertEqual(trade["reason"], STOP_LOSS)
+        self.assertEqual(trade["exit_t"], 5 * 900)
+        self.assertEqual(trade["exit_price"], 10)
+        self.assertEqual(trade["profit"], -20)
+
+    def test_backtest_take_profit(self):
+        """Take profit closes a trade when the high reaches the target."""
+        result = backtest(self.bars, 2, 120, take_profit_percentage=10, cash=1000)
+
+        trade = result["trades"][0]
+        self.assertEqual(trade["reason"], TAKE_PROFIT)
+        self.assertEqual(trade["exit_t"], 4 * 900)
+        self.assertAlmostEqual(trade["exit_price"], 13.2)
+        self.assertAlmostEqual(trade["profit"], 12)
+
+    def test_backtest_trade_value_capped(self):
+        """Trades are sized by trade value, capped at equity."""
+        result = backtest(self.bars, 2, 5000, cash=1000)
+
+        self.assertEqual(result["trades"][0]["notional"], 1000)
+
+    def test_backtest_no_bars(self):
+        """Backtest with no bars has no trades."""
+        result = backtest(load_bars(AssetFactory().id), 2, 120)
+
+        self.assertEqual(result["trades"], [])
+        self.assertEqual(result["sharpe"], 0)
+
+    def test_load_bars(self):
+        """Bars are loaded oldest to newest."""
+        asset = AssetFactory()
+        for t in (300, 100, 200):
+            BarFactory(asset=asset, t=t, c=t / 100)
+
+        bars = load_bars(asset.id, start=200)
+
+        np.testing.assert_array_equal(bars["t"], [200, 300])
+        np.testing.assert_array_equal(bars["c"], [2, 3])
+
+    @patch("core.backtest.backtest")
+    def test_backtest_strategy(self, mock_backtest):
+        """Strategy is backtested with its window, sizing, and exits."""
+        strategy = StrategyFactory(
+            type=Strategy.MOVING_AVERAGE_14D, trade_value=500, stop_loss_percentage=5
+        )
+
+        backtest_strategy(strategy)
+
+        args, kwargs = mock_backtest.call_args
+        self.assertEqual(args[1:], (260, strategy.trade_value))
+        self.assertEqual(kwargs["stop_loss_percentage"], 5)
+        self.assertIsNone(kwargs["take_profit_amount"])
+
+        strategy.timeframe = Strategy.HOUR_1
+        backtest_strategy(strategy)
+
+        # Window is sized for the timeframe
+        args, kwargs = mock_backtest.call_args
+        self.assertEqual(args[1], 10 * 7)
+        self.assertEqual(kwargs["annual_periods"], 252 * 7)
@@ -0,0 +1,46 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytz
+from alpaca_trade_api.entity import Clock as AlpacaClock
+from core.clock import MarketClock
+from django.test import TestCase
+
+
+class MarketClockTests(TestCase):
+    def setUp(self):
+        self.clock = MarketClock()
+        self.api = MagicMock()
+        self.api.get_clock.return_value = AlpacaClock(
+            {
+                "timestamp": "2021-03-12T18:00:00.000000-05:00",
+                "is_open": False,
+                "next_open": "2021-03-15T09:30:00-04:00",
+                "next_close": "2021-03-15T16:00:00-04:00",
+            }
+        )
+
+    def test_is_open_cached(self):
+        """Clock is only requested again once the next boundary passes."""
+        friday_evening = datetime(2021, 3, 12, 23, tzinfo=pytz.utc)
+        sunday = datetime(2021, 3, 14, 12, tzinfo=pytz.utc)
+
+        self.assertFalse(self.clock.is_open(self.api, now=friday_evening))
+        self.assertFalse(self.clock.is_open(self.api, now=sunday))
+        self.assertEqual(self.api.get_clock.call_count, 1)
+
+    def test_is_open_refreshed(self):
+        """Clock is requested once the market is due to open."""
+        monday_open = datetime(2021, 3, 15, 13, 30, tzinfo=pytz.utc)
+        self.clock.is_open(self.api, now=datetime(2021, 3, 12, 23, tzinfo=pytz.utc))
+        self.api.get_clock.return_value = AlpacaClock(
+            {
+                "timestamp": "2021-03-15T09:30:00.000000-04:00",
+                "is_open": True,
+                "next_open": "2021-03-16T09:30:00-04:00",
+                "next_close": "2021-03-15T16:00:00-04:00",
+            }
+        )
+
+        self.assertTrue(self.clock.is_open(self.api, now=monday_open))
+        self.assertEqual(self.api.get_clock.call_count, 2)
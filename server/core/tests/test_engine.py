@@ -0,0 +1,70 @@
+import numpy as np
+from assets.tests.factories import AssetFactory, BarFactory
+from core.engine import BUY, moving_average_signals
+from core.models import Strategy
+from core.resample import resample_cache
+from core.rolling import rolling_store
+from core.tests.factories import StrategyFactory
+from core.trading_calendar import completed_bar_times, latest_bar_times
+from django.test import TestCase
+
+
+class CoreEngineTests(TestCase):
+    def setUp(self):
+        rolling_store.clear()
+        resample_cache.clear()
+
+    def test_moving_average_signals(self):
+        """A decision is returned for each strategy."""
+        tsla = AssetFactory(symbol="TSLA")
+        window = 5 * 26
+        for t in range(window):
+            BarFactory(asset=tsla, t=t + 1, c=100)
+        BarFactory(asset=tsla, t=window + 1, c=90)
+        BarFactory(asset=tsla, t=window + 2, c=120)
+        seven_day = StrategyFactory(asset=tsla, type=Strategy.MOVING_AVERAGE_7D)
+        fourteen_day = StrategyFactory(asset=tsla, type=Strategy.MOVING_AVERAGE_14D)
+
+        signals = moving_average_signals([seven_day, fourteen_day])
+
+        self.assertEqual(signals[seven_day.pk]["side"], BUY)
+        self.assertEqual(signals[seven_day.pk]["close"], 120)
+        self.assertEqual(signals[seven_day.pk]["t"], window + 2)
+        # Fourteen day average covers all bars stored
+        self.assertEqual(signals[fourteen_day.pk]["side"], BUY)
+        self.assertAlmostEqual(
+            signals[fourteen_day.pk]["moving_average"], (window * 100 + 210) / 132
+        )
+
+    def test_moving_average_signals_derived_timeframe(self):
+        """Longer timeframes are resampled from the stored bars."""
+        tsla = AssetFactory(symbol="TSLA")
+        now = 1638216000  # 29th November 2021 3:00pm
+        hourly = StrategyFactory(
+            asset=tsla, type=Strategy.MOVING_AVERAGE_7D, timeframe=Strategy.HOUR_1
+        )
+        minutely = StrategyFactory(
+            asset=tsla, type=Strategy.MOVING_AVERAGE_7D, timeframe=Strategy.MIN_1
+        )
+        window = 5 * 7
+        hours = latest_bar_times(window + 1, now, Strategy.HOUR_1)
+        times = completed_bar_times(hours[0], now)
+        # Latest completed hour closes above the average after the hour before
+        # closes below it
+        closes = np.where(
+            times >= hours[-1], 120, np.where(times >= hours[-2], 90, 100)
+        )
+        for t, c in zip(times, closes):
+            BarFactory(asset=tsla, t=int(t), c=int(c))
+
+        signals = moving_average_signals([hourly, minutely], now=now)
+
+        # Timeframes shorter than the stored bars are not evaluated
+        self.assertEqual(list(signals), [hourly.pk])
+        self.assertEqual(signals[hourly.pk]["side"], BUY)
+        self.assertEqual(signals[hourly.pk]["close"], 120)
+        self.assertEqual(signals[hourly.pk]["t"], hours[-1])
+        self.assertAlmostEqual(
+            signals[hourly.pk]["moving_average"],
+            (100 * (window - 2) + 90 + 120) / window,
+        )
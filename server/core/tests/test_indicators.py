@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+from core.indicators import (
+    ATR,
+    EMA,
+    MACD,
+    RSI,
+    SMA,
+    Bollinger,
+    atr,
+    bollinger,
+    ema,
+    macd,
+    rsi,
+    sma,
+)
+from django.test import TestCase
+
+
+def replay(indicator, *series):
+    """Update an indicator with every bar, saving and restoring its state."""
+    values = []
+    for bar in zip(*series):
+        values.append(indicator.update(*bar))
+        # State survives a round trip through strict JSON, without `nan`
+        indicator = type(indicator).from_dict(
+            json.loads(json.dumps(indicator.to_dict(), allow_nan=False))
+        )
+    return indicator, np.array(values, dtype=float)
+
+
+class IndicatorTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 300)))
+        self.highs = self.closes * (1 + rng.uniform(0, 0.01, 300))
+        self.lows = self.closes * (1 - rng.uniform(0, 0.01, 300))
+
+    def test_batch_matches_incremental(self):
+        """Batch and incremental modes produce identical values."""
+        cases = [
+            (sma(self.closes, 20), SMA(20), (self.closes,)),
+            (ema(self.closes, 20), EMA(20), (self.closes,)),
+            (rsi(self.closes, 14), RSI(14), (self.closes,)),
+            (np.array(macd(self.closes)).T, MACD(), (self.closes,)),
+            (np.array(bollinger(self.closes)).T, Bollinger(), (self.closes,)),
+            (
+                atr(self.highs, self.lows, self.closes, 14),
+                ATR(14),
+                (self.highs, self.lows, self.closes),
+            ),
+        ]
+        for batch, indicator, series in cases:
+            with self.subTest(msg=type(indicator).__name__):
+                indicator, values = replay(indicator, *series)
+
+                np.testing.assert_array_equal(values, batch)
+                self.assertTrue(indicator.is_ready)
+                self.assertEqual(indicator.count, len(self.closes))
+
+    def test_warm_up(self):
+        """Values are `nan` until enough bars have been seen."""
+        self.assertEqual(np.isnan(sma(self.closes, 20)).sum(), 19)
+        self.assertEqual(np.isnan(ema(self.closes, 20)).sum(), 19)
+        self.assertEqual(np.isnan(rsi(self.closes, 14)).sum(), 14)
+        self.assertEqual(np.isnan(macd(self.closes, 12, 26, 9)[1]).sum(), 25 + 8)
+        self.assertEqual(np.isnan(atr(self.highs, self.lows, self.closes)).sum(), 13)
+        self.assertFalse(SMA(20).is_ready)
+        self.assertTrue(np.isnan(sma(self.closes[:5], 20)).all())
+
+    def test_to_dict(self):
+        """State during warm-up is stored as strict JSON."""
+        for indicator in (RSI(), MACD(), Bollinger(), ATR()):
+            with self.subTest(msg=type(indicator).__name__):
+                data = json.loads(json.dumps(indicator.to_dict(), allow_nan=False))
+                restored = type(indicator).from_dict(data)
+
+                self.assertFalse(restored.is_ready)
+                np.testing.assert_array_equal(restored.value, indicator.value)
+                self.assertEqual(
+                    type(restored.value), type(indicator.value), msg="value type"
+                )
+
+    def test_values(self):
+        """Indicators match values computed by hand."""
+        closes = np.array([1.0, 2, 3, 4, 5])
+
+        np.testing.assert_array_equal(sma(closes, 2)[1:], [1.5, 2.5, 3.5, 4.5])
+        # Seeded by the mean of the first window, then alpha = 2 / (window + 1)
+        np.testing.assert_allclose(ema(closes, 3)[2:], [2, 3, 4])
+        # Only gains, so the relative strength index is at its maximum
+        np.testing.assert_array_equal(rsi(closes, 2)[2:], [100, 100, 100])
+
+        lower, middle, upper = bollinger(closes, 2, 2)
+        np.testing.assert_array_equal(middle[1:], [1.5, 2.5, 3.5, 4.5])
+        np.testing.assert_array_equal(upper[1:] - middle[1:], [1, 1, 1, 1])
+
+        # True range includes the gap from the previous close
+        highs = np.array([11.0, 13, 12])
+        lows = np.array([9.0, 12, 10])
+        closes = np.array([10.0, 12, 11])
+        np.testing.assert_array_equal(atr(highs, lows, closes, 2)[1:], [2.5, 2.25])
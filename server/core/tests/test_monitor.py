@@ -0,0 +1,312 @@
+import asyncio
+import uuid
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import requests
+from alpaca_trade_api.entity import Order as AlpacaOrder
+from alpaca_trade_api.entity import Position as AlpacaPosition
+from assets.tests.factories import AssetFactory
+from core.backtest import STOP_LOSS, TAKE_PROFIT
+from core.monitor import Monitor, MonitorStream, ThresholdBook, exit_prices
+from core.tests.fake_alpaca import mock_api
+from core.tests.factories import StrategyFactory
+from core.trading_calendar import EXCHANGE_TIMEZONE
+from core.transport import http_error
+from django.test import TestCase
+from orders.ledger import intent_client_order_id
+from orders.models import Order, OrderIntent
+from orders.tests.factories import OrderFactory
+
+
+def epoch(year, month, day, hour=0, minute=0):
+    return int(
+        EXCHANGE_TIMEZONE.localize(datetime(year, month, day, hour, minute)).timestamp()
+    )
+
+
+def at_now():
+    """Submit exits during the 10:00 15Min bar of a session."""
+    return patch(
+        "core.monitor.timezone.now",
+        return_value=EXCHANGE_TIMEZONE.localize(datetime(2021, 11, 29, 10, 5)),
+    )
+
+
+def alpaca_order(symbol, qty):
+    return AlpacaOrder(
+        {
+            "id": str(uuid.uuid4()),
+            "client_order_id": str(uuid.uuid4()),
+            "created_at": "2021-11-29T15:00:00Z",
+            "symbol": symbol,
+            "qty": str(qty),
+            "filled_qty": "0",
+            "order_class": "",
+            "side": Order.SELL,
+            "type": Order.MARKET,
+            "time_in_force": Order.DAY,
+            "status": Order.ACCEPTED,
+            "extended_hours": False,
+        }
+    )
+
+
+class ThresholdBookTests(TestCase):
+    def setUp(self):
+        self.tsla = AssetFactory(symbol="TSLA")
+        self.aapl = AssetFactory(symbol="AAPL")
+        self.stop_loss = StrategyFactory(
+            asset=self.tsla, trade_value=1000, stop_loss_percentage=5
+        )
+        self.take_profit = StrategyFactory(
+            asset=self.tsla, trade_value=500, take_profit_amount=50
+        )
+        self.both = StrategyFactory(
+            asset=self.aapl,
+            trade_value=1000,
+            stop_loss_amount=100,
+            stop_loss_percentage=5,
+            take_profit_percentage=20,
+        )
+        self.stop_loss.held_qty = 10
+        self.take_profit.held_qty = 5
+        self.both.held_qty = 10
+        self.positions = [
+            {"symbol": "TSLA", "side": "long", "qty": "20", "avg_entry_price": "100"},
+            {"symbol": "AAPL", "side": "long", "qty": "5", "avg_entry_price": "100"},
+        ]
+
+    def test_exit_prices(self):
+        """The tightest threshold of each position is used."""
+        stop_prices = exit_prices(
+            np.array([100.0, 100, 100]),
+            np.array([10.0, 10, 10]),
+            np.array([50, np.nan, np.nan]),
+            np.array([10, 2, np.nan]),
+            -1,
+        )
+        np.testing.assert_array_equal(stop_prices, [95, 98, -np.inf])
+
+    def test_build(self):
+        """Thresholds are measured from the entry price of each position."""
+        book = ThresholdBook.build(
+            [self.stop_loss, self.take_profit, self.both], self.positions
+        )
+
+        rows = {row["strategy_id"]: row for row in book.rows}
+        self.assertEqual(rows[self.stop_loss.pk]["stop_price"], 95)
+        self.assertEqual(rows[self.stop_loss.pk]["target_price"], np.inf)
+        # Sized at the quantity bought, so $50 profit on 5 shares
+        self.assertEqual(rows[self.take_profit.pk]["qty"], 5)
+        self.assertEqual(rows[self.take_profit.pk]["target_price"], 110)
+        # Only 5 shares are held, so $100 loss is a $20 fall
+        self.assertEqual(rows[self.both.pk]["qty"], 5)
+        self.assertEqual(rows[self.both.pk]["stop_price"], 95)
+        self.assertEqual(rows[self.both.pk]["target_price"], 120)
+
+        with self.subTest(msg="exits together sell at most the position."):
+            self.stop_loss.held_qty = 18
+            never_bought = StrategyFactory(asset=self.tsla, stop_loss_percentage=5)
+            never_bought.held_qty = 0
+            book = ThresholdBook.build(
+                [never_bought, self.stop_loss, self.take_profit], self.positions
+            )
+            self.assertEqual(
+                [(row["strategy_id"], row["qty"]) for row in book.rows],
+                [(self.stop_loss.pk, 18), (self.take_profit.pk, 2)],
+            )
+
+        with self.subTest(msg="positions with an open order are not monitored."):
+            book = ThresholdBook.build(
+                [self.stop_loss, self.take_profit, self.both],
+                self.positions,
+                pending_symbols=["TSLA"],
+            )
+            self.assertEqual(book.symbols, ["AAPL"])
+
+    def test_evaluate(self):
+        """Every threshold is compared against a batch of prices at once."""
+        book = ThresholdBook.build(
+            [self.stop_loss, self.take_profit, self.both], self.positions
+        )
+
+        self.assertEqual(book.evaluate(["TSLA", "AAPL", "MSFT"], [100, 100, 1]), [])
+
+        exits = book.evaluate(["TSLA", "AAPL", "TSLA"], [111, 96, 94])
+
+        self.assertEqual(
+            {(e["strategy_id"], e["reason"], e["price"]) for e in exits},
+            {
+                (self.stop_loss.pk, STOP_LOSS, 94),
+                (self.take_profit.pk, TAKE_PROFIT, 111),
+            },
+        )
+        self.assertEqual(len(book), 1)
+
+        # Exits are only returned once
+        self.assertEqual(book.evaluate(["TSLA"], [50]), [])
+
+
+class MonitorTests(TestCase):
+    def setUp(self):
+        self.tsla = AssetFactory(symbol="TSLA")
+        self.strategy = StrategyFactory(
+            asset=self.tsla, trade_value=1000, stop_loss_percentage=5
+        )
+        StrategyFactory(asset=self.tsla, trade_value=1000)
+        OrderFactory(
+            user=self.strategy.user,
+            strategy=self.strategy,
+            asset_id=self.tsla,
+            side=Order.BUY,
+            filled_qty=10,
+        )
+        self.api = mock_api()
+        self.api.list_positions.return_value = [
+            AlpacaPosition(
+                {
+                    "symbol": "TSLA",
+                    "side": "long",
+                    "qty": "20",
+                    "avg_entry_price": "100",
+                }
+            )
+        ]
+        self.api.open_orders.return_value = []
+        self.api.submit_order.return_value = alpaca_order("TSLA", 10)
+
+    def test_refresh(self):
+        """Strategies with exits are loaded with a single query."""
+        monitor = Monitor(api=self.api)
+
+        with self.assertNumQueries(1):
+            book = monitor.refresh()
+
+        self.assertEqual(
+            [(row["strategy_id"], row["qty"]) for row in book.rows],
+            [(self.strategy.pk, 10)],
+        )
+        self.assertFalse(monitor.is_stale())
+
+        with self.subTest(msg="strategies which sold are not monitored."):
+            OrderFactory(
+                user=self.strategy.user,
+                strategy=self.strategy,
+                asset_id=self.tsla,
+                side=Order.SELL,
+                filled_qty=10,
+            )
+            self.assertEqual(monitor.refresh().rows, [])
+
+    def test_on_prices(self):
+        """Prices are evaluated without reading the database."""
+        monitor = Monitor(api=self.api)
+        monitor.refresh()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(monitor.on_prices(["TSLA"] * 1000, [99.0] * 1000), [])
+
+        # The intent is written and read back, and saved with its order
+        with self.assertNumQueries(4), at_now():
+            orders = monitor.on_prices(["TSLA", "TSLA"], [96, 94.5])
+
+        # Sold on the 15Min bar in progress, from 10:00
+        client_order_id = intent_client_order_id(
+            self.strategy.pk, epoch(2021, 11, 29, 10), Order.SELL
+        )
+        self.api.submit_order.assert_called_once_with(
+            client_order_id=str(client_order_id),
+            symbol="TSLA",
+            qty=10,
+            side=Order.SELL,
+            type=Order.MARKET,
+            time_in_force=Order.DAY,
+        )
+        self.assertEqual(len(orders), 1)
+        order = Order.objects.get(side=Order.SELL)
+        self.assertEqual(order.strategy, self.strategy)
+        self.assertEqual(order.user, self.strategy.user)
+        self.assertEqual(OrderIntent.objects.get().order, order)
+
+    def test_on_prices_placed_once(self):
+        """Exits which may have been placed are not submitted again."""
+        self.api.submit_order.side_effect = requests.exceptions.Timeout()
+        self.api.get_order_by_client_order_id.side_effect = (
+            requests.exceptions.Timeout()
+        )
+        monitor = Monitor(api=self.api)
+        monitor.refresh()
+
+        with patch("orders.dispatch.RETRY_BACKOFF", 0), at_now():
+            self.assertEqual(monitor.on_prices(["TSLA"], [90]), [])
+        self.assertEqual(OrderIntent.objects.get().status, OrderIntent.PENDING)
+
+        # The order was placed, so Alpaca rejects its client order id, and
+        # the exit is recovered rather than placed again
+        placed = alpaca_order("TSLA", 10)
+        self.api.submit_order.side_effect = http_error(
+            422, "Unprocessable Entity", "/v2/orders"
+        )
+        self.api.get_order_by_client_order_id.side_effect = None
+        self.api.get_order_by_client_order_id.return_value = placed
+        monitor.refresh()
+
+        with at_now():
+            orders = monitor.on_prices(["TSLA"], [90])
+
+        self.assertEqual([order.id for order in orders], [placed.id])
+        client_order_ids = {
+            call.kwargs["client_order_id"]
+            for call in self.api.submit_order.call_args_list
+        }
+        self.assertEqual(len(client_order_ids), 1)
+        self.assertEqual(OrderIntent.objects.get().status, OrderIntent.SUBMITTED)
+        self.api.submit_order.reset_mock()
+
+        with self.subTest(msg="exits of a bar are only placed once."):
+            monitor.refresh()
+            monitor.book = ThresholdBook(monitor.book.rows)
+            with at_now():
+                self.assertEqual(monitor.on_prices(["TSLA"], [90]), [])
+            self.api.submit_order.assert_not_called()
+
+    def test_on_prices_failed_order(self):
+        """Failed exits are not recorded."""
+        self.api.submit_order.side_effect = Exception("Insufficient qty")
+        monitor = Monitor(api=self.api)
+        monitor.refresh()
+
+        self.assertEqual(monitor.on_prices(["TSLA"], [90]), [])
+        self.assertFalse(Order.objects.filter(side=Order.SELL).exists())
+
+
+class MonitorStreamTests(TestCase):
+    @patch("core.monitor.Monitor")
+    def test_batches(self, mock_monitor):
+        """Messages are buffered and evaluated in batches."""
+        monitor = mock_monitor.return_value
+        monitor.book.symbols = ["TSLA", "AAPL"]
+        stream = MagicMock()
+        monitor_stream = MonitorStream(monitor, stream, quotes=True)
+
+        async def feed():
+            await monitor_stream.on_trade({"S": "TSLA", "p": 100})
+            await monitor_stream.on_trade({"S": "AAPL", "p": 50})
+            await monitor_stream.on_quote({"S": "TSLA", "bp": 99, "ap": 101})
+            while monitor_stream.draining:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(feed())
+
+        # Handlers do not yield to the event loop, so every message is
+        # buffered before the batch is evaluated
+        monitor.on_prices.assert_called_once_with(
+            ["TSLA", "AAPL", "TSLA"], [100, 50, 99]
+        )
+        # Symbols of the book are subscribed to once
+        stream.subscribe_trades.assert_called_once_with(
+            monitor_stream.on_trade, "AAPL", "TSLA"
+        )
+        stream.subscribe_quotes.assert_called_once()
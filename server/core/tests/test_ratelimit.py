@@ -0,0 +1,103 @@
+import time
+from unittest.mock import patch
+
+import fakeredis
+import redis
+from core.ratelimit import (
+    BACKFILL,
+    ORDERS,
+    TRADING,
+    RateLimiter,
+    api_priority,
+    endpoint_cost,
+)
+from core.tests.fake_alpaca import FakeAlpacaServer
+from core.transport import AlpacaTransport, SyncTransport
+from django.test import TestCase
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeRedis()
+        # 10 tokens, refilled at 10 tokens per second
+        self.limiter = RateLimiter(self.client, rate=10, period=1)
+
+    def test_reserve(self):
+        """Tokens are taken until the bucket is empty, and then waited for."""
+        self.assertEqual([self.limiter.reserve(2, ORDERS) for _ in range(5)], [0] * 5)
+
+        wait = self.limiter.reserve(2, ORDERS)
+
+        self.assertGreater(wait, 0.15)
+        self.assertLessEqual(wait, 0.2)
+        # The bucket is shared by every limiter using the same Redis
+        self.assertGreater(RateLimiter(self.client, rate=10, period=1).reserve(), 0)
+
+        time.sleep(wait)
+        self.assertEqual(self.limiter.reserve(2, ORDERS), 0)
+
+    def test_priority(self):
+        """Lower classes leave a reserve, and yield to higher classes waiting."""
+        # Backfill leaves half the bucket for higher classes
+        self.assertEqual([self.limiter.reserve(1, BACKFILL) for _ in range(5)], [0] * 5)
+        self.assertGreater(self.limiter.reserve(1, BACKFILL), 0)
+        self.assertEqual(self.limiter.reserve(2, TRADING), 0)
+
+        # Orders wait for more tokens than are left
+        wait = self.limiter.reserve(5, ORDERS)
+        self.assertGreater(wait, 0)
+        # Tokens left are kept for the orders waiting
+        self.assertGreater(self.limiter.reserve(1, TRADING), 0)
+
+        time.sleep(wait)
+        self.assertEqual(self.limiter.reserve(5, ORDERS), 0)
+
+    def test_unavailable(self):
+        """Requests are not limited while Redis cannot be reached."""
+        limiter = RateLimiter(redis.Redis(port=1))
+
+        with self.assertLogs("core.ratelimit", "WARNING"):
+            self.assertEqual(limiter.reserve(), 0)
+        with patch.object(limiter, "script") as mock_script:
+            self.assertEqual(limiter.reserve(), 0)
+        mock_script.assert_not_called()
+
+    def test_endpoint_cost(self):
+        """Requests are weighed and classed by endpoint, or by context."""
+        self.assertEqual(endpoint_cost("POST", "/orders"), (1, ORDERS))
+        self.assertEqual(endpoint_cost("GET", "/bars/15Min"), (2, TRADING))
+        self.assertEqual(endpoint_cost("GET", "/orders"), (1, TRADING))
+        with api_priority(BACKFILL):
+            self.assertEqual(endpoint_cost("GET", "/bars/15Min"), (2, BACKFILL))
+        self.assertEqual(endpoint_cost("GET", "/clock"), (1, TRADING))
+
+    def test_transport(self):
+        """Requests wait on the limiter, in the class of the calling thread."""
+        server = FakeAlpacaServer()
+        url = server.__enter__()
+        self.addCleanup(server.__exit__)
+        transport = SyncTransport(
+            AlpacaTransport(
+                key_id="key",
+                secret_key="secret",
+                base_url=url,
+                data_url=url,
+                limiter=self.limiter,
+            )
+        )
+        self.addCleanup(transport.close)
+
+        with patch.object(
+            self.limiter, "reserve", wraps=self.limiter.reserve
+        ) as mock_reserve:
+            started = time.monotonic()
+            for _ in range(4):
+                transport.get_barset("TSLA", "15Min")
+            with api_priority(BACKFILL):
+                transport.get_clock()
+
+        # Bars weigh 2 tokens, so the last requests waited for the bucket
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(mock_reserve.call_args_list[0].args, (2, TRADING))
+        self.assertEqual(mock_reserve.call_args_list[-1].args, (1, BACKFILL))
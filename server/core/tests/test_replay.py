@@ -0,0 +1,138 @@
+import tempfile
+from datetime import datetime
+from io import StringIO
+
+import numpy as np
+
+from assets.cache import get_bar_cache
+from assets.models import Bar
+from assets.tests.factories import AssetFactory, BarFactory
+from core.models import Strategy
+from core.replay import FakeTradeApi, ReplaySimulator, load_recording, retime
+from core.trading_calendar import EXCHANGE_TIMEZONE
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from freezegun import freeze_time
+from orders.models import Order
+
+
+def epoch(year, month, day, hour=0, minute=0):
+    return int(
+        EXCHANGE_TIMEZONE.localize(datetime(year, month, day, hour, minute)).timestamp()
+    )
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        self.tsla = AssetFactory(symbol="TSLA")
+        # Daily sample bars replayed as 15Min bars from 1st November 2021
+        self.recording = retime(
+            load_recording("assets/tests/sample_tsla_bars.json"), epoch(2021, 11, 1)
+        )
+
+    def test_retime(self):
+        """Recorded bars are moved onto consecutive calendar bars."""
+        times = self.recording["TSLA"]["t"]
+
+        self.assertEqual(times[0], epoch(2021, 11, 1, 9, 30))
+        self.assertEqual(times[26], epoch(2021, 11, 2, 9, 30))
+        self.assertEqual(len(times), 397)
+
+    def test_fake_trade_api(self):
+        """Only completed bars are visible, and orders fill at the latest close."""
+        api = FakeTradeApi(self.recording)
+
+        with freeze_time("2021-11-01 14:00:00"):
+            # 10:00 ET, so the 9:30 bar has completed
+            clock = api.get_clock().__dict__["_raw"]
+            self.assertTrue(clock["is_open"])
+            bars = api.get_bars(["TSLA"], "15Min", limit=10)["TSLA"]
+            self.assertEqual(len(bars), 2)
+
+            api.submit_order(
+                symbol="TSLA",
+                notional=1000,
+                side=Order.BUY,
+                type="market",
+                time_in_force="gtc",
+            )
+            position = api.list_positions()[0].__dict__["_raw"]
+            self.assertEqual(float(position["market_value"]), 1000)
+            self.assertEqual(api.cash, 99000)
+
+        with freeze_time("2021-11-06 14:00:00"):
+            clock = api.get_clock().__dict__["_raw"]
+            self.assertFalse(clock["is_open"])
+            self.assertEqual(clock["next_open"], "2021-11-08T14:30:00+00:00")
+
+    def test_replay(self):
+        """Recorded bars are replayed through the tick without keeping any data."""
+        # Closes oscillate around the moving average to cross it
+        closes = (100 + 10 * np.sin(np.arange(180) * 2 * np.pi / 40)).round(2)
+        recording = {
+            "TSLA": {
+                "t": self.recording["TSLA"]["t"][:180],
+                "o": closes,
+                "h": closes,
+                "l": closes,
+                "c": closes,
+                "v": np.ones(180),
+            }
+        }
+        simulator = ReplaySimulator(recording, strategies_per_symbol=2)
+
+        summary = simulator.run()
+
+        self.assertEqual(summary["ticks"], 180)
+        self.assertGreater(summary["orders"], 0)
+        self.assertGreater(summary["queries_max"], 0)
+        self.assertGreater(summary["requests"]["get_bars"], 0)
+        # Account is only requested on ticks with a BUY or SELL signal
+        self.assertLess(summary["requests"]["account_info"], 180)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Strategy.objects.count(), 0)
+        self.assertEqual(Bar.objects.count(), 0)
+
+    def test_replay_command(self):
+        """Replay command prints a summary of the replay."""
+        for t in self.recording["TSLA"]["t"][:26]:
+            BarFactory(asset=self.tsla, t=t)
+        out = StringIO()
+
+        call_command(
+            "replay",
+            "--symbols",
+            "TSLA",
+            "--start",
+            "2021-11-01",
+            "--end",
+            "2021-11-02",
+            stdout=out,
+        )
+
+        self.assertIn("Ticks: 26, orders: 0", out.getvalue())
+        # Replayed bars are restored
+        self.assertEqual(Bar.objects.count(), 26)
+
+    def test_replay_keeps_bar_cache(self):
+        """Replayed bars are not written to the bar cache."""
+        for t in self.recording["TSLA"]["t"][:26]:
+            BarFactory(asset=self.tsla, t=t, c=1)
+        recording = {
+            field: values[:26] + (10 if field == "t" else 0)
+            for field, values in self.recording["TSLA"].items()
+        }
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            BAR_CACHE_DIR=directory
+        ):
+            cache = get_bar_cache()
+            cache.load(self.tsla.pk)
+            meta = cache.meta(self.tsla.pk)
+
+            ReplaySimulator({"TSLA": recording}).run()
+
+            self.assertEqual(cache.meta(self.tsla.pk), meta)
+            bars = cache.load(self.tsla.pk)
+            self.assertEqual(list(bars["t"]), list(self.recording["TSLA"]["t"][:26]))
+            self.assertEqual(list(bars["c"]), [1] * 26)
@@ -0,0 +1,182 @@
+import tempfile
+from datetime import datetime
+
+import numpy as np
+from assets.cache import get_bar_cache
+from assets.ingest import ingest_bars
+from assets.models import Bar
+from assets.tests.factories import AssetFactory
+from core.resample import ResampleCache, can_resample, resample
+from core.trading_calendar import EXCHANGE_TIMEZONE, bar_times
+from django.test import TestCase, override_settings
+
+
+def epoch(year, month, day, hour=0, minute=0):
+    return int(
+        EXCHANGE_TIMEZONE.localize(datetime(year, month, day, hour, minute)).timestamp()
+    )
+
+
+class ResampleTests(TestCase):
+    def test_resample(self):
+        """Bars are aggregated within sessions, aligned to the open."""
+        # Full session on 24th, and early close on 26th November 2021
+        start = epoch(2021, 11, 24)
+        times = bar_times(start, start + 3 * 86400)
+        bars = {
+            "t": times,
+            "o": np.arange(len(times)) + 0.5,
+            "h": np.arange(len(times)) + 1.0,
+            "l": np.arange(len(times)) + 0.0,
+            "c": np.arange(len(times)) + 0.75,
+            "v": np.ones(len(times)),
+        }
+
+        hourly = resample(bars, "1H")
+
+        self.assertEqual(len(hourly["t"]), 7 + 4)
+        self.assertEqual(hourly["t"][1], times[4])
+        self.assertEqual(hourly["o"][1], 4.5)
+        self.assertEqual(hourly["h"][1], 8)
+        self.assertEqual(hourly["l"][1], 4)
+        self.assertEqual(hourly["c"][1], 7.75)
+        # Last bar of each session only covers the bars before the close
+        self.assertEqual(hourly["v"][6], 2)
+        self.assertEqual(hourly["v"][10], 2)
+        np.testing.assert_array_equal(hourly["t"], bar_times(start, times[-1], "1H"))
+
+        daily = resample(bars, "1D")
+
+        np.testing.assert_array_equal(daily["t"], [times[0], times[26]])
+        np.testing.assert_array_equal(daily["v"], [26, 14])
+        np.testing.assert_array_equal(daily["c"], [25.75, 39.75])
+
+        with self.assertRaises(ValueError):
+            resample(bars, "5Min")
+
+    @override_settings(BAR_BASE_TIMEFRAME="1Min")
+    def test_can_resample(self):
+        """Only timeframes as long as the stored bars can be derived."""
+        self.assertTrue(can_resample("1Min"))
+        self.assertTrue(can_resample("1D"))
+        self.assertFalse(can_resample("1Min", source="15Min"))
+
+
+class ResampleCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ResampleCache()
+        self.tsla = AssetFactory(symbol="TSLA")
+        # Full session on 24th, and early close on 26th November 2021
+        self.times = bar_times(epoch(2021, 11, 24), epoch(2021, 11, 26, 11))
+        self.create_bars(self.times)
+
+    def create_bars(self, times):
+        Bar.objects.bulk_create(
+            [
+                Bar(asset=self.tsla, t=t, o=1, h=2, l=1, c=i % 10, v=1)
+                for i, t in enumerate(times)
+            ]
+        )
+
+    def test_refresh(self):
+        """Only completed derived bars are returned."""
+        now = epoch(2021, 11, 26, 11, 15)
+        key = (str(self.tsla.id), "1H")
+
+        with self.assertNumQueries(1):
+            series = self.cache.refresh([(self.tsla.id, "1H", 5)], now)
+
+        # 10:30 bar completes at 11:30
+        bars = series[key]
+        np.testing.assert_array_equal(
+            bars["t"],
+            [
+                epoch(2021, 11, 24, 12, 30),
+                epoch(2021, 11, 24, 13, 30),
+                epoch(2021, 11, 24, 14, 30),
+                epoch(2021, 11, 24, 15, 30),
+                epoch(2021, 11, 26, 9, 30),
+            ],
+        )
+        self.assertEqual(bars["v"][-2], 2)
+
+        with self.assertNumQueries(1):
+            # No new bars, so the cached series is used
+            self.cache.refresh([(self.tsla.id, "1H", 5)], now)
+
+    def test_refresh_bar_cache(self):
+        """Series are derived from the bar cache, if enabled."""
+        now = epoch(2021, 11, 26, 11, 15)
+        key = (str(self.tsla.id), "1H")
+        expected = ResampleCache().refresh([(self.tsla.id, "1H", 5)], now)[key]
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            BAR_CACHE_DIR=directory
+        ):
+            get_bar_cache().load(self.tsla.id)
+
+            # Only the extents of the bars are queried
+            with self.assertNumQueries(1):
+                series = self.cache.refresh([(self.tsla.id, "1H", 5)], now)
+
+        for field, values in expected.items():
+            np.testing.assert_array_equal(series[key][field], values)
+
+    def test_refresh_new_bars(self):
+        """New bars only derive the last derived bar onwards."""
+        now = epoch(2021, 11, 26, 11, 15)
+        self.cache.refresh([(self.tsla.id, "1H", 5)], now)
+
+        later = epoch(2021, 11, 26, 11, 30)
+        self.create_bars([epoch(2021, 11, 26, 11, 15)])
+
+        with self.assertNumQueries(2):
+            bars = self.cache.refresh([(self.tsla.id, "1H", 5)], later)[
+                (str(self.tsla.id), "1H")
+            ]
+
+        self.assertEqual(bars["t"][-1], epoch(2021, 11, 26, 10, 30))
+        self.assertEqual(bars["v"][-1], 4)
+
+        # Matches a rebuild of the series
+        rebuilt = ResampleCache().refresh([(self.tsla.id, "1H", 5)], later)
+        for field, values in rebuilt[(str(self.tsla.id), "1H")].items():
+            np.testing.assert_array_equal(bars[field], values)
+
+    def test_refresh_corrections(self):
+        """Bars corrected in place derive their bars again."""
+        now = epoch(2021, 11, 26, 11, 15)
+        key = (str(self.tsla.id), "1H")
+        self.cache.refresh([(self.tsla.id, "1H", 5)], now)
+
+        ingest_bars(
+            {
+                "TSLA": [
+                    {"t": t, "o": 1, "h": 9, "l": 1, "c": 5, "v": 3}
+                    for t in (epoch(2021, 11, 24, 15, 45), epoch(2021, 11, 26, 10, 0))
+                ]
+            }
+        )
+        bars = self.cache.refresh([(self.tsla.id, "1H", 5)], now)[key]
+
+        self.assertEqual(bars["v"][-2], 4)
+        self.assertEqual(bars["h"][-1], 9)
+        rebuilt = ResampleCache().refresh([(self.tsla.id, "1H", 5)], now)[key]
+        for field, values in rebuilt.items():
+            np.testing.assert_array_equal(bars[field], values)
+
+    def test_refresh_backfill(self):
+        """Bars stored within a series rebuild the series."""
+        Bar.objects.filter(asset=self.tsla, t=epoch(2021, 11, 24, 15, 45)).delete()
+        now = epoch(2021, 11, 26, 11, 15)
+        bars = self.cache.refresh([(self.tsla.id, "1H", 5)], now)[
+            (str(self.tsla.id), "1H")
+        ]
+        self.assertEqual(bars["v"][-2], 1)
+
+        self.create_bars([epoch(2021, 11, 24, 15, 45)])
+        bars = self.cache.refresh([(self.tsla.id, "1H", 5)], now)[
+            (str(self.tsla.id), "1H")
+        ]
+
+        self.assertEqual(bars["v"][-2], 2)
@@ -0,0 +1,127 @@
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+from assets.cache import get_bar_cache
+from assets.ingest import ingest_bars
+from assets.tests.factories import AssetFactory, BarFactory
+from core.rolling import RollingStore, RollingWindow
+from django.test import TestCase, override_settings
+
+
+class RollingWindowTests(TestCase):
+    def test_push(self):
+        """Running averages match averages computed from scratch."""
+        closes = np.random.default_rng(0).uniform(1, 1000, 50)
+        state = RollingWindow(10)
+
+        for count, close in enumerate(closes, start=1):
+            state.push(close)
+            latest = closes[max(count - 10, 0) : count]
+            self.assertAlmostEqual(state.moving_average(), latest.mean())
+            self.assertEqual(state.latest_close(), close)
+            if count > 1:
+                previous = closes[max(count - 11, 0) : count - 1]
+                self.assertAlmostEqual(state.previous_moving_average(), previous.mean())
+                self.assertEqual(state.previous_close(), closes[count - 2])
+
+    def test_empty(self):
+        """An empty window has no moving average."""
+        state = RollingWindow(10)
+
+        self.assertTrue(np.isnan(state.moving_average()))
+        self.assertTrue(np.isnan(state.previous_moving_average()))
+
+
+class RollingStoreTests(TestCase):
+    def setUp(self):
+        self.store = RollingStore()
+        self.asset = AssetFactory()
+        for t in range(1, 6):
+            BarFactory(asset=self.asset, t=t * 100, c=t)
+
+    def test_refresh_builds_state(self):
+        """Windows are built from the latest stored bars."""
+        state = self.store.refresh([(self.asset.id, 3)])[(str(self.asset.id), 3)]
+
+        self.assertEqual(state.moving_average(), 4)
+        self.assertEqual(state.previous_moving_average(), 3)
+        self.assertEqual(state.last_t, 500)
+
+    def test_refresh_applies_new_bars(self):
+        """New bars are pushed without rebuilding the window."""
+        self.store.refresh([(self.asset.id, 3)])
+        BarFactory(asset=self.asset, t=600, c=6)
+
+        with patch.object(self.store, "rebuild") as mock_rebuild:
+            state = self.store.refresh([(self.asset.id, 3)])[(str(self.asset.id), 3)]
+
+        mock_rebuild.assert_not_called()
+        self.assertEqual(state.moving_average(), 5)
+        self.assertEqual(state.last_t, 600)
+
+    def test_refresh_rebuilds_after_backfill(self):
+        """Bars stored out of order rebuild the window."""
+        self.store.refresh([(self.asset.id, 3)])
+        BarFactory(asset=self.asset, t=450, c=100)
+
+        state = self.store.refresh([(self.asset.id, 3)])[(str(self.asset.id), 3)]
+
+        self.assertEqual(state.moving_average(), (100 + 4 + 5) / 3)
+        self.assertEqual(state.previous_moving_average(), (3 + 100 + 4) / 3)
+
+        # Backfilled bar is not treated as new on the next refresh
+        with patch.object(self.store, "rebuild") as mock_rebuild:
+            self.store.refresh([(self.asset.id, 3)])
+
+        mock_rebuild.assert_not_called()
+
+    def test_refresh_rebuilds_after_correction(self):
+        """Bars corrected in place rebuild the window."""
+        self.store.refresh([(self.asset.id, 3)])
+        ingest_bars(
+            {
+                self.asset.symbol: [
+                    {"t": 500, "o": 50, "h": 50, "l": 50, "c": 50, "v": 1}
+                ]
+            }
+        )
+
+        state = self.store.refresh([(self.asset.id, 3)])[(str(self.asset.id), 3)]
+
+        self.assertEqual(state.moving_average(), (3 + 4 + 50) / 3)
+        self.assertEqual(state.latest_close(), 50)
+
+    def test_refresh_reads_bar_cache(self):
+        """Windows are built from the bar cache, if enabled."""
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            BAR_CACHE_DIR=directory
+        ):
+            get_bar_cache().load(self.asset.pk)
+
+            # Only the extents of the bars are queried
+            with self.assertNumQueries(1):
+                state = self.store.refresh([(self.asset.id, 3)])[
+                    (str(self.asset.id), 3)
+                ]
+
+            self.assertEqual(state.moving_average(), 4)
+            self.assertEqual(state.previous_moving_average(), 3)
+            self.assertEqual(state.last_t, 500)
+
+            with self.subTest(msg="new bars are applied from the database."):
+                BarFactory(asset=self.asset, t=600, c=6)
+                state = self.store.refresh([(self.asset.id, 3)])[
+                    (str(self.asset.id), 3)
+                ]
+                self.assertEqual(state.moving_average(), 5)
+
+            with self.subTest(msg="cached bars behind the stored bars are rebuilt."):
+                # Stored by another host, so not appended to this cache
+                BarFactory(asset=self.asset, t=700, c=7)
+                self.store.clear()
+                state = self.store.refresh([(self.asset.id, 3)])[
+                    (str(self.asset.id), 3)
+                ]
+                self.assertEqual(state.moving_average(), 6)
+                self.assertEqual(state.last_t, 700)
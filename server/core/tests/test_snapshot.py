@@ -0,0 +1,85 @@
+from unittest.mock import MagicMock
+
+from alpaca_trade_api.entity import Account as AlpacaAccount
+from alpaca_trade_api.entity import Position as AlpacaPosition
+from core.snapshot import AccountSnapshot
+from django.test import TestCase
+from orders.models import Order
+
+
+class AccountSnapshotTests(TestCase):
+    def setUp(self):
+        self.api = MagicMock()
+        self.api.account_info.return_value = AlpacaAccount({"equity": "100000"})
+        self.api.list_positions.return_value = [
+            AlpacaPosition({"symbol": "TSLA", "side": "long", "market_value": "2000"}),
+            AlpacaPosition({"symbol": "AAPL", "side": "long", "market_value": "500"}),
+        ]
+
+    def test_fetch(self):
+        """Account and positions are fetched with one request each."""
+        snapshot = AccountSnapshot.fetch(self.api)
+
+        self.api.account_info.assert_called_once()
+        self.api.list_positions.assert_called_once()
+        self.assertEqual(snapshot.equity, 100000)
+        self.assertEqual(snapshot.position("TSLA")["market_value"], "2000")
+        self.assertIsNone(snapshot.position("MSFT"))
+
+    def test_record_order(self):
+        """Positions and buying power are updated locally as orders are placed."""
+        snapshot = AccountSnapshot.fetch(self.api)
+
+        snapshot.record_order("TSLA", Order.SELL, 500)
+        snapshot.record_order("AAPL", Order.SELL, 500)
+        snapshot.record_order("MSFT", Order.BUY, 100)
+
+        self.assertEqual(float(snapshot.position("TSLA")["market_value"]), 1500)
+        self.assertIsNone(snapshot.position("AAPL"))
+        self.assertEqual(float(snapshot.position("MSFT")["market_value"]), 100)
+        # Sales add to the buying power, and buys spend it
+        self.assertEqual(snapshot.buying_power, 100900)
+
+    def test_record_buys(self):
+        """Buys in one tick each spend the cash and buying power left."""
+        self.api.account_info.return_value = AlpacaAccount(
+            {"equity": "100000", "cash": "1500", "buying_power": "3000"}
+        )
+        snapshot = AccountSnapshot.fetch(self.api)
+
+        snapshot.record_order("MSFT", Order.BUY, 1000)
+        snapshot.record_order("MSFT", Order.BUY, 1000)
+
+        self.assertEqual(snapshot.buying_power, 1000)
+        self.assertEqual(float(snapshot.account["cash"]), -500)
+        self.assertEqual(snapshot.equity, 100000)
+        self.assertEqual(float(snapshot.position("MSFT")["market_value"]), 2000)
+
+    def test_to_dict(self):
+        """Snapshots can be passed between tasks."""
+        snapshot = AccountSnapshot.fetch(self.api)
+
+        restored = AccountSnapshot.from_dict(snapshot.to_dict())
+
+        self.assertEqual(restored.to_dict(), snapshot.to_dict())
+
+    def test_share_positions(self):
+        """Holders together are given at most the value of each position."""
+        self.api.list_positions.return_value.append(
+            AlpacaPosition({"symbol": "MSFT", "side": "short", "market_value": "-50"})
+        )
+        snapshot = AccountSnapshot.fetch(self.api)
+
+        shares = snapshot.share_positions(
+            {1: {"TSLA": 1500, "AAPL": 100}, 2: {"TSLA": 1500}, 3: {}}
+        )
+
+        self.assertEqual(float(shares[1].position("TSLA")["market_value"]), 1500)
+        self.assertEqual(float(shares[1].position("AAPL")["market_value"]), 100)
+        self.assertEqual(float(shares[2].position("TSLA")["market_value"]), 500)
+        self.assertIsNone(shares[2].position("AAPL"))
+        self.assertIsNone(shares[3].position("TSLA"))
+        self.assertEqual(shares[3].position("MSFT")["side"], "short")
+        self.assertEqual(shares[3].equity, 100000)
+        # The snapshot shared is not changed
+        self.assertEqual(snapshot.position("TSLA")["market_value"], "2000")
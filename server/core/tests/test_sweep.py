@@ -0,0 +1,119 @@
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from assets.models import Bar
+from assets.tests.factories import AssetFactory
+from core.models import BacktestResult
+from core.sweep import load_universe, run_sweep
+from core.tasks import sweep_backtests
+from core.trading_calendar import bar_times
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class SweepTests(TestCase):
+    def setUp(self):
+        self.tsla = AssetFactory(symbol="TSLA")
+        self.aapl = AssetFactory(symbol="AAPL")
+        rng = np.random.default_rng(0)
+        # Two weeks of 15Min bars from 1st November 2021
+        times = bar_times(1635739200, 1635739200 + 14 * 86400)
+        for asset in (self.tsla, self.aapl):
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(times))))
+            Bar.objects.bulk_create(
+                [
+                    Bar(asset=asset, t=t, o=c, h=c * 1.01, l=c * 0.99, c=c, v=1)
+                    for t, c in zip(times, closes.round(5))
+                ]
+            )
+        self.bar_count = len(times)
+
+    def test_load_universe(self):
+        """Bars of every asset are loaded into one array."""
+        slices, values = load_universe([self.tsla.id, self.aapl.id])
+
+        self.assertEqual(values.shape, (5, 2 * self.bar_count))
+        self.assertEqual(
+            [(start, stop) for _, start, stop in slices],
+            [(0, self.bar_count), (self.bar_count, 2 * self.bar_count)],
+        )
+        self.assertEqual(
+            {asset_id for asset_id, _, _ in slices},
+            {str(self.tsla.id), str(self.aapl.id)},
+        )
+
+    def test_run_sweep(self):
+        """Every combination of the grid is saved for every asset."""
+        parameters = {
+            "windows": [5, 10],
+            "timeframes": ["15Min", "1H", "5Min"],
+            "stop_loss_percentages": [None, 1],
+            "take_profit_percentages": [2],
+        }
+
+        with self.subTest(msg="sweep in process."):
+            sweep_id = run_sweep(
+                [self.tsla.id, self.aapl.id], max_workers=1, **parameters
+            )
+            in_process = BacktestResult.objects.filter(sweep_id=sweep_id)
+
+            # Timeframes shorter than the stored bars are skipped
+            self.assertEqual(in_process.count(), 2 * 2 * 2 * 2)
+            self.assertEqual(
+                set(in_process.values_list("timeframe", flat=True)), {"15Min", "1H"}
+            )
+
+        with self.subTest(msg="sweep in worker processes."):
+            sweep_id = run_sweep(
+                [self.tsla.id, self.aapl.id], max_workers=2, **parameters
+            )
+            in_workers = BacktestResult.objects.filter(sweep_id=sweep_id)
+
+            fields = ("asset_id", "timeframe", "window", "stop_loss_percentage")
+            self.assertEqual(
+                set(in_workers.values_list(*fields, "sharpe")),
+                set(in_process.values_list(*fields, "sharpe")),
+            )
+
+    def test_ranked(self):
+        """Results are ranked best first."""
+        sweep_id = run_sweep([self.tsla.id], [5, 10, 20], max_workers=1)
+
+        results = BacktestResult.objects.filter(sweep_id=sweep_id)
+        ranked = list(results.ranked("max_drawdown"))
+        self.assertEqual(len(ranked), 3)
+        self.assertEqual(
+            [result.max_drawdown for result in ranked],
+            sorted([result.max_drawdown for result in ranked], reverse=True),
+        )
+        with self.assertRaises(ValueError):
+            results.ranked("unknown")
+
+    def test_sweep_command(self):
+        """Sweep command prints the ranked results."""
+        out = StringIO()
+
+        call_command("sweep", "TSLA", "--windows", "5", "--workers", "1", stdout=out)
+
+        self.assertIn("TSLA 15Min window=5", out.getvalue())
+        self.assertEqual(BacktestResult.objects.count(), 1)
+
+    @patch("core.tasks.group")
+    @patch("core.tasks.run_sweep")
+    def test_sweep_backtests(self, mock_run_sweep, mock_group):
+        """Assets are split into chunks swept by separate tasks."""
+        with self.subTest(msg="assets are swept in one task."):
+            sweep_id = sweep_backtests([str(self.tsla.id)], [5])
+
+            mock_run_sweep.assert_called_once()
+            self.assertEqual(mock_run_sweep.call_args[1]["sweep_id"], sweep_id)
+            mock_group.assert_not_called()
+
+        mock_run_sweep.reset_mock()
+
+        with self.subTest(msg="assets are swept in chunks."):
+            sweep_backtests([str(self.tsla.id), str(self.aapl.id)], [5], chunk_size=1)
+
+            mock_run_sweep.assert_not_called()
+            self.assertEqual(len(list(mock_group.call_args[0][0])), 2)
@@ -1,28 +1,42 @@
 import json
+import time
 import uuid
 from datetime import timedelta
-from unittest.mock import patch
+from unittest.mock import ANY, call, patch
 
+import numpy as np
 from alpaca_trade_api.entity import Account as AlpacaAccount
 from alpaca_trade_api.entity import Order as AlpacaOrder
 from alpaca_trade_api.entity import Position as AlpacaPosition
-from assets.models import Asset, Bar
+from assets.models import Asset, Bar, BarWatermark
 from assets.tests.factories import AssetFactory
+from core.engine import HOLD, SELL
+from core.trading_calendar import latest_bar_times
 from core.tasks import (
-    fetch_bar_data_for_strategy,
+    compute_signals,
+    fetch_bar_data_for_strategies,
     moving_average_strategy,
+    record_tick,
+    run_strategies_for_user,
     run_strategies_for_users,
+    signal_key,
 )
+from core.rolling import rolling_store
+from core.snapshot import AccountSnapshot
+from core.models import Strategy
+from core.tests.fake_alpaca import mock_api
 from core.tests.factories import StrategyFactory
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 from django.utils import timezone
-from orders.models import Order
+from freezegun import freeze_time
+from orders.models import Order, OrderIntent
 from users.tests.factories import UserFactory
 
 
 class CoreTaskTests(TestCase):
     def setUp(self):
+        rolling_store.clear()
         self.tsla = AssetFactory(symbol="TSLA")
         self.user_1 = UserFactory()
         self.user_2 = UserFactory()
@@ -60,71 +74,234 @@ class CoreTaskTests(TestCase):
             Bar.objects.bulk_create(objs, batch_size=1000, ignore_conflicts=True)
 
     @patch("core.tasks.TradeApiRest")
-    @patch("core.tasks.moving_average_strategy")
-    def test_run_strategies_for_user(
-        self, mock_moving_average_strategy, mock_trade_api
+    @patch("core.tasks.market_clock")
+    @patch("core.tasks.AccountSnapshot.fetch")
+    @patch("core.tasks.compute_signals")
+    @patch("core.tasks.chord")
+    def test_run_strategies_for_users(
+        self,
+        mock_chord,
+        mock_compute_signals,
+        mock_fetch,
+        mock_market_clock,
+        mock_trade_api,
     ):
-        """Moving average strategies that are active are run for users."""
-        mock_trade_api.return_value.is_market_open.return_value = True
+        """A subtask is run for each user with active strategies."""
+        mock_market_clock.is_open.return_value = True
+        signals = {signal_key(self.strategy_1): {"side": Order.BUY}}
+        mock_compute_signals.return_value = signals
+        snapshot = {"account": {"equity": "1000"}, "positions": {}}
+        mock_fetch.return_value = AccountSnapshot.from_dict(snapshot)
+
+        run_strategies_for_users()
+
+        header = mock_chord.call_args[0][0]
+        self.assertEqual(
+            sorted(task.args[0] for task in header.tasks),
+            sorted([self.user_1.pk, self.user_2.pk]),
+        )
+        self.assertTrue(all(task.args[1] == signals for task in header.tasks))
+        self.assertTrue(all(task.args[2] == snapshot for task in header.tasks))
+        # Account and positions are fetched once for every user
+        mock_fetch.assert_called_once()
+        body = mock_chord.return_value.call_args[0][0]
+        self.assertEqual(body.task, "core.tasks.record_tick")
+
+    @patch("core.tasks.TradeApiRest")
+    @patch("core.tasks.market_clock")
+    @patch("core.tasks.AccountSnapshot.fetch")
+    @patch("core.tasks.compute_signals")
+    @patch("core.tasks.chord")
+    def test_run_strategies_for_users_shares_positions(
+        self,
+        mock_chord,
+        mock_compute_signals,
+        mock_fetch,
+        mock_market_clock,
+        mock_trade_api,
+    ):
+        """Users selling the same asset together sell at most the position."""
+        mock_market_clock.is_open.return_value = True
+        signals = {signal_key(self.strategy_1): {"side": SELL}}
+        mock_compute_signals.return_value = signals
+        mock_fetch.return_value = AccountSnapshot(
+            {"equity": "10000"},
+            [{"symbol": "TSLA", "side": "long", "market_value": "1500"}],
+        )
+
+        run_strategies_for_users()
+
+        header = mock_chord.call_args[0][0]
+        shares = {
+            task.args[0]: AccountSnapshot.from_dict(task.args[2])
+            for task in header.tasks
+        }
+        self.assertEqual(
+            sum(
+                float(share.position("TSLA")["market_value"])
+                for share in shares.values()
+                if share.position("TSLA")
+            ),
+            1500,
+        )
+        self.assertEqual(
+            max(
+                float(share.position("TSLA")["market_value"])
+                for share in shares.values()
+            ),
+            1000,
+        )
+
+    @patch("core.tasks.TradeApiRest")
+    @patch("core.tasks.market_clock")
+    @patch("core.tasks.chord")
+    def test_run_strategies_for_users_market_closed(
+        self, mock_chord, mock_market_clock, mock_trade_api
+    ):
+        """Strategies are not run while the market is closed."""
+        mock_market_clock.is_open.return_value = False
 
         run_strategies_for_users()
 
-        self.assertEqual(mock_moving_average_strategy.call_count, 2)
-        mock_moving_average_strategy.assert_any_call(self.user_1)
-        mock_moving_average_strategy.assert_any_call(self.user_2)
+        mock_chord.assert_not_called()
+        mock_trade_api.assert_not_called()
+
+    @patch("core.tasks.moving_average_strategy")
+    def test_run_strategies_for_user(self, mock_moving_average_strategy):
+        """Moving average strategies are run for a user with the tick signals."""
+        mock_moving_average_strategy.return_value = 1
+        signals = {signal_key(self.strategy_1): {"side": HOLD}}
+
+        result = run_strategies_for_user(self.user_1.pk, signals)
+
+        mock_moving_average_strategy.assert_called_once_with(self.user_1, signals, None)
+        self.assertEqual(result["user_id"], self.user_1.pk)
+        self.assertEqual(result["orders"], 1)
+
+    def test_record_tick(self):
+        """Results of each user are aggregated."""
+        results = [
+            {"user_id": self.user_1.pk, "orders": 1, "elapsed": 0.5},
+            {"user_id": self.user_2.pk, "orders": 2, "elapsed": 1.5},
+        ]
+
+        summary = record_tick(results, started_at=time.time())
+
+        self.assertEqual(summary["users"], 2)
+        self.assertEqual(summary["orders"], 3)
+        self.assertEqual(summary["user_elapsed_max"], 1.5)
+
+    @patch("core.tasks.moving_average_signals")
+    @patch("core.tasks.fetch_bar_data_for_strategies")
+    def test_compute_signals(
+        self,
+        mock_fetch_bar_data_for_strategies,
+        mock_moving_average_signals,
+    ):
+        """Signals shared by many strategies are computed once."""
+        mock_fetch_bar_data_for_strategies.side_effect = lambda strategies: strategies
+        mock_moving_average_signals.side_effect = lambda strategies: {
+            strategy.pk: {"side": HOLD} for strategy in strategies
+        }
+
+        signals = compute_signals([self.strategy_1, self.strategy_2])
+
+        # Both strategies trade TSLA with the same type and timeframe
+        self.assertEqual(signals, {signal_key(self.strategy_1): {"side": HOLD}})
+        self.assertEqual(signal_key(self.strategy_1), signal_key(self.strategy_2))
+        mock_fetch_bar_data_for_strategies.assert_called_once_with([self.strategy_1])
+        mock_moving_average_signals.assert_called_once_with([self.strategy_1])
 
     @patch("core.tasks.logger")
-    @patch("core.tasks.fetch_bar_data_for_strategy")
-    @patch("core.tasks.update_bars")
+    @patch("core.tasks.refresh_bars")
     @patch("core.tasks.TradeApiRest")
     def test_moving_average_strategy_not_enough_data(
         self,
         mock_trade_api,
-        mock_update_bars,
-        mock_fetch_bar_data_for_strategy,
+        mock_refresh_bars,
         mock_logger,
     ):
         """Active strategy does not create an order if there is not enough bar data."""
-        mock_fetch_bar_data_for_strategy.return_value = None
-
         moving_average_strategy(self.user_1)
         mock_logger.info.assert_called_once_with(
             f"Insufficient bar data for asset: {self.strategy_1.asset.id}"
         )
 
-    @patch("core.tasks.time.mktime")
-    @patch("core.tasks.update_bars")
-    def test_fetch_bar_data_for_strategy(self, mock_update_bars, mock_mktime):
-        """Bar data is fetched when required."""
-        self.refresh_tsla_bars()
+    def create_tsla_bars(self, times):
+        Bar.objects.bulk_create(
+            [Bar(asset=self.tsla, t=t, o=1, h=1, l=1, c=1, v=1) for t in times]
+        )
+
+    @freeze_time("2021-11-29 15:00:00")
+    @patch("core.tasks.refresh_bars")
+    def test_fetch_bar_data_for_strategies(self, mock_refresh_bars):
+        """Only gaps in the expected bar data are fetched."""
+        strategy_3 = StrategyFactory(
+            asset=self.tsla, user=self.user_3, type=Strategy.MOVING_AVERAGE_14D
+        )
+        times = latest_bar_times(261, timezone.now())
 
         with self.subTest(msg="bar data is not required."):
-            # Enough bar data exists in sample data at this time
-            mock_mktime.return_value = "1614229200"
-            fetch_bar_data_for_strategy(self.strategy_1)
-            mock_update_bars.assert_not_called()
+            self.create_tsla_bars(times)
+            ready = fetch_bar_data_for_strategies(
+                [self.strategy_1, self.strategy_2, strategy_3]
+            )
+            mock_refresh_bars.assert_not_called()
+            self.assertEqual(ready, [self.strategy_1, self.strategy_2, strategy_3])
 
-        mock_mktime.reset_mock()
-        mock_update_bars.reset_mock()
+        Bar.objects.all().delete()
+        mock_refresh_bars.reset_mock()
 
         with self.subTest(msg="bar data is required."):
-            # Not enough bar data exists in sample data at this time
-            mock_mktime.return_value = "1648443600"
-            fetch_bar_data_for_strategy(self.strategy_1)
-            mock_update_bars.assert_called_once_with(["TSLA"], "15Min", 131)
+            # Gap in the 14D window, and the latest bar is missing
+            self.create_tsla_bars(np.concatenate([times[:10], times[29:-1]]))
+            ready = fetch_bar_data_for_strategies(
+                [self.strategy_1, self.strategy_2, strategy_3]
+            )
+            # Each gap is fetched once for every strategy sharing it
+            self.assertEqual(mock_refresh_bars.call_count, 2)
+            mock_refresh_bars.assert_any_call(
+                ["TSLA"],
+                "15Min",
+                limit=19,
+                start="2021-11-11T20:45:00+00:00",
+                end="2021-11-12T18:45:00+00:00",
+            )
+            mock_refresh_bars.assert_any_call(
+                ["TSLA"],
+                "15Min",
+                limit=1,
+                start="2021-11-29T14:45:00+00:00",
+                end="2021-11-29T14:45:00+00:00",
+            )
+            # Some bars may not exist, but the 14D window has too many missing
+            self.assertEqual(ready, [self.strategy_1, self.strategy_2])
+
+        Bar.objects.all().delete()
+        mock_refresh_bars.reset_mock()
+
+        with self.subTest(msg="new bars are fetched after the watermark."):
+            self.create_tsla_bars(times[:-2])
+            BarWatermark.objects.create(
+                asset=self.tsla, timeframe="15Min", t=int(times[-3])
+            )
+            fetch_bar_data_for_strategies([self.strategy_1])
+            self.assertEqual(
+                mock_refresh_bars.call_args_list[0],
+                call(["TSLA"], "15Min", limit=2, after="2021-11-26T17:45:00+00:00"),
+            )
 
     @patch("core.tasks.TradeApiRest")
-    @patch("core.tasks.time.mktime")
-    @patch("core.tasks.update_bars")
-    @patch("core.tasks.fetch_bar_data_for_strategy")
+    @patch("core.tasks.refresh_bars")
+    @patch("core.tasks.fetch_bar_data_for_strategies")
     def test_moving_average_strategy(
         self,
-        mock_fetch_bar_data_for_strategy,
-        mock_update_bars,
-        mock_mktime,
+        mock_fetch_bar_data_for_strategies,
+        mock_refresh_bars,
         mock_trade_api,
     ):
         """Active strategy creates an order if required."""
+        mock_api(mock_trade_api.return_value)
         account_info = AlpacaAccount(
             {
                 "account_blocked": False,
@@ -213,38 +390,42 @@ class CoreTaskTests(TestCase):
             }
         )
 
-        mock_fetch_bar_data_for_strategy.return_value = 130
+        mock_fetch_bar_data_for_strategies.side_effect = lambda strategies: strategies
         mock_trade_api.return_value.is_market_open.return_value = True
         mock_trade_api.return_value.account_info.return_value = account_info
-        mock_trade_api.return_value.list_position_by_symbol.return_value = position
+        mock_trade_api.return_value.list_positions.return_value = [position]
         mock_trade_api.return_value.submit_order.return_value = order
 
-        seven_days_epoch = 104 * 86400
         with self.subTest(msg="buy order is placed."):
             max_epoch_time = 1630818000
-            base_epoch = max_epoch_time - seven_days_epoch
-            mock_mktime.return_value = base_epoch
             self.refresh_tsla_bars(max_epoch=max_epoch_time)
             moving_average_strategy(self.user_1)
             mock_trade_api.return_value.submit_order.assert_called_once_with(
+                client_order_id=ANY,
                 symbol=self.strategy_1.asset.symbol,
                 notional=float(self.strategy_1.trade_value),
                 side=Order.BUY,
                 type=Order.MARKET,
                 time_in_force=Order.GTC,
             )
+            intent = OrderIntent.objects.get()
+            self.assertEqual(intent.status, OrderIntent.SUBMITTED)
+            self.assertEqual(intent.order, Order.objects.get())
+
+        with self.subTest(msg="order is not placed again for the same bar."):
+            mock_trade_api.reset_mock()
+            self.assertEqual(moving_average_strategy(self.user_1), 0)
+            mock_trade_api.return_value.submit_order.assert_not_called()
 
-        mock_mktime.reset_mock()
         mock_trade_api.reset_mock()
         Order.objects.all().delete()
 
         with self.subTest(msg="sell order is placed."):
             max_epoch_time = 1618894800
-            base_epoch = max_epoch_time - seven_days_epoch
-            mock_mktime.return_value = base_epoch
             self.refresh_tsla_bars(max_epoch=max_epoch_time)
             moving_average_strategy(self.user_1)
             mock_trade_api.return_value.submit_order.assert_called_once_with(
+                client_order_id=ANY,
                 symbol=self.strategy_1.asset.symbol,
                 notional=float(self.strategy_1.trade_value),
                 side=Order.SELL,
@@ -252,32 +433,55 @@ class CoreTaskTests(TestCase):
                 time_in_force=Order.GTC,
             )
 
-        mock_mktime.reset_mock()
         mock_trade_api.reset_mock()
         Order.objects.all().delete()
 
         with self.subTest(msg="no order is placed."):
             max_epoch_time = 1633150800
-            base_epoch = max_epoch_time - seven_days_epoch
-            mock_mktime.return_value = base_epoch
             self.refresh_tsla_bars(max_epoch=max_epoch_time)
             moving_average_strategy(self.user_1)
             mock_trade_api.return_value.submit_order.assert_not_called()
 
+        mock_trade_api.reset_mock()
+        OrderIntent.objects.all().delete()
+        Order.objects.all().delete()
+
+        with self.subTest(msg="buys in one tick are sized by buying power left."):
+            StrategyFactory(asset=self.tsla, user=self.user_1, trade_value=1000)
+            mock_trade_api.return_value.submit_order.side_effect = (
+                lambda **params: AlpacaOrder(
+                    {**order._raw, **params, "id": str(uuid.uuid4())}
+                )
+            )
+            snapshot = AccountSnapshot(
+                {"equity": "100000", "cash": "1500", "buying_power": "1500"}, []
+            )
+            max_epoch_time = 1630818000
+            self.refresh_tsla_bars(max_epoch=max_epoch_time)
+            moving_average_strategy(self.user_1, snapshot=snapshot)
+            self.assertEqual(
+                sorted(
+                    c.kwargs["notional"]
+                    for c in mock_trade_api.return_value.submit_order.call_args_list
+                ),
+                [500, 1000],
+            )
+            self.assertEqual(snapshot.buying_power, 0)
+            self.assertEqual(float(snapshot.account["cash"]), 0)
+
     @patch("core.tasks.logger")
     @patch("core.tasks.TradeApiRest")
-    @patch("core.tasks.time.mktime")
-    @patch("core.tasks.update_bars")
-    @patch("core.tasks.fetch_bar_data_for_strategy")
+    @patch("core.tasks.refresh_bars")
+    @patch("core.tasks.fetch_bar_data_for_strategies")
     def test_moving_average_strategy_fails(
         self,
-        mock_fetch_bar_data_for_strategy,
-        mock_update_bars,
-        mock_mktime,
+        mock_fetch_bar_data_for_strategies,
+        mock_refresh_bars,
         mock_trade_api,
         mock_logger,
     ):
         """If trade view api fails to submit an order, an order object is not created."""
+        mock_api(mock_trade_api.return_value)
         account_info = AlpacaAccount(
             {
                 "account_blocked": False,
@@ -366,20 +570,31 @@ class CoreTaskTests(TestCase):
             }
         )
 
-        mock_fetch_bar_data_for_strategy.return_value = 130
+        mock_fetch_bar_data_for_strategies.side_effect = lambda strategies: strategies
         mock_trade_api.return_value.is_market_open.return_value = True
         mock_trade_api.return_value.account_info.return_value = account_info
-        mock_trade_api.return_value.list_position_by_symbol.return_value = position
+        mock_trade_api.return_value.list_positions.return_value = [position]
         mock_trade_api.return_value.submit_order.side_effect = ValidationError(
             "Mock error"
         )
 
-        seven_days_epoch = 104 * 86400
         max_epoch_time = 1630818000
-        base_epoch = max_epoch_time - seven_days_epoch
-        mock_mktime.return_value = base_epoch
         self.refresh_tsla_bars(max_epoch=max_epoch_time)
 
-        moving_average_strategy(self.user_1)
+        self.assertEqual(moving_average_strategy(self.user_1), 0)
         mock_logger.warning.assert_called_once()
         self.assertEqual(Order.objects.count(), 0)
+
+        self.assertEqual(OrderIntent.objects.get().status, OrderIntent.FAILED)
+
+        with self.subTest(msg="a failed order does not cancel the others."):
+            OrderIntent.objects.all().delete()
+            StrategyFactory(asset=self.tsla, user=self.user_1, trade_value=500)
+            mock_trade_api.return_value.submit_order.side_effect = [
+                ValidationError("Mock error"),
+                order,
+            ]
+
+            self.assertEqual(moving_average_strategy(self.user_1), 1)
+            self.assertEqual(mock_trade_api.return_value.submit_order.call_count, 3)
+            self.assertEqual(Order.objects.count(), 1)
@@ -0,0 +1,102 @@
+from datetime import date, datetime
+
+import pytz
+from core.trading_calendar import (
+    EXCHANGE_TIMEZONE,
+    bar_intervals,
+    bar_times,
+    early_closes,
+    holidays,
+    is_trading_day,
+    latest_bar_times,
+)
+from django.test import TestCase
+
+
+def epoch(year, month, day, hour=0, minute=0):
+    return int(
+        EXCHANGE_TIMEZONE.localize(datetime(year, month, day, hour, minute)).timestamp()
+    )
+
+
+class TradingCalendarTests(TestCase):
+    def test_holidays(self):
+        """Holidays are observed on the nearest weekday."""
+        self.assertEqual(
+            holidays(2021),
+            {
+                date(2021, 1, 1),
+                date(2021, 1, 18),
+                date(2021, 2, 15),
+                date(2021, 4, 2),
+                date(2021, 5, 31),
+                date(2021, 7, 5),
+                date(2021, 9, 6),
+                date(2021, 11, 25),
+                date(2021, 12, 24),
+            },
+        )
+        # New Year's Day on a Saturday is not observed, Juneteenth from 2022
+        self.assertNotIn(date(2021, 12, 31), holidays(2021))
+        self.assertIn(date(2022, 6, 20), holidays(2022))
+        self.assertFalse(is_trading_day(date(2021, 11, 25)))
+        self.assertFalse(is_trading_day(date(2021, 11, 27)))
+        self.assertTrue(is_trading_day(date(2021, 11, 26)))
+
+    def test_early_closes(self):
+        """Early closes are only before holidays falling on a weekday."""
+        self.assertEqual(early_closes(2021), {date(2021, 11, 26)})
+        self.assertEqual(
+            early_closes(2024),
+            {date(2024, 7, 3), date(2024, 11, 29), date(2024, 12, 24)},
+        )
+
+    def test_bar_times(self):
+        """Bars are aligned to the open and end by the close."""
+        times = bar_times(epoch(2021, 11, 24), epoch(2021, 11, 27))
+
+        # Full session on 24th, holiday on 25th, early close on 26th
+        self.assertEqual(len(times), 26 + 14)
+        self.assertEqual(times[0], epoch(2021, 11, 24, 9, 30))
+        self.assertEqual(times[25], epoch(2021, 11, 24, 15, 45))
+        self.assertEqual(times[26], epoch(2021, 11, 26, 9, 30))
+        self.assertEqual(times[-1], epoch(2021, 11, 26, 12, 45))
+
+        extended_times = bar_times(
+            epoch(2021, 11, 24), epoch(2021, 11, 25), extended_hours=True
+        )
+        self.assertEqual(len(extended_times), 16 * 4)
+        self.assertEqual(extended_times[0], epoch(2021, 11, 24, 4))
+
+    def test_latest_bar_times(self):
+        """Only completed bars are returned."""
+        now = datetime(2021, 11, 29, 15, 10, tzinfo=pytz.utc)
+
+        times = latest_bar_times(131, now)
+
+        self.assertEqual(len(times), 131)
+        self.assertEqual(times[-1], epoch(2021, 11, 29, 9, 45))
+        self.assertEqual(times[0], epoch(2021, 11, 18, 13, 15))
+
+    def test_bar_intervals(self):
+        """Last bar of a session ends at the close."""
+        times, ends = bar_intervals(epoch(2021, 11, 24), epoch(2021, 11, 27), "1H")
+
+        # Full session on 24th, early close on 26th
+        self.assertEqual(len(times), 7 + 4)
+        self.assertEqual(times[6], epoch(2021, 11, 24, 15, 30))
+        self.assertEqual(ends[6], epoch(2021, 11, 24, 16))
+        self.assertEqual(ends[-1], epoch(2021, 11, 26, 13))
+
+        times, ends = bar_intervals(epoch(2021, 11, 24), epoch(2021, 11, 27), "1D")
+
+        self.assertEqual(
+            list(times), [epoch(2021, 11, 24, 9, 30), epoch(2021, 11, 26, 9, 30)]
+        )
+        self.assertEqual(list(ends), [epoch(2021, 11, 24, 16), epoch(2021, 11, 26, 13)])
+
+        # Daily bars complete at the close
+        now = datetime(2021, 11, 29, 20, 59, tzinfo=pytz.utc)
+        self.assertEqual(latest_bar_times(1, now, "1D")[0], epoch(2021, 11, 26, 9, 30))
+        now = datetime(2021, 11, 29, 21, tzinfo=pytz.utc)
+        self.assertEqual(latest_bar_times(1, now, "1D")[0], epoch(2021, 11, 29, 9, 30))
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+import requests
+from alpaca_trade_api.entity import Bar, Order, Quote
+from alpaca_trade_api.rest import APIError
+from core.alpaca import AsyncTradeApiRest, TradeApiRest
+from core.ratelimit import RateLimiter
+from core.tests.fake_alpaca import FakeAlpacaServer
+from core.transport import AlpacaTransport, SyncTransport
+from django.test import TestCase
+from orders.dispatch import OrderDispatcher, error_status, is_retryable, may_exist
+
+BARS = {
+    "TSLA": [
+        {"t": 1638196200 + 900 * i, "o": 1, "h": 2, "l": 0.5, "c": 1.5, "v": 10}
+        for i in range(3)
+    ]
+}
+
+
+class TransportTests(TestCase):
+    def setUp(self):
+        self.server = FakeAlpacaServer(bars=BARS)
+        url = self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.transport = AlpacaTransport(
+            key_id="key",
+            secret_key="secret",
+            base_url=url,
+            data_url=url,
+            limiter=RateLimiter(fakeredis.FakeRedis()),
+        )
+        self.transport.retry_wait = 0
+
+    def run_async(self, coroutine):
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await self.transport.close()
+
+        return asyncio.run(run())
+
+    def test_async_api(self):
+        """Async methods make the requests of their sync counterparts."""
+
+        async def requests():
+            api = AsyncTradeApiRest(self.transport)
+            bars = await api.get_bars("TSLA,AAPL", "15Min", limit=2)
+            quote = await api.get_last_quote("TSLA")
+            aggs = await api.get_aggs("TSLA", "minute", 15, "2021-11-29", "2021-11-29")
+            order = await api.submit_order(
+                "TSLA", notional=100, side="buy", type="market", time_in_force="day"
+            )
+            placed = await api.get_order_by_client_order_id(order.client_order_id)
+            open_orders = await api.get_orders(status="open", nested=True)
+            return (
+                bars,
+                quote,
+                aggs,
+                order,
+                placed,
+                open_orders,
+                await api.list_positions(),
+                await api.is_market_open(),
+                await api.daily_balance(),
+            )
+
+        (
+            bars,
+            quote,
+            aggs,
+            order,
+            placed,
+            open_orders,
+            positions,
+            is_open,
+            balance,
+        ) = self.run_async(requests())
+
+        self.assertEqual(set(bars), {"TSLA", "AAPL"})
+        self.assertIsInstance(bars["TSLA"][0], Bar)
+        self.assertEqual(
+            [bar._raw["t"] for bar in bars["TSLA"]],
+            [BARS["TSLA"][1]["t"], BARS["TSLA"][2]["t"]],
+        )
+        self.assertEqual(bars["AAPL"], [])
+        self.assertIsInstance(quote, Quote)
+        self.assertEqual(
+            [agg._raw["t"] for agg in aggs], [bar["t"] * 1000 for bar in BARS["TSLA"]]
+        )
+        self.assertIn(
+            ("GET", "/v1/aggs/ticker/TSLA/range/15/minute/2021-11-29/2021-11-29", {}),
+            self.server.requests,
+        )
+        self.assertEqual(quote.askprice, 101)
+        self.assertIsInstance(order, Order)
+        self.assertEqual(placed.id, order.id)
+        self.assertEqual([o.id for o in open_orders], [order.id])
+        self.assertEqual(positions, [])
+        self.assertTrue(is_open)
+        self.assertEqual(balance, 100)
+        # Unset parameters are dropped, and booleans written in lowercase
+        self.assertIn(
+            ("GET", "/v2/orders", {"status": "open", "nested": "true"}),
+            self.server.requests,
+        )
+
+    def test_connection_pool(self):
+        """Concurrent requests run at once over a bounded pool of connections."""
+        self.server.delay = 0.2
+        self.transport.max_connections = 4
+
+        async def requests():
+            started = time.monotonic()
+            await asyncio.gather(*(self.transport.get_clock() for _ in range(8)))
+            await asyncio.gather(*(self.transport.get_clock() for _ in range(8)))
+            return time.monotonic() - started
+
+        elapsed = self.run_async(requests())
+
+        self.assertEqual(len(self.server.requests), 16)
+        # Four requests at a time, over connections kept open between rounds
+        self.assertLess(elapsed, 16 * 0.2 / 2)
+        self.assertEqual(len(self.server.connections), 4)
+
+    def test_errors(self):
+        """Rate limited requests are retried, and other errors raised."""
+        self.server.fail(429, times=2)
+        asset = self.run_async(self.transport.get_asset("TSLA"))
+        self.assertEqual(asset.symbol, "TSLA")
+        self.assertEqual(len(self.server.requests), 3)
+
+        with self.assertRaises(APIError) as context:
+            self.run_async(self.transport.get_asset("MSFT"))
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertFalse(is_retryable(context.exception))
+
+        self.server.fail(500)
+        with self.assertRaises(APIError) as context:
+            self.run_async(self.transport.get_clock())
+        self.assertEqual(context.exception.status_code, 500)
+        self.assertTrue(is_retryable(context.exception))
+
+        with self.subTest(msg="errors without a JSON body keep their status."):
+            self.server.fail(503, "Service Unavailable", json=False)
+            with self.assertRaises(requests.HTTPError) as context:
+                self.run_async(self.transport.get_clock())
+            self.assertTrue(is_retryable(context.exception))
+            self.assertTrue(may_exist(context.exception))
+
+            self.server.fail(
+                504, "Gateway Timeout", times=self.transport.retry + 1, json=False
+            )
+            with self.assertRaises(requests.HTTPError) as context:
+                self.run_async(self.transport.submit_order("TSLA", notional=100))
+            self.assertEqual(error_status(context.exception), 504)
+            self.assertTrue(may_exist(context.exception))
+
+            self.server.fail(404, "Not Found", json=False)
+            with self.assertRaises(requests.HTTPError) as context:
+                self.run_async(self.transport.get_clock())
+            self.assertEqual(error_status(context.exception), 404)
+            self.assertFalse(is_retryable(context.exception))
+
+    def test_sync_facade(self):
+        """Calls from many threads share the connections of one transport."""
+        transport = SyncTransport(self.transport)
+        self.addCleanup(transport.close)
+        api = TradeApiRest(transport)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in range(3):
+                clocks = list(executor.map(lambda _: api.get_clock(), range(4)))
+
+        self.assertTrue(all(clock.is_open for clock in clocks))
+        self.assertLessEqual(len(self.server.connections), 4)
+        self.assertTrue(api.is_tradable("AAPL"))
+
+        with self.subTest(msg="orders are dispatched over the transport."):
+            results = OrderDispatcher(api, backoff=0).dispatch(
+                [
+                    {"symbol": symbol, "notional": 100, "side": "buy"}
+                    for symbol in ("TSLA", "MSFT")
+                ]
+            )
+
+            self.assertEqual(results[0]["order"]["symbol"], "TSLA")
+            self.assertIsNone(results[0]["error"])
+            self.assertIsNone(results[1]["order"])
+            self.assertEqual(results[1]["error"], "asset not found")
+            self.assertEqual([o.symbol for o in api.open_orders()], ["TSLA"])
@@ -0,0 +1,143 @@
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from assets.models import Bar
+from assets.tests.factories import AssetFactory
+from core.backtest import backtest, moving_averages
+from core.models import Strategy, StrategyRecommendation
+from core.tasks import recommend_strategy_parameters
+from core.tests.factories import StrategyFactory
+from core.trading_calendar import bar_times
+from core.walkforward import recommend_strategies, slice_bars, walk_forward
+from django.core.management import call_command
+from django.test import TestCase
+
+
+def random_bars(count, seed=0):
+    closes = 100 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.01, count)))
+    return {
+        "t": np.arange(count) * 900,
+        "o": closes,
+        "h": closes * 1.01,
+        "l": closes * 0.99,
+        "c": closes,
+    }
+
+
+class WalkForwardTests(TestCase):
+    def test_walk_forward(self):
+        """Parameters chosen on each train slice are tested on the next slice."""
+        bars = random_bars(400)
+        windows = [5, 10, 20]
+
+        with patch(
+            "core.walkforward.moving_averages", wraps=moving_averages
+        ) as mock_moving_averages:
+            result = walk_forward(
+                bars, windows, 100, 50, stop_loss_percentages=[None, 1]
+            )
+
+        # Moving averages are computed once and reused by every slice
+        self.assertEqual(mock_moving_averages.call_count, len(windows))
+
+        # Slices start once the longest moving average is available
+        folds = result["folds"]
+        self.assertEqual(len(folds), (400 - 19 - 100 - 50) // 50 + 1)
+        self.assertEqual(folds[0]["train_t"], 19 * 900)
+        self.assertEqual(folds[0]["test_t"], 119 * 900)
+        self.assertEqual(folds[1]["train_t"], 69 * 900)
+
+        train = slice(19, 119)
+        scores = {
+            (window, stop_loss, None): backtest(
+                slice_bars(bars, train),
+                window,
+                1000,
+                stop_loss_percentage=stop_loss,
+                averages=moving_averages(bars["c"], window)[train],
+            )["sharpe"]
+            for window in windows
+            for stop_loss in (None, 1)
+        }
+        self.assertEqual(folds[0]["parameters"], max(scores, key=scores.get))
+        self.assertEqual(result["window"], folds[-1]["parameters"][0])
+        self.assertTrue(0 < result["stability"] <= 1)
+
+    def test_walk_forward_not_enough_bars(self):
+        """Walk forward requires enough bars for one fold."""
+        self.assertIsNone(walk_forward(random_bars(100), [5], 80, 20))
+
+        with self.assertRaises(ValueError):
+            walk_forward(random_bars(100), [5], 10, 10, metric="unknown")
+
+
+class RecommendStrategiesTests(TestCase):
+    def setUp(self):
+        self.tsla = AssetFactory(symbol="TSLA")
+        # Two weeks of 15Min bars from 1st November 2021
+        times = bar_times(1635739200, 1635739200 + 14 * 86400)
+        closes = random_bars(len(times))["c"].round(5)
+        Bar.objects.bulk_create(
+            [
+                Bar(asset=self.tsla, t=t, o=c, h=c, l=c, c=c, v=1)
+                for t, c in zip(times, closes)
+            ]
+        )
+        self.strategy_1 = StrategyFactory(asset=self.tsla, trade_value=1000)
+        self.strategy_2 = StrategyFactory(asset=self.tsla, trade_value=1000)
+        self.strategy_3 = StrategyFactory(
+            asset=self.tsla, trade_value=1000, timeframe=Strategy.MIN_5
+        )
+
+    def test_recommend_strategies(self):
+        """Strategies sharing an asset and timeframe share a recommendation."""
+        recommendations = recommend_strategies(
+            [self.strategy_1, self.strategy_2, self.strategy_3],
+            [5, 10],
+            train_days=3,
+            test_days=1,
+            max_workers=1,
+        )
+
+        # Timeframes shorter than the stored bars are skipped
+        self.assertEqual(
+            {r.strategy_id for r in recommendations},
+            {self.strategy_1.id, self.strategy_2.id},
+        )
+        self.assertEqual(recommendations[0].window, recommendations[1].window)
+        self.assertEqual(recommendations[0].folds, (260 - 9 - 4 * 26) // 26 + 1)
+        self.assertEqual(StrategyRecommendation.objects.count(), 2)
+
+    def test_walk_forward_command(self):
+        """Walk forward command prints the recommendations."""
+        out = StringIO()
+
+        call_command(
+            "walk_forward",
+            str(self.strategy_1.id),
+            "--windows",
+            "5",
+            "--train-days",
+            "3",
+            "--test-days",
+            "1",
+            "--workers",
+            "1",
+            stdout=out,
+        )
+
+        self.assertIn(f"Strategy {self.strategy_1.id} (TSLA): window=5", out.getvalue())
+
+    @patch("core.tasks.recommend_strategies")
+    def test_recommend_strategy_parameters(self, mock_recommend_strategies):
+        """Active strategies are walked forward by default."""
+        mock_recommend_strategies.return_value = []
+
+        recommend_strategy_parameters([5])
+
+        strategies = mock_recommend_strategies.call_args[0][0]
+        self.assertEqual(
+            set(strategies),
+            {self.strategy_1, self.strategy_2, self.strategy_3},
+        )
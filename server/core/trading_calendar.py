@@ -0,0 +1,281 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pytz
+
+EXCHANGE_TIMEZONE = pytz.timezone("America/New_York")
+
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+EXTENDED_OPEN = time(4, 0)
+EXTENDED_CLOSE = time(20, 0)
+EXTENDED_EARLY_CLOSE = time(17, 0)
+
+# Intraday bar lengths in seconds
+TIMEFRAME_SECONDS = {
+    "1Min": 60,
+    "minute": 60,
+    "5Min": 5 * 60,
+    "15Min": 15 * 60,
+    "1H": 60 * 60,
+}
+
+# One-off closures that do not follow the holiday rules
+SPECIAL_CLOSURES = {
+    date(2012, 10, 29),  # Hurricane Sandy
+    date(2012, 10, 30),  # Hurricane Sandy
+    date(2018, 12, 5),  # National Day of Mourning for George H.W. Bush
+    date(2025, 1, 9),  # National Day of Mourning for Jimmy Carter
+}
+
+
+def nth_weekday(year, month, weekday, n):
+    """Return the nth (1-indexed, or -1 for last) weekday of a month."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def easter(year):
+    """Return Easter Sunday using the anonymous Gregorian algorithm."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    el = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * el) // 451
+    month, day = divmod(h + el - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def observed(holiday):
+    """Move a holiday falling on a weekend to the nearest weekday."""
+    if holiday.weekday() == 5:
+        return holiday - timedelta(days=1)
+    if holiday.weekday() == 6:
+        return holiday + timedelta(days=1)
+    return holiday
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    """Return the set of NYSE full day holidays for a year."""
+    days = {
+        nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        easter(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),  # Memorial Day
+        observed(date(year, 7, 4)),  # Independence Day
+        nth_weekday(year, 9, 0, 1),  # Labor Day
+        nth_weekday(year, 11, 3, 4),  # Thanksgiving Day
+        observed(date(year, 12, 25)),  # Christmas Day
+    }
+    # New Year's Day is not observed on the prior Friday when on a Saturday
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+    days |= {day for day in SPECIAL_CLOSURES if day.year == year}
+    return days
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    """Return the set of days the NYSE closes at 1:00pm for a year."""
+    days = {nth_weekday(year, 11, 3, 4) + timedelta(days=1)}  # Day after Thanksgiving
+    for day in (date(year, 7, 3), date(year, 12, 24)):
+        # Only when the following day is a holiday falling on a weekday
+        if day.weekday() < 4:
+            days.add(day)
+    return days - holidays(year)
+
+
+def localize(day, at):
+    """Return the Unix epoch of a time of day on the exchange."""
+    return int(EXCHANGE_TIMEZONE.localize(datetime.combine(day, at)).timestamp())
+
+
+@lru_cache(maxsize=None)
+def sessions(year, extended_hours=False):
+    """
+    Return the trading sessions of a year.
+
+    Sessions are precomputed once per year as a tuple of arrays of each
+    session's date ordinal, and the Unix epochs of its open and close.
+
+    :param year(int): calendar year
+    :param extended_hours(bool): include pre-market and after-hours trading
+    """
+    closed = holidays(year)
+    early = early_closes(year)
+    days = [
+        date(year, 1, 1) + timedelta(days=offset)
+        for offset in range((date(year + 1, 1, 1) - date(year, 1, 1)).days)
+    ]
+    days = [day for day in days if day.weekday() < 5 and day not in closed]
+
+    if extended_hours:
+        opens = [localize(day, EXTENDED_OPEN) for day in days]
+        closes = [
+            localize(day, EXTENDED_EARLY_CLOSE if day in early else EXTENDED_CLOSE)
+            for day in days
+        ]
+    else:
+        opens = [localize(day, REGULAR_OPEN) for day in days]
+        closes = [
+            localize(day, EARLY_CLOSE if day in early else REGULAR_CLOSE)
+            for day in days
+        ]
+
+    return (
+        np.array([day.toordinal() for day in days], dtype=np.int64),
+        np.array(opens, dtype=np.int64),
+        np.array(closes, dtype=np.int64),
+    )
+
+
+def is_trading_day(day):
+    """Return true if the exchange is open on the given date."""
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def session_bounds(start, end, extended_hours=False):
+    """
+    Return the opens and closes of sessions overlapping an interval.
+
+    :param start(int): Unix epoch the interval starts at
+    :param end(int): Unix epoch the interval ends at
+    :param extended_hours(bool): include pre-market and after-hours trading
+    :returns: tuple of arrays of session opens and closes
+    """
+    first_year = datetime.fromtimestamp(start, EXCHANGE_TIMEZONE).year
+    last_year = datetime.fromtimestamp(end, EXCHANGE_TIMEZONE).year
+    years = [
+        sessions(year, extended_hours) for year in range(first_year, last_year + 1)
+    ]
+    opens = np.concatenate([year[1] for year in years])
+    closes = np.concatenate([year[2] for year in years])
+    overlapping = (closes > start) & (opens <= end)
+    return opens[overlapping], closes[overlapping]
+
+
+def bars_per_session(timeframe):
+    """
+    Return the number of bars of a timeframe in a regular trading session.
+
+    Timeframes not in `TIMEFRAME_SECONDS` (i.e. 1D) have one bar per session.
+    """
+    step = TIMEFRAME_SECONDS.get(timeframe)
+    if step is None:
+        return 1
+    session = (REGULAR_CLOSE.hour - REGULAR_OPEN.hour) * 3600 + (
+        REGULAR_CLOSE.minute - REGULAR_OPEN.minute
+    ) * 60
+    return -(-session // step)
+
+
+def bar_intervals(start, end, timeframe="15Min", extended_hours=False):
+    """
+    Return the expected start and end times of every bar in an interval.
+
+    Bars are aligned to each session's open, and the last bar of a session
+    ends at the close, so may be shorter than the timeframe. Timeframes not in
+    `TIMEFRAME_SECONDS` (i.e. 1D) have one bar per session.
+
+    :param start(int): Unix epoch of the earliest bar start
+    :param end(int): Unix epoch of the latest bar start
+    :param timeframe(str): timeframe, e.g. 15Min
+    :param extended_hours(bool): include pre-market and after-hours trading
+    :returns: tuple of sorted arrays of bar start and end times as Unix epochs
+    """
+    step = TIMEFRAME_SECONDS.get(timeframe)
+    opens, closes = session_bounds(start, end, extended_hours)
+    if step is None:
+        counts = np.ones(len(opens), dtype=np.int64)
+    else:
+        counts = -(-(closes - opens) // step)
+    if not counts.sum():
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    # Offset of each bar from the start of its session, without a Python loop
+    # over sessions
+    session_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    offsets = np.arange(counts.sum()) - session_starts
+    times = np.repeat(opens, counts) + offsets * (step or 0)
+    ends = np.repeat(closes, counts)
+    if step is not None:
+        ends = np.minimum(times + step, ends)
+    included = (times >= start) & (times <= end)
+    return times[included], ends[included]
+
+
+def bar_times(start, end, timeframe="15Min", extended_hours=False):
+    """
+    Return the expected start times of every bar in an interval.
+
+    :param start(int): Unix epoch of the earliest bar start
+    :param end(int): Unix epoch of the latest bar start
+    :param timeframe(str): timeframe, e.g. 15Min
+    :param extended_hours(bool): include pre-market and after-hours trading
+    :returns: sorted array of bar start times as Unix epochs
+    """
+    return bar_intervals(start, end, timeframe, extended_hours)[0]
+
+
+def completed_bar_times(start, now, timeframe="15Min", extended_hours=False):
+    """
+    Return the start times of bars in an interval which have completed.
+
+    :param start(int): Unix epoch of the earliest bar start
+    :param now(datetime | int): current time
+    :param timeframe(str): timeframe, e.g. 15Min
+    :param extended_hours(bool): include pre-market and after-hours trading
+    """
+    if isinstance(now, datetime):
+        now = int(now.timestamp())
+    times, ends = bar_intervals(start, now, timeframe, extended_hours)
+    return times[ends <= now]
+
+
+def latest_bar_times(count, now, timeframe="15Min", extended_hours=False):
+    """
+    Return the start times of the latest `count` completed bars.
+
+    :param count(int): number of bars
+    :param now(datetime | int): current time
+    :param timeframe(str): timeframe, e.g. 15Min
+    :param extended_hours(bool): include pre-market and after-hours trading
+    """
+    if isinstance(now, datetime):
+        now = int(now.timestamp())
+
+    # Look back far enough to cover weekends and holidays, widening the
+    # interval until enough bars are found
+    days = count // bars_per_session(timeframe) + 7
+    while True:
+        times = completed_bar_times(now - days * 86400, now, timeframe, extended_hours)
+        if len(times) >= count or days > 3660:
+            return times[-count:]
+        days *= 2
+
+
+def current_bar_time(now, timeframe="15Min", extended_hours=False):
+    """
+    Return the start time of the latest bar started by now, i.e. the bar in
+    progress during a session.
+
+    :param now(datetime | int): current time
+    :param timeframe(str): timeframe, e.g. 15Min
+    :param extended_hours(bool): include pre-market and after-hours trading
+    """
+    if isinstance(now, datetime):
+        now = int(now.timestamp())
+    # A week always holds a session
+    return int(bar_times(now - 7 * 86400, now, timeframe, extended_hours)[-1])
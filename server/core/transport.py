@@ -0,0 +1,438 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+import aiohttp
+import requests
+from alpaca_trade_api import __version__
+from alpaca_trade_api.common import (
+    get_api_version,
+    get_base_url,
+    get_credentials,
+    get_data_url,
+)
+from alpaca_trade_api.entity import (
+    Account,
+    Asset,
+    Bar,
+    Clock,
+    Order,
+    PortfolioHistory,
+    Position,
+    Quote,
+    Trade,
+)
+from alpaca_trade_api.rest import APIError
+
+from core.ratelimit import api_priority, get_rate_limiter, request_priority
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open to the Alpaca hosts, shared by all requests
+MAX_CONNECTIONS = 32
+# Seconds an idle connection is kept open for reuse
+KEEPALIVE_TIMEOUT = 60
+# Seconds to wait for each response
+REQUEST_TIMEOUT = 30
+
+
+def query_params(data):
+    """
+    Return request data as query parameters, dropping unset values and
+    writing booleans as Alpaca expects.
+
+    :param data(dict): request data, if any
+    """
+    if not data:
+        return None
+    return {
+        key: str(value).lower() if isinstance(value, bool) else value
+        for key, value in data.items()
+        if value is not None
+    }
+
+
+def http_error(status, reason, url):
+    """
+    Return the requests error of a failed response, so errors carry a
+    `status_code` as those raised by `alpaca_trade_api.REST` do.
+
+    :param status(int): HTTP status code
+    :param reason(str): HTTP reason phrase
+    :param url(str): requested url
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response.url = url
+    return requests.HTTPError(f"{status} {reason}: {url}", response=response)
+
+
+class AlpacaTransport:
+    """
+    Asynchronous client of the Alpaca REST api.
+
+    Requests share a pool of keep-alive connections, so concurrent requests
+    reuse open connections rather than each connecting. Methods are named as
+    those of `alpaca_trade_api.REST`, and return the same entities.
+
+    The pool is bound to the event loop of the first request, and is closed
+    with `close`.
+    """
+
+    def __init__(
+        self,
+        key_id=None,
+        secret_key=None,
+        base_url=None,
+        data_url=None,
+        max_connections=MAX_CONNECTIONS,
+        timeout=REQUEST_TIMEOUT,
+        limiter=None,
+    ):
+        """
+        Credentials and urls default to the environment variables read by
+        `alpaca_trade_api.REST`.
+
+        :param key_id(str): api key id
+        :param secret_key(str): api secret key
+        :param base_url(str): url of the trading api
+        :param data_url(str): url of the market data api
+        :param max_connections(int): maximum number of open connections
+        :param timeout(float): seconds to wait for each response
+        :param limiter(RateLimiter): limiter each request waits on, defaults to
+        the one shared by the process
+        """
+        key_id, secret_key, oauth = get_credentials(key_id, secret_key)
+        if oauth:
+            self.headers = {"Authorization": "Bearer " + oauth}
+        else:
+            self.headers = {
+                "APCA-API-KEY-ID": key_id,
+                "APCA-API-SECRET-KEY": secret_key,
+            }
+        self.headers["User-Agent"] = "APCA-TRADE-SDK-PY/" + __version__
+        self.base_url = (base_url or get_base_url()).rstrip("/")
+        self.data_url = (data_url or get_data_url()).rstrip("/")
+        self.api_version = get_api_version(None)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retry = int(os.environ.get("APCA_RETRY_MAX", 3))
+        self.retry_wait = int(os.environ.get("APCA_RETRY_WAIT", 3))
+        self.retry_codes = [
+            int(code)
+            for code in os.environ.get("APCA_RETRY_CODES", "429,504").split(",")
+        ]
+        self.limiter = limiter or get_rate_limiter()
+        self.session = None
+
+    def get_session(self):
+        """Return the session of the connection pool, opened on first use."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections, keepalive_timeout=KEEPALIVE_TIMEOUT
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+        return self.session
+
+    async def close(self):
+        """Close the open connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, data=None, base_url=None, api_version=None):
+        """
+        Make a request, returning the decoded JSON response.
+
+        Each request first waits on the rate limiter shared by all workers.
+        Rate limited and timed out requests are retried after `retry_wait`
+        seconds, up to `retry` times. Other errors raise `APIError`.
+
+        :param method(str): HTTP method
+        :param path(str): path of the endpoint
+        :param data(dict): query parameters of GET and DELETE requests, and
+        the JSON body of others
+        :param base_url(str): url of the api, defaults to the trading api
+        :param api_version(str): version of the api, defaults to v2
+        """
+        url = f"{base_url or self.base_url}/{api_version or self.api_version}{path}"
+        options = {"allow_redirects": False}
+        if method in ("GET", "DELETE"):
+            options["params"] = query_params(data)
+        else:
+            options["json"] = data
+
+        retry = max(self.retry, 0)
+        while True:
+            await self.limiter.acquire(method, path)
+            async with self.get_session().request(method, url, **options) as response:
+                text = await response.text()
+                if response.status < 400:
+                    return await response.json(content_type=None) if text else None
+                if response.status not in self.retry_codes or retry <= 0:
+                    error = http_error(response.status, response.reason, url)
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        raise error from None
+                    if isinstance(body, dict) and "message" in body:
+                        raise APIError(body, error) from None
+                    raise error
+            logger.warning(
+                f"Retrying request after seconds: {url}, {self.retry_wait}, {retry} left"
+            )
+            await asyncio.sleep(self.retry_wait)
+            retry -= 1
+
+    async def data_request(self, path, data=None):
+        """Make a GET request to the v1 market data api."""
+        return await self.request(
+            "GET", path, data, base_url=self.data_url, api_version="v1"
+        )
+
+    async def get_account(self):
+        return Account(await self.request("GET", "/account"))
+
+    async def get_portfolio_history(
+        self,
+        date_start=None,
+        date_end=None,
+        period=None,
+        timeframe=None,
+        extended_hours=None,
+    ):
+        return PortfolioHistory(
+            await self.request(
+                "GET",
+                "/account/portfolio/history",
+                {
+                    "date_start": date_start,
+                    "date_end": date_end,
+                    "period": period,
+                    "timeframe": timeframe,
+                    "extended_hours": extended_hours,
+                },
+            )
+        )
+
+    async def list_assets(self, status=None, asset_class=None):
+        assets = await self.request(
+            "GET", "/assets", {"status": status, "asset_class": asset_class}
+        )
+        return [Asset(asset) for asset in assets]
+
+    async def get_asset(self, symbol):
+        return Asset(await self.request("GET", f"/assets/{symbol}"))
+
+    async def list_positions(self):
+        return [
+            Position(position) for position in await self.request("GET", "/positions")
+        ]
+
+    async def get_position(self, symbol):
+        return Position(await self.request("GET", f"/positions/{symbol}"))
+
+    async def list_orders(
+        self,
+        status=None,
+        limit=None,
+        after=None,
+        until=None,
+        direction=None,
+        nested=None,
+    ):
+        orders = await self.request(
+            "GET",
+            "/orders",
+            {
+                "status": status,
+                "limit": limit,
+                "after": after,
+                "until": until,
+                "direction": direction,
+                "nested": nested,
+            },
+        )
+        return [Order(order) for order in orders]
+
+    async def get_order_by_client_order_id(self, client_order_id):
+        return Order(
+            await self.request(
+                "GET",
+                "/orders:by_client_order_id",
+                {"client_order_id": client_order_id},
+            )
+        )
+
+    async def get_order(self, order_id):
+        return Order(await self.request("GET", f"/orders/{order_id}"))
+
+    async def cancel_order(self, order_id):
+        await self.request("DELETE", f"/orders/{order_id}")
+
+    async def cancel_all_orders(self):
+        await self.request("DELETE", "/orders")
+
+    async def submit_order(
+        self,
+        symbol,
+        qty=None,
+        side="buy",
+        type="market",
+        time_in_force="day",
+        limit_price=None,
+        stop_price=None,
+        client_order_id=None,
+        extended_hours=None,
+        order_class=None,
+        take_profit=None,
+        stop_loss=None,
+        trail_price=None,
+        trail_percent=None,
+        notional=None,
+    ):
+        params = {
+            "symbol": symbol,
+            "qty": qty,
+            "notional": notional,
+            "side": side,
+            "type": type,
+            "time_in_force": time_in_force,
+            "limit_price": limit_price,
+            "stop_price": stop_price,
+            "client_order_id": client_order_id,
+            "extended_hours": extended_hours,
+            "order_class": order_class,
+            "take_profit": take_profit,
+            "stop_loss": stop_loss,
+            "trail_price": trail_price,
+            "trail_percent": trail_percent,
+        }
+        return Order(
+            await self.request(
+                "POST",
+                "/orders",
+                {key: value for key, value in params.items() if value is not None},
+            )
+        )
+
+    async def get_clock(self):
+        return Clock(await self.request("GET", "/clock"))
+
+    async def get_barset(
+        self,
+        symbols,
+        timeframe,
+        limit=None,
+        start=None,
+        end=None,
+        after=None,
+        until=None,
+    ):
+        """Return a dict of each symbol to its list of bars."""
+        if not isinstance(symbols, str):
+            symbols = ",".join(symbols)
+        barset = await self.data_request(
+            f"/bars/{timeframe}",
+            {
+                "symbols": symbols,
+                "limit": limit,
+                "start": start,
+                "end": end,
+                "after": after,
+                "until": until,
+            },
+        )
+        return {symbol: [Bar(bar) for bar in bars] for symbol, bars in barset.items()}
+
+    async def get_aggs(self, symbol, timespan, multiplier, _from, to):
+        """Return the list of aggregate bars of the symbol over the range."""
+        aggs = await self.data_request(
+            f"/aggs/ticker/{symbol}/range/{multiplier}/{timespan}/{_from}/{to}"
+        )
+        return [Bar(agg) for agg in aggs.get("results") or []]
+
+    async def get_last_trade(self, symbol):
+        return Trade((await self.data_request(f"/last/stocks/{symbol}"))["last"])
+
+    async def get_last_quote(self, symbol):
+        return Quote((await self.data_request(f"/last_quote/stocks/{symbol}"))["last"])
+
+
+async def in_priority(coroutine, priority):
+    """Await a coroutine, with its requests in a priority class."""
+    with api_priority(priority):
+        return await coroutine
+
+
+class SyncTransport:
+    """
+    Blocking facade of an `AlpacaTransport`, for synchronous code.
+
+    The transport runs on an event loop in a daemon thread, and each method
+    call blocks until its request is done. Calls are thread safe, and calls
+    made from many threads run concurrently over the one connection pool.
+    """
+
+    def __init__(self, transport=None):
+        """
+        :param transport(AlpacaTransport): transport to run, defaults to one
+        configured from the environment
+        """
+        self.transport = transport or AlpacaTransport()
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="alpaca-transport", daemon=True
+        )
+        self.thread.start()
+
+    def run(self, coroutine):
+        """Run a coroutine on the transport's loop, returning its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def __getattr__(self, name):
+        method = getattr(self.transport, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            # The request runs in the loop's thread, in the priority class of
+            # the calling thread
+            return self.run(
+                in_priority(method(*args, **kwargs), request_priority.get())
+            )
+
+        return call
+
+    def close(self):
+        """Close the open connections, and stop the loop."""
+        self.run(self.transport.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Return the transport shared by the process, started on first use.
+
+    A forked process, e.g. a Celery worker, starts its own transport, as
+    threads and open connections are not inherited.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None or _transport.pid != os.getpid():
+            _transport = SyncTransport()
+        return _transport
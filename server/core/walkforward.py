@@ -0,0 +1,221 @@
+import logging
+from itertools import product
+
+import numpy as np
+
+from core.backtest import (
+    PERIODS_PER_YEAR,
+    TRADING_DAYS_PER_YEAR,
+    backtest,
+    moving_averages,
+    periods_per_year,
+)
+from core.models import BacktestResult, StrategyRecommendation
+from core.resample import can_resample, resample
+from core.sweep import load_universe, map_shared, shared_bars
+
+logger = logging.getLogger(__name__)
+
+
+def slice_bars(bars, index):
+    """Return the bars within a slice."""
+    return {field: values[index] for field, values in bars.items()}
+
+
+def walk_forward(
+    bars,
+    windows,
+    train_size,
+    test_size,
+    stop_loss_percentages=(None,),
+    take_profit_percentages=(None,),
+    trade_value=1000,
+    metric=BacktestResult.SHARPE,
+    annual_periods=PERIODS_PER_YEAR,
+):
+    """
+    Optimise moving average parameters with rolling train and test slices.
+
+    Parameters with the best metric on each train slice are backtested on
+    the test slice which follows it. Test slices do not overlap, so every
+    out of sample bar is traded once.
+
+    Each moving average is computed once over the whole history and sliced
+    for every train and test slice, rather than recomputed for each of them.
+    Slices start once the longest moving average is available.
+
+    :param bars(dict): arrays returned from `load_bars`
+    :param windows(list): moving average window lengths, in bars
+    :param train_size(int): number of bars parameters are chosen on
+    :param test_size(int): number of bars parameters are evaluated on
+    :param stop_loss_percentages(list): stop losses, `None` for no stop loss
+    :param take_profit_percentages(list): take profits, `None` for no take
+    profit
+    :param trade_value(float): value of each buy order
+    :param metric(str): one of `BacktestResult.METRICS`
+    :param annual_periods(int): bars per year, used to annualise the Sharpe
+    ratio
+    :returns: dict of the recommended parameters and each fold, or None if
+    there are not enough bars for a single fold
+    """
+    if metric not in BacktestResult.METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    averages = {window: moving_averages(bars["c"], window) for window in windows}
+    grid = list(product(windows, stop_loss_percentages, take_profit_percentages))
+
+    def evaluate(index, parameters):
+        window, stop_loss, take_profit = parameters
+        return backtest(
+            slice_bars(bars, index),
+            window,
+            trade_value,
+            stop_loss_percentage=stop_loss,
+            take_profit_percentage=take_profit,
+            annual_periods=annual_periods,
+            averages=averages[window][index],
+        )[metric]
+
+    folds = []
+    first = max(windows) - 1
+    for start in range(first, len(bars["t"]) - train_size - test_size + 1, test_size):
+        train = slice(start, start + train_size)
+        test = slice(train.stop, train.stop + test_size)
+
+        scores = [evaluate(train, parameters) for parameters in grid]
+        best = int(np.argmax(scores))
+        folds.append(
+            {
+                "train_t": int(bars["t"][train.start]),
+                "test_t": int(bars["t"][test.start]),
+                "parameters": grid[best],
+                "in_sample": scores[best],
+                "out_of_sample": evaluate(test, grid[best]),
+            }
+        )
+
+    if not folds:
+        return None
+
+    # Parameters chosen on the most recent train slice are recommended
+    recommended = folds[-1]["parameters"]
+    window, stop_loss, take_profit = recommended
+    return {
+        "window": window,
+        "stop_loss_percentage": stop_loss,
+        "take_profit_percentage": take_profit,
+        "in_sample": float(np.mean([fold["in_sample"] for fold in folds])),
+        "out_of_sample": float(np.mean([fold["out_of_sample"] for fold in folds])),
+        "stability": float(
+            np.mean([fold["parameters"] == recommended for fold in folds])
+        ),
+        "folds": folds,
+    }
+
+
+def walk_forward_asset(asset_id, start, stop, timeframe, trade_value, options):
+    """
+    Walk forward one asset and timeframe in a worker process.
+
+    :param asset_id(str): id of the asset
+    :param start(int): first column of the asset in the shared array
+    :param stop(int): column after the last column of the asset
+    :param timeframe(str): timeframe to optimise
+    :param trade_value(float): value of each buy order
+    :param options(dict): keyword arguments passed to `walk_forward`, with
+    train and test sizes in trading days
+    :returns: tuple of (asset id, timeframe, trade value, result)
+    """
+    bars = resample(shared_bars(start, stop), timeframe)
+    periods = periods_per_year(timeframe)
+    bars_per_day = periods // TRADING_DAYS_PER_YEAR
+    options = dict(options)
+    result = walk_forward(
+        bars,
+        train_size=options.pop("train_days") * bars_per_day,
+        test_size=options.pop("test_days") * bars_per_day,
+        trade_value=trade_value,
+        annual_periods=periods,
+        **options,
+    )
+    return asset_id, timeframe, trade_value, result
+
+
+def recommend_strategies(
+    strategies,
+    windows,
+    train_days=20,
+    test_days=5,
+    stop_loss_percentages=(None,),
+    take_profit_percentages=(None,),
+    metric=BacktestResult.SHARPE,
+    max_workers=None,
+):
+    """
+    Recommend moving average parameters for each strategy.
+
+    Strategies of the same asset, timeframe, and trade value share a walk
+    forward, and walk forwards of different assets run in parallel.
+
+    :param strategies(iterable): strategies to recommend parameters for
+    :param windows(list): moving average window lengths, in bars
+    :param train_days(int): trading days parameters are chosen on
+    :param test_days(int): trading days parameters are evaluated on
+    :param stop_loss_percentages(list): stop losses, `None` for no stop loss
+    :param take_profit_percentages(list): take profits, `None` for no take
+    profit
+    :param metric(str): one of `BacktestResult.METRICS`
+    :param max_workers(int): number of worker processes, defaults to the
+    number of cores
+    :returns: list of saved `StrategyRecommendation`
+    """
+    groups = {}
+    for strategy in strategies:
+        if not can_resample(strategy.timeframe):
+            logger.warning(
+                f"Unable to walk forward timeframe shorter than stored bars: {strategy.id}"
+            )
+            continue
+        key = (str(strategy.asset_id), strategy.timeframe, float(strategy.trade_value))
+        groups.setdefault(key, []).append(strategy)
+
+    slices, values = load_universe({asset_id for asset_id, _, _ in groups})
+    options = {
+        "windows": list(windows),
+        "train_days": train_days,
+        "test_days": test_days,
+        "stop_loss_percentages": list(stop_loss_percentages),
+        "take_profit_percentages": list(take_profit_percentages),
+        "metric": metric,
+    }
+    tasks = [
+        (asset_id, start, stop, timeframe, trade_value, options)
+        for asset_id, start, stop in slices
+        for (group_asset_id, timeframe, trade_value) in groups
+        if group_asset_id == asset_id
+    ]
+
+    recommendations = []
+    for asset_id, timeframe, trade_value, result in map_shared(
+        walk_forward_asset, tasks, values, max_workers
+    ):
+        if result is None:
+            logger.info(f"Insufficient bar data to walk forward asset: {asset_id}")
+            continue
+        recommendations += StrategyRecommendation.objects.bulk_create(
+            [
+                StrategyRecommendation(
+                    strategy=strategy,
+                    window=result["window"],
+                    stop_loss_percentage=result["stop_loss_percentage"],
+                    take_profit_percentage=result["take_profit_percentage"],
+                    metric=metric,
+                    in_sample=result["in_sample"],
+                    out_of_sample=result["out_of_sample"],
+                    stability=result["stability"],
+                    folds=len(result["folds"]),
+                )
+                for strategy in groups[(asset_id, timeframe, trade_value)]
+            ]
+        )
+    return recommendations
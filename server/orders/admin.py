@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from .models import Order
+from .models import Order, OrderIntent
 
 admin.site.register(Order)
+admin.site.register(OrderIntent)
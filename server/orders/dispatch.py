@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+import uuid
+
+import aiohttp
+import requests
+from core.alpaca import TradeApiRest
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_ORDERS = 8
+ORDER_TIMEOUT = 30
+MAX_ATTEMPTS = 3
+# Seconds before the first retry, doubled on each further retry
+RETRY_BACKOFF = 0.5
+
+
+def error_status(error):
+    """
+    Return the HTTP status code of a failed request, if it got a response.
+
+    Errors without a JSON body are raised as `requests.HTTPError`, which only
+    carries the status code of its response.
+
+    :param error(Exception): error raised by the request
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_retryable(error):
+    """
+    Return true if an order request may succeed if it is retried.
+
+    Timeouts, connection errors, rate limits and server errors are
+    transient, whereas other errors (e.g. insufficient buying power) are not.
+
+    :param error(Exception): error raised by the order request
+    """
+    if isinstance(
+        error,
+        (
+            asyncio.TimeoutError,
+            aiohttp.ClientConnectionError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ),
+    ):
+        return True
+    status_code = error_status(error)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def may_exist(error):
+    """
+    Return true if an order may have been placed despite the request failing.
+
+    :param error(Exception): error raised by the order request
+    """
+    # Alpaca rejects a client order id which has already been used with 422
+    return is_retryable(error) or error_status(error) == 422
+
+
+class OrderDispatcher:
+    """
+    Submit every order decided in a tick concurrently.
+
+    Orders are submitted from the event loop of the api's connections, with
+    at most `max_concurrency` requests in flight over its pooled HTTP
+    session. Each order is submitted independently, so a slow or failed order
+    never delays or cancels the others, and the outcome of every order is
+    returned.
+
+    Every order is submitted with a client order id, so transient failures
+    are retried with backoff without risking a duplicate order. When an order
+    may have been placed despite an error, it is looked up by its client
+    order id before being retried.
+    """
+
+    def __init__(
+        self,
+        api=None,
+        max_concurrency=MAX_CONCURRENT_ORDERS,
+        timeout=ORDER_TIMEOUT,
+        max_attempts=MAX_ATTEMPTS,
+        backoff=RETRY_BACKOFF,
+    ):
+        """
+        :param api(TradeApiRest): api used to place orders
+        :param max_concurrency(int): maximum number of order requests in flight
+        :param timeout(float): seconds to wait for each request, or None to
+        wait indefinitely
+        :param max_attempts(int): maximum number of submissions of each order
+        :param backoff(float): seconds before the first retry
+        """
+        self.api = api or TradeApiRest()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    async def submit(self, api, params):
+        """
+        Submit a single order, returning the raw order placed.
+
+        :param api(AsyncTradeApiRest): api used to place the order
+        :param params(dict): keyword arguments of `TradeApiRest.submit_order`
+        """
+        order = await asyncio.wait_for(api.submit_order(**params), self.timeout)
+        return order.__dict__["_raw"]
+
+    async def recover(self, api, client_order_id):
+        """
+        Return the raw order placed with a client order id, or None if no
+        order was placed.
+
+        :param api(AsyncTradeApiRest): api used to look up the order
+        :param client_order_id(str): client order id the order was submitted
+        with
+        """
+        try:
+            order = await asyncio.wait_for(
+                api.get_order_by_client_order_id(client_order_id), self.timeout
+            )
+        except Exception:
+            return None
+        return order.__dict__["_raw"]
+
+    async def attempt(self, api, params):
+        """
+        Submit an order once, recovering the order if it may have been placed
+        despite an error.
+
+        :param api(AsyncTradeApiRest): api used to place the order
+        :param params(dict): keyword arguments of `TradeApiRest.submit_order`
+        :returns: tuple of (raw order placed or None, error or None)
+        """
+        try:
+            return await self.submit(api, params), None
+        except Exception as e:
+            error = e
+        if may_exist(error):
+            # The order may have been placed, e.g. the request timed out after
+            # Alpaca received it
+            order = await self.recover(api, params["client_order_id"])
+            if order is not None:
+                return order, None
+        return None, error
+
+    def result(self, params, order, error, attempts, elapsed):
+        """Return the result of an order, logging it if the order failed."""
+        message = None
+        if error is not None:
+            if isinstance(error, asyncio.TimeoutError):
+                message = f"No response after {self.timeout}s"
+            else:
+                message = str(error) or type(error).__name__
+            logger.warning(
+                f"Order failed after attempts: {params.get('symbol')}, {attempts}, {message}"
+            )
+        return {
+            "params": params,
+            "order": order,
+            "error": message,
+            "retryable": error is not None and is_retryable(error),
+            "attempts": attempts,
+            "elapsed": elapsed,
+        }
+
+    async def submit_async(self, api, params, semaphore):
+        """
+        Submit an order, once a request slot is free.
+
+        :param api(AsyncTradeApiRest): api used to place the order
+        :param params(dict): keyword arguments of `TradeApiRest.submit_order`
+        :param semaphore(Semaphore): bounds the number of requests in flight
+        :returns: dict of the `params`, raw `order` placed or None, `error`
+        message or None, whether the error is `retryable`, number of
+        `attempts`, and `elapsed` seconds
+        """
+        params = {"client_order_id": str(uuid.uuid4()), **params}
+        started = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            async with semaphore:
+                order, error = await self.attempt(api, params)
+            if (
+                error is None
+                or not is_retryable(error)
+                or attempts >= self.max_attempts
+            ):
+                break
+            # Sleep outside the semaphore, so other orders are submitted
+            await asyncio.sleep(self.backoff * 2 ** (attempts - 1))
+        return self.result(params, order, error, attempts, time.monotonic() - started)
+
+    async def dispatch_async(self, orders):
+        """
+        Submit orders concurrently.
+
+        :param orders(list): keyword arguments of `TradeApiRest.submit_order`
+        for each order
+        :returns: list of results of `submit_async`, in the order given
+        """
+        if not orders:
+            return []
+
+        api = self.api.async_api()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(
+            *(self.submit_async(api, params, semaphore) for params in orders)
+        )
+
+    def dispatch(self, orders):
+        """
+        Submit orders concurrently, blocking until every order has a result.
+
+        :param orders(list): keyword arguments of `TradeApiRest.submit_order`
+        for each order
+        :returns: list of results of `submit_async`, in the order given
+        """
+        if not orders:
+            return []
+        results = self.api.run(self.dispatch_async(orders))
+        failed = sum(result["error"] is not None for result in results)
+        logger.info(f"Orders dispatched, failed: {len(results)}, {failed}")
+        return results
@@ -0,0 +1,159 @@
+import logging
+import uuid
+
+from django.utils import timezone
+
+from .dispatch import MAX_CONCURRENT_ORDERS, OrderDispatcher, error_status
+from .models import Order, OrderIntent
+from .tasks import build_order
+
+logger = logging.getLogger(__name__)
+
+# Namespace of the client order ids derived for order intents
+ORDER_INTENT_NAMESPACE = uuid.UUID("0b7c1e4a-5f3d-4c8e-9a61-2d4b8f0e7a93")
+
+
+def intent_client_order_id(strategy_id, t, side):
+    """
+    Return the client order id of the order a strategy decided on a bar.
+
+    :param strategy_id(int): id of the strategy deciding the order
+    :param t(int): the beginning time of the bar as a Unix epoch
+    :param side(str): buy or sell
+    """
+    return uuid.uuid5(ORDER_INTENT_NAMESPACE, f"{strategy_id}:{t}:{side}")
+
+
+def record_intents(intents):
+    """
+    Write order intents to the ledger before they are submitted.
+
+    Intents already in the ledger are kept as they are, so an order decided
+    again (e.g. a tick which is retried) is only submitted if it was never
+    confirmed.
+
+    :param intents(list): unsaved order intents
+    :returns: list of the intents still to be submitted
+    """
+    if not intents:
+        return []
+    OrderIntent.objects.bulk_create(intents, ignore_conflicts=True)
+    return list(
+        OrderIntent.objects.filter(pk__in=[intent.pk for intent in intents])
+        .pending()
+        .select_related("asset")
+        .order_by("created_at", "pk")
+    )
+
+
+def settle_intent(intent, raw_order=None, error="", failed=False):
+    """
+    Update an intent with the outcome of its submission.
+
+    :param intent(OrderIntent): intent submitted
+    :param raw_order(dict): raw order placed, if any
+    :param error(str): reason the order was not placed
+    :param failed(bool): true if the order will never be placed
+    :returns: unsaved order placed, if any
+    """
+    intent.updated_at = timezone.now()
+    if raw_order is None:
+        intent.error = error or ""
+        if failed:
+            intent.status = OrderIntent.FAILED
+        return None
+
+    order = build_order(
+        raw_order,
+        user_id=intent.user_id,
+        strategy_id=intent.strategy_id,
+        asset_id_id=intent.asset_id,
+    )
+    intent.status = OrderIntent.SUBMITTED
+    intent.error = ""
+    intent.order = order
+    return order
+
+
+def save_settled(intents, orders):
+    """Save orders placed, and the intents they were placed for."""
+    Order.objects.bulk_create(orders, ignore_conflicts=True)
+    OrderIntent.objects.bulk_update(
+        intents, ["status", "attempts", "error", "order", "updated_at"]
+    )
+
+
+def submit_intents(intents, api=None, max_concurrency=MAX_CONCURRENT_ORDERS):
+    """
+    Submit pending order intents concurrently, and record the outcome.
+
+    Orders which fail transiently are retried by the dispatcher, and left
+    pending if every attempt fails, so they are recovered by
+    `reconcile_intents`. Orders which are rejected are marked as failed.
+
+    :param intents(list): intents returned from `record_intents`
+    :param api(TradeApiRest): api used to place orders
+    :param max_concurrency(int): maximum number of order requests in flight
+    :returns: list of tuples of (intent, result of `OrderDispatcher.dispatch`)
+    """
+    if not intents:
+        return []
+
+    results = OrderDispatcher(api, max_concurrency=max_concurrency).dispatch(
+        [intent.order_params() for intent in intents]
+    )
+
+    orders = []
+    for intent, result in zip(intents, results):
+        intent.attempts += result["attempts"]
+        order = settle_intent(
+            intent,
+            result["order"],
+            error=result["error"],
+            failed=not result["retryable"],
+        )
+        if order is not None:
+            orders.append(order)
+    save_settled(intents, orders)
+
+    return list(zip(intents, results))
+
+
+def reconcile_intents(api, older_than):
+    """
+    Settle intents left pending, e.g. by a worker which stopped mid-tick.
+
+    Each intent is looked up by its client order id, and is recorded as
+    submitted if Alpaca has the order, or failed otherwise, as its signal is
+    stale by now.
+
+    :param api(TradeApiRest): api used to look up orders
+    :param older_than(datetime): only reconcile intents created before
+    :returns: number of intents reconciled
+    """
+    intents = list(OrderIntent.objects.pending().filter(created_at__lt=older_than))
+    if not intents:
+        return 0
+
+    orders = []
+    settled = []
+    for intent in intents:
+        try:
+            order = api.get_order_by_client_order_id(str(intent.client_order_id))
+            raw_order = order.__dict__["_raw"]
+        except Exception as e:
+            if error_status(e) != 404:
+                # Unable to tell if the order exists, so try again later
+                logger.warning(f"Order intent lookup failed: {intent.pk}, {e}")
+                continue
+            raw_order = None
+        order = settle_intent(
+            intent, raw_order, error=intent.error or "Order not placed", failed=True
+        )
+        if order is not None:
+            orders.append(order)
+        settled.append(intent)
+    save_settled(settled, orders)
+
+    logger.info(f"Order intents reconciled, recovered: {len(settled)}, {len(orders)}")
+    return len(settled)
@@ -0,0 +1,37 @@
+from alpaca_trade_api.stream import Stream
+from django.core.management.base import BaseCommand
+from orders.updates import TradeUpdateStream
+
+
+class Command(BaseCommand):
+    help = "Keep orders in sync with the trade updates stream in real time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of orders buffered before they are written.",
+        )
+        parser.add_argument(
+            "--flush-interval",
+            type=float,
+            default=1.0,
+            help="Maximum seconds an update is buffered before it is written.",
+        )
+        parser.add_argument(
+            "--base-url",
+            default=None,
+            help="Trading api url streamed from, defaults to APCA_API_BASE_URL.",
+        )
+
+    def handle(self, *args, **kwargs):
+        # Credentials are read from the APCA_API_* env variables
+        stream = Stream(base_url=kwargs["base_url"], raw_data=True)
+
+        self.stdout.write("Syncing orders...")
+        TradeUpdateStream(
+            stream,
+            batch_size=kwargs["batch_size"],
+            flush_interval=kwargs["flush_interval"],
+        ).run()
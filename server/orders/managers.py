@@ -14,3 +14,11 @@ class OrderQuerySet(QuerySet):
         if user.is_staff:
             return self.all()
         return self.filter(user=user)
+
+
+class OrderIntentQuerySet(QuerySet):
+    """Custom queryset methods for order intents."""
+
+    def pending(self):
+        """Return intents without a confirmed order or failure."""
+        return self.filter(status="pending")
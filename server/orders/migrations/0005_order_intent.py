@@ -0,0 +1,159 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_strategy_recommendation"),
+        ("assets", "0004_bars_unique_together"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("orders", "0004_rename_trail_percent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderIntent",
+            fields=[
+                (
+                    "client_order_id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                (
+                    "t",
+                    models.PositiveIntegerField(
+                        help_text="the beginning time of the bar the order was decided on",
+                        verbose_name="bar time",
+                    ),
+                ),
+                (
+                    "side",
+                    models.CharField(
+                        choices=[("buy", "buy"), ("sell", "sell")],
+                        max_length=56,
+                        verbose_name="side",
+                    ),
+                ),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[
+                            ("market", "market"),
+                            ("limit", "limit"),
+                            ("stop", "stop"),
+                            ("stop_limit", "stop limit"),
+                            ("trailing_stop", "trailing stop"),
+                        ],
+                        max_length=56,
+                        verbose_name="type",
+                    ),
+                ),
+                (
+                    "time_in_force",
+                    models.CharField(
+                        choices=[
+                            ("day", "day"),
+                            ("gtc", "good till cancelled"),
+                            ("opg", "order on open"),
+                            ("cls", "order on close"),
+                            ("ioc", "immediate or cancel"),
+                            ("fok", "fill or kill"),
+                        ],
+                        max_length=56,
+                        verbose_name="time in force",
+                    ),
+                ),
+                (
+                    "notional",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=5,
+                        max_digits=12,
+                        null=True,
+                        verbose_name="notional",
+                    ),
+                ),
+                (
+                    "qty",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=5,
+                        max_digits=12,
+                        null=True,
+                        verbose_name="quantity",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "pending"),
+                            ("submitted", "submitted"),
+                            ("failed", "failed"),
+                        ],
+                        default="pending",
+                        max_length=56,
+                        verbose_name="status",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=0, verbose_name="attempts"),
+                ),
+                ("error", models.TextField(blank=True, verbose_name="error")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="modified"),
+                ),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="assets.asset",
+                        verbose_name="asset",
+                    ),
+                ),
+                (
+                    "order",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="intent",
+                        to="orders.order",
+                        verbose_name="order",
+                    ),
+                ),
+                (
+                    "strategy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="order_intents",
+                        to="core.strategy",
+                        verbose_name="strategy",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="user",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "order intent",
+                "verbose_name_plural": "order intents",
+            },
+        ),
+    ]
@@ -5,7 +5,7 @@ from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from .managers import OrderQuerySet
+from .managers import OrderIntentQuerySet, OrderQuerySet
 
 
 class Order(models.Model):
@@ -260,3 +260,117 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         self.clean()
         return super().save(*args, **kwargs)
+
+
+class OrderIntent(models.Model):
+    """
+    An order decided by a strategy, recorded before it is submitted.
+
+    The client order id is derived from the strategy, bar, and side of the
+    order, so an order is only ever placed once for each decision, however
+    many times it is submitted.
+    """
+
+    PENDING = "pending"
+    SUBMITTED = "submitted"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, _("pending")),
+        (SUBMITTED, _("submitted")),
+        (FAILED, _("failed")),
+    ]
+
+    client_order_id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("user"),
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    strategy = models.ForeignKey(
+        Strategy,
+        verbose_name=_("strategy"),
+        related_name="order_intents",
+        on_delete=models.CASCADE,
+    )
+    asset = models.ForeignKey(
+        Asset,
+        verbose_name=_("asset"),
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    t = models.PositiveIntegerField(
+        verbose_name=_("bar time"),
+        help_text=_("the beginning time of the bar the order was decided on"),
+    )
+    side = models.CharField(
+        verbose_name=_("side"),
+        choices=Order.SIDE_CHOICES,
+        max_length=56,
+    )
+    type = models.CharField(
+        verbose_name=_("type"),
+        choices=Order.TYPE_CHOICES,
+        max_length=56,
+    )
+    time_in_force = models.CharField(
+        verbose_name=_("time in force"),
+        choices=Order.TIME_IN_FORCE_CHOICES,
+        max_length=56,
+    )
+    notional = models.DecimalField(
+        verbose_name=_("notional"),
+        max_digits=12,
+        decimal_places=5,
+        blank=True,
+        null=True,
+    )
+    qty = models.DecimalField(
+        verbose_name=_("quantity"),
+        max_digits=12,
+        decimal_places=5,
+        blank=True,
+        null=True,
+    )
+    status = models.CharField(
+        verbose_name=_("status"),
+        choices=STATUS_CHOICES,
+        max_length=56,
+        default=PENDING,
+    )
+    attempts = models.PositiveIntegerField(_("attempts"), default=0)
+    error = models.TextField(_("error"), blank=True)
+    order = models.OneToOneField(
+        Order,
+        verbose_name=_("order"),
+        related_name="intent",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    created_at = models.DateTimeField(_("created"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("modified"), auto_now=True)
+
+    objects = OrderIntentQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "order intent"
+        verbose_name_plural = "order intents"
+
+    def __str__(self):
+        return f"{self.side} {self.asset.symbol} at {self.t} ({self.status})"
+
+    def order_params(self):
+        """Return the keyword arguments submitting the order to Alpaca."""
+        params = {
+            "symbol": self.asset.symbol,
+            "side": self.side,
+            "type": self.type,
+            "time_in_force": self.time_in_force,
+            "client_order_id": str(self.client_order_id),
+        }
+        if self.notional is not None:
+            params["notional"] = float(self.notional)
+        if self.qty is not None:
+            params["qty"] = float(self.qty)
+        return params
@@ -9,6 +9,49 @@ from .serializers import OrderCreateSerializer
 logger = logging.getLogger(__name__)
 
 
+def build_order(raw_order, **kwargs):
+    """
+    Build an unsaved order from an order returned by Alpaca.
+
+    :param raw_order(dict): raw order returned from Alpaca
+    :param kwargs: fields of the order not returned by Alpaca, e.g. `user`
+    """
+    fields = {
+        field: raw_order.get(field)
+        for field in (
+            "id",
+            "client_order_id",
+            "created_at",
+            "updated_at",
+            "submitted_at",
+            "filled_at",
+            "expired_at",
+            "canceled_at",
+            "failed_at",
+            "replaced_at",
+            "replaced_by",
+            "replaces",
+            "notional",
+            "qty",
+            "filled_qty",
+            "filled_avg_price",
+            "order_class",
+            "type",
+            "side",
+            "time_in_force",
+            "limit_price",
+            "stop_price",
+            "status",
+            "extended_hours",
+            "trail_percent",
+            "trail_price",
+            "hwm",
+        )
+    }
+    fields.update(kwargs)
+    return Order(**fields)
+
+
 def update_orders(user, orders=None):
     """Update db with historical orders placed from Alpaca account."""
     logger.info("Updating historical orders...")
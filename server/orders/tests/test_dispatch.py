@@ -0,0 +1,197 @@
+import asyncio
+import time
+import uuid
+from unittest.mock import AsyncMock, MagicMock
+
+import requests
+from alpaca_trade_api.entity import Order as AlpacaOrder
+from alpaca_trade_api.rest import APIError
+from django.test import TestCase
+from orders.dispatch import OrderDispatcher
+from orders.models import Order
+
+
+def alpaca_order(symbol, notional):
+    return AlpacaOrder(
+        {
+            "id": str(uuid.uuid4()),
+            "client_order_id": str(uuid.uuid4()),
+            "symbol": symbol,
+            "notional": str(notional),
+            "side": Order.BUY,
+            "status": Order.ACCEPTED,
+        }
+    )
+
+
+def order_params(symbol, notional=100):
+    return {
+        "symbol": symbol,
+        "notional": notional,
+        "side": Order.BUY,
+        "type": Order.MARKET,
+        "time_in_force": Order.GTC,
+    }
+
+
+class OrderDispatcherTests(TestCase):
+    def setUp(self):
+        self.api = MagicMock()
+        self.api.run.side_effect = asyncio.run
+        # Orders are awaited on the api's async twin
+        self.async_api = self.api.async_api.return_value
+        self.async_api.submit_order = AsyncMock(
+            side_effect=lambda **params: alpaca_order(
+                params["symbol"], params["notional"]
+            )
+        )
+        self.async_api.get_order_by_client_order_id = AsyncMock()
+
+    def test_dispatch(self):
+        """Every order is submitted, and results are returned in order."""
+        orders = [order_params(symbol) for symbol in ("TSLA", "AAPL", "MSFT")]
+
+        results = OrderDispatcher(self.api).dispatch(orders)
+
+        self.assertEqual(self.async_api.submit_order.call_count, 3)
+        self.assertEqual(
+            [result["order"]["symbol"] for result in results], ["TSLA", "AAPL", "MSFT"]
+        )
+        self.assertEqual(
+            [result["params"]["symbol"] for result in results],
+            ["TSLA", "AAPL", "MSFT"],
+        )
+        # Orders are given a client order id, so they can be retried
+        self.assertEqual(
+            len({result["params"]["client_order_id"] for result in results}), 3
+        )
+        self.assertTrue(all(result["error"] is None for result in results))
+        self.assertEqual(OrderDispatcher(self.api).dispatch([]), [])
+
+    def test_dispatch_failures(self):
+        """A failed order is recorded without cancelling the others."""
+
+        def submit_order(**params):
+            if params["symbol"] == "AAPL":
+                raise Exception("Insufficient buying power")
+            return alpaca_order(params["symbol"], params["notional"])
+
+        self.async_api.submit_order.side_effect = submit_order
+
+        results = OrderDispatcher(self.api).dispatch(
+            [order_params(symbol) for symbol in ("TSLA", "AAPL", "MSFT")]
+        )
+
+        self.assertEqual(
+            [result["error"] for result in results],
+            [None, "Insufficient buying power", None],
+        )
+        self.assertIsNone(results[1]["order"])
+        self.assertEqual(results[2]["order"]["symbol"], "MSFT")
+
+    def test_dispatch_concurrency(self):
+        """Orders are submitted concurrently, up to the concurrency limit."""
+        in_flight = []
+        peak = []
+
+        async def submit_order(**params):
+            in_flight.append(params["symbol"])
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(params["symbol"])
+            return alpaca_order(params["symbol"], params["notional"])
+
+        self.async_api.submit_order.side_effect = submit_order
+
+        started = time.monotonic()
+        results = OrderDispatcher(self.api, max_concurrency=3).dispatch(
+            [order_params(str(i)) for i in range(9)]
+        )
+
+        self.assertEqual(len(results), 9)
+        self.assertEqual(max(peak), 3)
+        # Three rounds of three orders, rather than nine in sequence
+        self.assertLess(time.monotonic() - started, 0.05 * 9)
+
+    def test_dispatch_timeout(self):
+        """A slow order does not delay the results of the others."""
+
+        async def submit_order(**params):
+            if params["symbol"] == "TSLA":
+                await asyncio.sleep(5)
+            return alpaca_order(params["symbol"], params["notional"])
+
+        self.async_api.submit_order.side_effect = submit_order
+        self.async_api.get_order_by_client_order_id.side_effect = APIError(
+            {"message": "order not found"}
+        )
+
+        started = time.monotonic()
+        results = OrderDispatcher(self.api, timeout=0.1, max_attempts=1).dispatch(
+            [order_params("TSLA"), order_params("AAPL")]
+        )
+
+        # The slow request is cancelled, rather than left running
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(results[0]["error"], "No response after 0.1s")
+        self.assertIsNone(results[0]["order"])
+        self.assertEqual(results[1]["order"]["symbol"], "AAPL")
+
+    def test_dispatch_retries(self):
+        """Transient failures are retried with the same client order id."""
+        self.async_api.get_order_by_client_order_id.side_effect = APIError(
+            {"message": "order not found"}
+        )
+        self.async_api.submit_order.side_effect = [
+            requests.exceptions.ConnectionError("Connection reset"),
+            alpaca_order("TSLA", 100),
+        ]
+
+        results = OrderDispatcher(self.api, backoff=0).dispatch([order_params("TSLA")])
+
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(results[0]["attempts"], 2)
+        first, second = self.async_api.submit_order.call_args_list
+        self.assertEqual(
+            first.kwargs["client_order_id"], second.kwargs["client_order_id"]
+        )
+
+        with self.subTest(msg="rejected orders are not retried."):
+            self.async_api.submit_order.reset_mock()
+            self.async_api.submit_order.side_effect = Exception(
+                "Insufficient buying power"
+            )
+
+            results = OrderDispatcher(self.api, backoff=0).dispatch(
+                [order_params("TSLA")]
+            )
+
+            self.assertEqual(self.async_api.submit_order.call_count, 1)
+            self.assertFalse(results[0]["retryable"])
+
+        with self.subTest(msg="orders failing every attempt are retryable."):
+            self.async_api.submit_order.reset_mock()
+            self.async_api.submit_order.side_effect = requests.exceptions.Timeout()
+
+            results = OrderDispatcher(self.api, backoff=0).dispatch(
+                [order_params("TSLA")]
+            )
+
+            self.assertEqual(self.async_api.submit_order.call_count, 3)
+            self.assertTrue(results[0]["retryable"])
+            self.assertEqual(results[0]["error"], "Timeout")
+
+    def test_dispatch_recovers(self):
+        """Orders placed despite an error are recovered, rather than retried."""
+        placed = alpaca_order("TSLA", 100)
+        self.async_api.submit_order.side_effect = requests.exceptions.ReadTimeout()
+        self.async_api.get_order_by_client_order_id.return_value = placed
+
+        results = OrderDispatcher(self.api, backoff=0).dispatch([order_params("TSLA")])
+
+        self.assertEqual(self.async_api.submit_order.call_count, 1)
+        self.async_api.get_order_by_client_order_id.assert_called_once_with(
+            results[0]["params"]["client_order_id"]
+        )
+        self.assertEqual(results[0]["order"], placed.__dict__["_raw"])
+        self.assertIsNone(results[0]["error"])
@@ -0,0 +1,161 @@
+import uuid
+from datetime import timedelta
+
+import requests
+from alpaca_trade_api.entity import Order as AlpacaOrder
+from alpaca_trade_api.rest import APIError
+from core.tests.fake_alpaca import mock_api
+from core.tests.factories import StrategyFactory
+from core.transport import http_error
+from django.test import TestCase
+from django.utils import timezone
+from orders.ledger import (
+    intent_client_order_id,
+    reconcile_intents,
+    record_intents,
+    submit_intents,
+)
+from orders.models import Order, OrderIntent
+
+
+class NotFound(APIError):
+    status_code = 404
+
+
+def alpaca_order(**params):
+    return AlpacaOrder(
+        {
+            "id": str(uuid.uuid4()),
+            "client_order_id": params["client_order_id"],
+            "created_at": "2021-11-29T15:00:00Z",
+            "symbol": params["symbol"],
+            "notional": str(params["notional"]),
+            "filled_qty": "0",
+            "order_class": "",
+            "side": params["side"],
+            "type": params["type"],
+            "time_in_force": params["time_in_force"],
+            "status": Order.ACCEPTED,
+            "extended_hours": False,
+        }
+    )
+
+
+class OrderLedgerTests(TestCase):
+    def setUp(self):
+        self.strategy = StrategyFactory()
+        self.api = mock_api()
+        self.api.submit_order.side_effect = alpaca_order
+
+    def intent(self, t=1638198000, side=Order.BUY):
+        return OrderIntent(
+            client_order_id=intent_client_order_id(self.strategy.pk, t, side),
+            user=self.strategy.user,
+            strategy=self.strategy,
+            asset=self.strategy.asset,
+            t=t,
+            side=side,
+            type=Order.MARKET,
+            time_in_force=Order.GTC,
+            notional=100,
+        )
+
+    def test_intent_client_order_id(self):
+        """Client order ids are derived from the strategy, bar, and side."""
+        self.assertEqual(
+            intent_client_order_id(1, 1638198000, Order.BUY),
+            intent_client_order_id(1, 1638198000, Order.BUY),
+        )
+        self.assertNotEqual(
+            intent_client_order_id(1, 1638198000, Order.BUY),
+            intent_client_order_id(1, 1638198000, Order.SELL),
+        )
+        self.assertNotEqual(
+            intent_client_order_id(1, 1638198000, Order.BUY),
+            intent_client_order_id(2, 1638198000, Order.BUY),
+        )
+
+    def test_record_intents(self):
+        """Orders decided again are only submitted if they were not placed."""
+        intents = record_intents([self.intent(), self.intent(side=Order.SELL)])
+        self.assertEqual(len(intents), 2)
+
+        submit_intents(intents[:1], self.api)
+
+        pending = record_intents([self.intent(), self.intent(side=Order.SELL)])
+        self.assertEqual([intent.side for intent in pending], [intents[1].side])
+        self.assertEqual(OrderIntent.objects.count(), 2)
+
+    def test_submit_intents(self):
+        """Intents are settled with the outcome of their order."""
+        submitted, rejected, transient = record_intents(
+            [
+                self.intent(t=1),
+                self.intent(t=2),
+                self.intent(t=3),
+            ]
+        )
+
+        def submit_order(**params):
+            if params["client_order_id"] == str(rejected.pk):
+                raise Exception("Insufficient buying power")
+            if params["client_order_id"] == str(transient.pk):
+                raise requests.exceptions.ConnectionError("Connection reset")
+            return alpaca_order(**params)
+
+        self.api.submit_order.side_effect = submit_order
+        self.api.get_order_by_client_order_id.side_effect = NotFound(
+            {"message": "order not found"}
+        )
+
+        with self.assertNumQueries(2):
+            # Orders and intents are each saved with one query
+            submit_intents([submitted, rejected, transient], self.api)
+
+        submitted.refresh_from_db()
+        self.assertEqual(submitted.status, OrderIntent.SUBMITTED)
+        self.assertEqual(submitted.order.client_order_id, submitted.client_order_id)
+        self.assertEqual(submitted.order.strategy, self.strategy)
+        rejected.refresh_from_db()
+        self.assertEqual(rejected.status, OrderIntent.FAILED)
+        self.assertEqual(rejected.error, "Insufficient buying power")
+        self.assertEqual(rejected.attempts, 1)
+        transient.refresh_from_db()
+        self.assertEqual(transient.status, OrderIntent.PENDING)
+
+    def test_reconcile_intents(self):
+        """Pending intents are settled from the orders held by Alpaca."""
+        placed, missing, gone, unknown = record_intents(
+            [
+                self.intent(t=1),
+                self.intent(t=2),
+                self.intent(t=3),
+                self.intent(t=4),
+            ]
+        )
+
+        def get_order_by_client_order_id(client_order_id):
+            if client_order_id == str(placed.pk):
+                return alpaca_order(**placed.order_params())
+            if client_order_id == str(missing.pk):
+                raise NotFound({"message": "order not found"})
+            if client_order_id == str(gone.pk):
+                # Not found without a JSON body
+                raise http_error(404, "Not Found", client_order_id)
+            raise requests.exceptions.ConnectionError("Connection reset")
+
+        self.api.get_order_by_client_order_id.side_effect = get_order_by_client_order_id
+
+        self.assertEqual(reconcile_intents(self.api, timezone.now() - timedelta(1)), 0)
+        self.assertEqual(reconcile_intents(self.api, timezone.now()), 3)
+
+        placed.refresh_from_db()
+        self.assertEqual(placed.status, OrderIntent.SUBMITTED)
+        self.assertIsNotNone(placed.order)
+        missing.refresh_from_db()
+        self.assertEqual(missing.status, OrderIntent.FAILED)
+        gone.refresh_from_db()
+        self.assertEqual(gone.status, OrderIntent.FAILED)
+        unknown.refresh_from_db()
+        self.assertEqual(unknown.status, OrderIntent.PENDING)
+        self.api.submit_order.assert_not_called()
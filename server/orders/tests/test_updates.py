@@ -0,0 +1,291 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+import websockets
+from alpaca_trade_api.stream import Stream
+from core.tests.factories import StrategyFactory
+from django.test import TestCase, TransactionTestCase
+from orders.ledger import intent_client_order_id
+from orders.models import Order, OrderIntent
+from orders.tests.factories import OrderFactory
+from orders.updates import TradeUpdateStream, apply_trade_updates
+
+
+def raw_order(order, **fields):
+    return {
+        "id": str(order.id),
+        "client_order_id": str(order.client_order_id),
+        "created_at": "2021-11-29T15:00:00Z",
+        "updated_at": "2021-11-29T15:00:01Z",
+        "submitted_at": "2021-11-29T15:00:00Z",
+        "symbol": order.asset_id.symbol,
+        "asset_id": str(order.asset_id.pk),
+        "qty": str(order.qty),
+        "notional": None,
+        "filled_qty": "0",
+        "filled_avg_price": None,
+        "order_class": "",
+        "type": Order.MARKET,
+        "side": Order.BUY,
+        "time_in_force": Order.DAY,
+        "status": Order.NEW,
+        "extended_hours": False,
+        **fields,
+    }
+
+
+def trade_update(event, order):
+    return {"event": event, "order": order}
+
+
+class ApplyTradeUpdatesTests(TestCase):
+    def setUp(self):
+        self.strategy = StrategyFactory()
+        self.order = OrderFactory(
+            user=self.strategy.user,
+            strategy=self.strategy,
+            asset_id=self.strategy.asset,
+            qty=10,
+            filled_qty=0,
+            status=Order.NEW,
+        )
+
+    def test_apply_trade_updates(self):
+        """Orders are updated with the latest event of each order."""
+        created, updated = apply_trade_updates(
+            [
+                trade_update(
+                    "partial_fill",
+                    raw_order(
+                        self.order,
+                        status=Order.PARTIALLY_FILLED,
+                        filled_qty="4",
+                        filled_avg_price="100",
+                    ),
+                ),
+                trade_update(
+                    "fill",
+                    raw_order(
+                        self.order,
+                        status=Order.FILLED,
+                        filled_qty="10",
+                        filled_avg_price="101.5",
+                        filled_at="2021-11-29T15:00:02Z",
+                    ),
+                ),
+            ]
+        )
+
+        self.assertEqual((created, updated), (0, 1))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.FILLED)
+        self.assertEqual(self.order.filled_qty, 10)
+        self.assertEqual(float(self.order.filled_avg_price), 101.5)
+        self.assertIsNotNone(self.order.filled_at)
+
+    def test_apply_trade_updates_replaced(self):
+        """Replacement orders are created for the owner of the order replaced."""
+        new_order = Order(
+            id=uuid.uuid4(), client_order_id=uuid.uuid4(), asset_id=self.order.asset_id
+        )
+
+        created, updated = apply_trade_updates(
+            [
+                trade_update(
+                    "replaced",
+                    raw_order(
+                        self.order, status=Order.REPLACED, replaced_by=str(new_order.id)
+                    ),
+                ),
+                trade_update(
+                    "new",
+                    raw_order(new_order, qty="5", replaces=str(self.order.id)),
+                ),
+            ]
+        )
+
+        self.assertEqual((created, updated), (1, 1))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.REPLACED)
+        self.assertEqual(self.order.replaced_by_id, new_order.id)
+        replacement = Order.objects.get(pk=new_order.id)
+        self.assertEqual(replacement.user, self.strategy.user)
+        self.assertEqual(replacement.strategy, self.strategy)
+        self.assertEqual(replacement.replaces, self.order)
+        self.assertEqual(replacement.qty, 5)
+
+    def test_apply_trade_updates_intents(self):
+        """Orders of pending intents are created, and unknown orders skipped."""
+        intent = OrderIntent.objects.create(
+            client_order_id=intent_client_order_id(self.strategy.pk, 1, Order.BUY),
+            user=self.strategy.user,
+            strategy=self.strategy,
+            asset=self.strategy.asset,
+            t=1,
+            side=Order.BUY,
+            type=Order.MARKET,
+            time_in_force=Order.DAY,
+            qty=5,
+        )
+        placed = Order(
+            id=uuid.uuid4(),
+            client_order_id=intent.client_order_id,
+            asset_id=self.order.asset_id,
+        )
+        unknown = Order(
+            id=uuid.uuid4(), client_order_id=uuid.uuid4(), asset_id=self.order.asset_id
+        )
+
+        created, updated = apply_trade_updates(
+            [
+                trade_update("new", raw_order(placed, qty="5")),
+                trade_update("new", raw_order(unknown, qty="5")),
+            ]
+        )
+
+        self.assertEqual((created, updated), (1, 0))
+        self.assertFalse(Order.objects.filter(pk=unknown.id).exists())
+        intent.refresh_from_db()
+        self.assertEqual(intent.status, OrderIntent.SUBMITTED)
+        self.assertEqual(intent.order_id, placed.id)
+
+
+class TradeUpdateServer:
+    """Local stand-in of the Alpaca trading stream, sending trade updates."""
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    async def handler(self, websocket, *args):
+        await websocket.recv()
+        await websocket.send(
+            json.dumps(
+                {
+                    "stream": "authorization",
+                    "data": {"status": "authorized", "action": "authenticate"},
+                }
+            )
+        )
+        await websocket.recv()
+        await websocket.send(
+            json.dumps({"stream": "listening", "data": {"streams": ["trade_updates"]}})
+        )
+        for update in self.updates:
+            await websocket.send(
+                json.dumps({"stream": "trade_updates", "data": update})
+            )
+        # Keep the client reading, so it notices when it is stopped
+        try:
+            while True:
+                await asyncio.sleep(0.05)
+                await websocket.send(json.dumps({"stream": "listening", "data": {}}))
+        except websockets.ConnectionClosed:
+            pass
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            websockets.serve(self.handler, "127.0.0.1", 0)
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def __enter__(self):
+        self.thread.start()
+        self.ready.wait(5)
+        return f"http://127.0.0.1:{self.port}"
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+class TradeUpdateStreamTests(TransactionTestCase):
+    def test_stream(self):
+        """Trade updates streamed over a websocket are applied in batches."""
+        strategy = StrategyFactory()
+        orders = [
+            OrderFactory(
+                user=strategy.user,
+                strategy=strategy,
+                asset_id=strategy.asset,
+                qty=10,
+                filled_qty=0,
+                status=Order.NEW,
+            )
+            for _ in range(3)
+        ]
+        updates = [
+            trade_update("fill", raw_order(order, status=Order.FILLED, filled_qty="10"))
+            for order in orders[:2]
+        ] + [trade_update("canceled", raw_order(orders[2], status=Order.CANCELED))]
+
+        with TradeUpdateServer(updates) as base_url:
+            stream = Stream("key", "secret", base_url=base_url, raw_data=True)
+            consumer = TradeUpdateStream(stream, batch_size=2, flush_interval=0.1)
+            loop = asyncio.new_event_loop()
+
+            def run():
+                # The stream runs on the thread's current event loop
+                asyncio.set_event_loop(loop)
+                consumer.run()
+
+            thread = threading.Thread(target=run)
+            thread.start()
+
+            deadline = time.monotonic() + 10
+            while consumer.applied < len(updates) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            # Stopping only signals the stream's thread safe queues
+            asyncio.run(stream.stop_ws())
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+            loop.close()
+
+        self.assertEqual(consumer.applied, 3)
+        self.assertEqual(
+            {str(order.pk): order.status for order in Order.objects.all()},
+            {
+                orders[0].pk: Order.FILLED,
+                orders[1].pk: Order.FILLED,
+                orders[2].pk: Order.CANCELED,
+            },
+        )
+
+    @patch("orders.updates.apply_trade_updates")
+    def test_flush_retries(self, mock_apply_trade_updates):
+        """Failed batches are retried, keeping events received since."""
+        consumer = TradeUpdateStream(MagicMock(), retry_backoff=0)
+        first = trade_update("new", {"id": "1", "status": Order.NEW})
+        second = trade_update("new", {"id": "2", "status": Order.NEW})
+        newer = trade_update("fill", {"id": "1", "status": Order.FILLED})
+
+        def apply_trade_updates(updates):
+            if mock_apply_trade_updates.call_count == 1:
+                # Received while the batch is written
+                consumer.pending["1"] = newer
+                raise Exception("Connection lost")
+
+        mock_apply_trade_updates.side_effect = apply_trade_updates
+        consumer.pending = {"1": first, "2": second}
+
+        asyncio.run(consumer.flush())
+
+        self.assertEqual(mock_apply_trade_updates.call_count, 2)
+        self.assertEqual(mock_apply_trade_updates.call_args[0][0], [newer, second])
+        self.assertEqual(consumer.applied, 2)
+        self.assertEqual(consumer.pending, {})
+        self.assertFalse(consumer.flushing)
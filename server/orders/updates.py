@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections, transaction
+
+from .models import Order, OrderIntent
+from .tasks import build_order
+
+logger = logging.getLogger(__name__)
+
+# Seconds before retrying a batch of trade updates which failed to be written,
+# doubled on each further failure up to the maximum
+RETRY_BACKOFF = 1
+MAX_RETRY_BACKOFF = 60
+
+# Fields of an order changed by trade updates, e.g. fills and cancels
+ORDER_STATE_FIELDS = [
+    "updated_at",
+    "submitted_at",
+    "filled_at",
+    "expired_at",
+    "canceled_at",
+    "failed_at",
+    "replaced_at",
+    "qty",
+    "notional",
+    "filled_qty",
+    "filled_avg_price",
+    "limit_price",
+    "stop_price",
+    "status",
+    "trail_percent",
+    "trail_price",
+    "hwm",
+]
+
+
+def is_uuid(value):
+    """Return true if a value is a UUID, e.g. a client order id set by us."""
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+def order_owner(raw, known, intents):
+    """
+    Return the owner of an order which is not stored yet, from the order it
+    replaces or its order intent, or None if the owner is unknown.
+
+    :param raw(dict): raw order
+    :param known(dict): stored orders, keyed by id
+    :param intents(dict): order intents, keyed by client order id
+    """
+    parent = known.get(str(raw.get("replaces")))
+    if parent is not None:
+        return {
+            "user_id": parent.user_id,
+            "strategy_id": parent.strategy_id,
+            "asset_id_id": parent.asset_id_id,
+        }
+    intent = intents.get(str(raw["client_order_id"]))
+    if intent is not None:
+        return {
+            "user_id": intent.user_id,
+            "strategy_id": intent.strategy_id,
+            "asset_id_id": intent.asset_id,
+        }
+    return None
+
+
+def create_orders(raw_orders, known, intents):
+    """
+    Create the orders which are not stored yet and whose owner is known, and
+    add them to `known`.
+
+    :param raw_orders(dict): raw orders, keyed by id
+    :param known(dict): stored orders, keyed by id
+    :param intents(dict): order intents, keyed by client order id
+    :returns: list of orders created
+    """
+    created = []
+    for order_id, raw in raw_orders.items():
+        if order_id in known:
+            continue
+        owner = order_owner(raw, known, intents)
+        if owner is None:
+            logger.info(f"Trade update for unknown order skipped: {order_id}")
+            continue
+        order = build_order(raw, **owner, replaced_by=None, replaces=None)
+        created.append(order)
+        known[order_id] = order
+    Order.objects.bulk_create(created, ignore_conflicts=True)
+    return created
+
+
+def update_orders(raw_orders, known):
+    """
+    Update stored orders with the state of their raw order.
+
+    :param raw_orders(dict): raw orders, keyed by id
+    :param known(dict): stored orders, keyed by id
+    :returns: list of orders updated
+    """
+    updated = []
+    for order_id, raw in raw_orders.items():
+        order = known.get(order_id)
+        if order is None:
+            continue
+        for field in ORDER_STATE_FIELDS:
+            setattr(order, field, raw.get(field))
+        # Only link orders which are stored
+        for field in ("replaces", "replaced_by"):
+            if str(raw.get(field)) in known:
+                setattr(order, f"{field}_id", raw[field])
+        updated.append(order)
+    Order.objects.bulk_update(updated, ORDER_STATE_FIELDS + ["replaces", "replaced_by"])
+    return updated
+
+
+def settle_lost_intents(raw_orders, known, intents):
+    """
+    Settle pending intents whose submission response was lost.
+
+    :param raw_orders(dict): raw orders, keyed by id
+    :param known(dict): stored orders, keyed by id
+    :param intents(dict): order intents, keyed by client order id
+    """
+    order_ids = {
+        str(raw["client_order_id"]): order_id for order_id, raw in raw_orders.items()
+    }
+    settled = []
+    for client_order_id, intent in intents.items():
+        order = known.get(order_ids[client_order_id])
+        if intent.status == OrderIntent.PENDING and order is not None:
+            intent.status = OrderIntent.SUBMITTED
+            intent.error = ""
+            intent.order = order
+            settled.append(intent)
+    OrderIntent.objects.bulk_update(settled, ["status", "error", "order"])
+
+
+def apply_trade_updates(updates):
+    """
+    Apply trade update events to orders in one transaction.
+
+    Known orders are updated with the state of the latest event, in one
+    query. Orders which are not stored yet, e.g. orders replacing a stored
+    order, or orders whose submission response was lost, are created when
+    their owner is known from the order they replace or their order intent.
+
+    :param updates(list): raw trade update events, each with an `event` and
+    the raw `order`, oldest to newest
+    :returns: tuple of the number of orders (created, updated)
+    """
+    raw_orders = {}
+    for update in updates:
+        raw_orders[str(update["order"]["id"])] = update["order"]
+    if not raw_orders:
+        return 0, 0
+
+    related_ids = {
+        str(raw[field])
+        for raw in raw_orders.values()
+        for field in ("replaces", "replaced_by")
+        if raw.get(field)
+    }
+    with transaction.atomic():
+        known = {
+            str(pk): order
+            for pk, order in Order.objects.in_bulk(
+                list(set(raw_orders) | related_ids)
+            ).items()
+        }
+        intents = {
+            str(intent.client_order_id): intent
+            for intent in OrderIntent.objects.filter(
+                client_order_id__in=[
+                    raw["client_order_id"]
+                    for raw in raw_orders.values()
+                    if is_uuid(raw["client_order_id"])
+                ]
+            )
+        }
+        created = create_orders(raw_orders, known, intents)
+        updated = update_orders(raw_orders, known)
+        settle_lost_intents(raw_orders, known, intents)
+
+    return len(created), len(updated) - len(created)
+
+
+class TradeUpdateStream:
+    """
+    Keep orders in sync with an Alpaca trading stream.
+
+    Trade updates are buffered as they arrive, keeping the latest event of
+    each order, and written in batches of up to `batch_size` orders, at least
+    every `flush_interval` seconds. Batches are written in a worker thread,
+    so the stream keeps being read while a batch is written. A batch which
+    fails to be written is buffered again, and retried with backoff.
+    """
+
+    def __init__(
+        self,
+        stream,
+        batch_size=100,
+        flush_interval=1.0,
+        retry_backoff=RETRY_BACKOFF,
+    ):
+        """
+        :param stream(Stream): Alpaca stream with raw data
+        :param batch_size(int): number of orders buffered before writing
+        :param flush_interval(float): maximum seconds an update is buffered
+        :param retry_backoff(float): seconds before retrying a failed batch,
+        doubled on each further failure
+        """
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.pending = {}
+        self.flushing = False
+        self.timer = None
+        self.applied = 0
+        # Single thread, so batches are written in the order received
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def on_trade_update(self, message):
+        # Older streams wrap each update in an entity, and raw messages are
+        # wrapped in the stream envelope
+        message = getattr(message, "_raw", message)
+        update = message.get("data", message)
+        if not update.get("order"):
+            return
+        self.pending[str(update["order"]["id"])] = update
+        if len(self.pending) >= self.batch_size:
+            self.schedule()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self.schedule
+            )
+
+    def schedule(self):
+        """Start writing the buffer, unless a batch is being written."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.flushing:
+            self.flushing = True
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Write buffered updates until the buffer is empty."""
+        loop = asyncio.get_running_loop()
+        backoff = self.retry_backoff
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, {}
+                try:
+                    await loop.run_in_executor(
+                        self.executor, apply_trade_updates, list(batch.values())
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Trade updates failed, retrying after seconds: {e}, {backoff}"
+                    )
+                    # Events received since the batch was taken are newer
+                    self.pending = {**batch, **self.pending}
+                    await loop.run_in_executor(self.executor, close_old_connections)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_RETRY_BACKOFF)
+                    continue
+                self.applied += len(batch)
+                backoff = self.retry_backoff
+        finally:
+            self.flushing = False
+
+    def close(self):
+        """Write any buffered updates, and close the worker's connection."""
+        batch, self.pending = list(self.pending.values()), {}
+        if batch:
+            self.executor.submit(apply_trade_updates, batch).result()
+        self.executor.submit(connections.close_all).result()
+        self.executor.shutdown()
+
+    def run(self):
+        """Subscribe to trade updates, and run the stream."""
+        self.stream.subscribe_trade_updates(self.on_trade_update)
+        try:
+            self.stream.run()
+        finally:
+            self.close()